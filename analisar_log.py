@@ -1,68 +1,182 @@
+import argparse
+import json
+import mmap
+import os
 import re
-import psycopg2
-import config
+from collections import Counter
+import conexoes
 
-def extrair_referencias_sem_marcas():
-    """Extrai as referências que não retornaram marcas do log"""
-    referencias = []
-    try:
-        with open('reprocessar_marcas.log', 'r') as arquivo:
-            for linha in arquivo:
-                if "WARNING - Nenhuma marca encontrada para a referência" in linha:
-                    # Extrai a referência e o tipo de veículo usando regex
-                    match = re.search(r"referência (.+?) do tipo (.+?)$", linha)
+# Logs dos scripts de extração analisados por padrão
+ARQUIVOS_LOG = ['marcas.log', 'reprocessar_marcas.log', 'crawler.log']
+
+# Posição em que a análise de cada log parou e falhas já encontradas
+ARQUIVO_ESTADO = 'analisar_log_estado.json'
+
+# Falhas de marcas: (texto procurado antes do regex, regex com referência e tipo de veículo)
+PADROES_MARCAS = [
+    (b"Nenhuma marca encontrada para a refer",
+     re.compile(r"Nenhuma marca encontrada para a referência (.+?) do tipo (\w+)")),
+    (b"Erro ao processar refer",
+     re.compile(r"Erro ao processar referência (.+?) do tipo (\w+):")),
+    (b"Erro ao obter marcas do site",
+     re.compile(r"Erro ao obter marcas do site para referência (.+?) e tipo (\w+):")),
+]
+
+# Falhas do crawler: o item da etapa começa com (referencia_id, codigo_referencia, tipo_veiculo, ...)
+PADROES_CRAWLER = [
+    (b"Erro na etapa",
+     re.compile(r"Erro na etapa (\w+) para \((\d+), \d+, '(\w+)'")),
+]
+
+def estado_vazio():
+    return {'arquivos': {}, 'falhas_marcas': {}, 'falhas_crawler': {}}
+
+def carregar_estado(caminho):
+    if not os.path.exists(caminho):
+        return estado_vazio()
+    with open(caminho, 'r', encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+def salvar_estado(caminho, estado):
+    with open(caminho + '.tmp', 'w', encoding='utf-8') as arquivo:
+        json.dump(estado, arquivo, ensure_ascii=False, indent=2)
+    os.replace(caminho + '.tmp', caminho)
+
+def linhas_com(mm, inicio, fim, marcadores):
+    """Retorna as linhas (em bytes) entre inicio e fim que contêm algum dos marcadores.
+
+    Em vez de percorrer linha a linha, procura diretamente cada marcador no arquivo
+    mapeado em memória; só as linhas encontradas são decodificadas e passam pelo regex.
+    """
+    inicios = set()
+    for marcador in marcadores:
+        posicao = mm.find(marcador, inicio, fim)
+        while posicao != -1:
+            inicio_linha = mm.rfind(b'\n', inicio, posicao) + 1
+            inicios.add(max(inicio_linha, inicio))
+            proxima = mm.find(b'\n', posicao, fim)
+            if proxima == -1:
+                break
+            posicao = mm.find(marcador, proxima, fim)
+    linhas = []
+    for inicio_linha in sorted(inicios):
+        fim_linha = mm.find(b'\n', inicio_linha, fim)
+        linhas.append(mm[inicio_linha:fim_linha if fim_linha != -1 else fim])
+    return linhas
+
+def analisar_arquivo(caminho, posicao_anterior):
+    """Analisa as linhas novas de um log a partir da posição salva.
+
+    Retorna (falhas de marcas, falhas do crawler, nova posição). Só linhas completas
+    são consideradas: uma linha ainda sendo escrita fica para a próxima análise.
+    Se o arquivo encolheu (foi truncado ou trocado), recomeça do início.
+    """
+    falhas_marcas = Counter()
+    falhas_crawler = Counter()
+    tamanho = os.path.getsize(caminho)
+    inicio = posicao_anterior if posicao_anterior <= tamanho else 0
+    if tamanho == inicio:
+        return falhas_marcas, falhas_crawler, inicio
+
+    with open(caminho, 'rb') as arquivo, mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        fim = mm.rfind(b'\n', inicio, tamanho) + 1
+        if fim <= inicio:
+            return falhas_marcas, falhas_crawler, inicio
+
+        for padroes, falhas in ((PADROES_MARCAS, falhas_marcas), (PADROES_CRAWLER, falhas_crawler)):
+            for linha in linhas_com(mm, inicio, fim, [marcador for marcador, _ in padroes]):
+                texto = linha.decode('utf-8', errors='replace')
+                for _, regex in padroes:
+                    match = regex.search(texto)
                     if match:
-                        referencia = match.group(1)
-                        tipo_veiculo = match.group(2)
-                        referencias.append((referencia, tipo_veiculo))
-        return referencias
-    except Exception as e:
-        print(f"Erro ao extrair referências: {e}")
-        return []
+                        falhas[match.groups()] += 1
+                        break
+    return falhas_marcas, falhas_crawler, fim
+
+def extrair_falhas(arquivos, estado):
+    """Acumula no estado as falhas das linhas novas de cada log; retorna o número de falhas novas"""
+    novas = 0
+    for caminho in arquivos:
+        if not os.path.exists(caminho):
+            continue
+        anterior = estado['arquivos'].get(caminho, {})
+        inode = os.stat(caminho).st_ino
+        posicao = anterior.get('posicao', 0) if anterior.get('inode') == inode else 0
+
+        falhas_marcas, falhas_crawler, posicao_final = analisar_arquivo(caminho, posicao)
+        for (referencia, tipo_veiculo), total in falhas_marcas.items():
+            chave = f"{referencia}|{tipo_veiculo}"
+            estado['falhas_marcas'][chave] = estado['falhas_marcas'].get(chave, 0) + total
+        for (etapa, referencia_id, tipo_veiculo), total in falhas_crawler.items():
+            chave = f"{referencia_id}|{tipo_veiculo}|{etapa}"
+            estado['falhas_crawler'][chave] = estado['falhas_crawler'].get(chave, 0) + total
+
+        encontradas = sum(falhas_marcas.values()) + sum(falhas_crawler.values())
+        novas += encontradas
+        print(f"{caminho}: {posicao_final - posicao} bytes novos analisados, {encontradas} falhas")
+        estado['arquivos'][caminho] = {'inode': inode, 'posicao': posicao_final}
+    return novas
+
+def get_referencias_ids(cur, referencias, referencia_ids):
+    """Obtém em uma única consulta {mes_ano: id} e {id: mes_ano} das referências informadas"""
+    cur.execute(
+        "SELECT id, mes_ano FROM referencias WHERE mes_ano = ANY(%s) OR id = ANY(%s)",
+        (list(referencias), list(referencia_ids))
+    )
+    linhas = cur.fetchall()
+    return {mes_ano: ref_id for ref_id, mes_ano in linhas}, {ref_id: mes_ano for ref_id, mes_ano in linhas}
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(description="Agrega as falhas registradas nos logs dos scripts de extração")
+    parser.add_argument('--logs', nargs='*', default=ARQUIVOS_LOG, help="Arquivos de log analisados")
+    parser.add_argument('--reiniciar', action='store_true', help="Descarta o estado salvo e analisa os logs desde o início")
+    parser.add_argument('--saida', default='referencias_sem_marcas.txt', help="Arquivo com as referências sem marcas")
+    return parser.parse_args()
+
+def main():
+    args = parse_argumentos()
+    estado = estado_vazio() if args.reiniciar else carregar_estado(ARQUIVO_ESTADO)
+
+    # Analisa só o que foi escrito nos logs desde a última execução
+    novas = extrair_falhas(args.logs, estado)
+    print(f"{novas} novas falhas nos logs")
+
+    falhas_marcas = [chave.split('|') for chave in estado['falhas_marcas']]
+    falhas_crawler = [chave.split('|') for chave in estado['falhas_crawler']]
+    print(f"Encontradas {len(falhas_marcas)} referências sem marcas e {len(falhas_crawler)} falhas do crawler nos logs")
 
-def get_referencias_ids(referencias):
-    """Obtém os IDs das referências no banco de dados"""
     try:
-        conn = psycopg2.connect(**config.DB_CONFIG)
-        cur = conn.cursor()
-        
-        referencias_com_ids = []
-        for referencia, tipo_veiculo in referencias:
-            # Extrai mês e ano da referência
-            mes, ano = referencia.split('/')
-            
-            # Busca o ID da referência
-            cur.execute("""
-                SELECT id FROM referencias 
-                WHERE mes = %s AND ano = %s
-            """, (mes, ano))
-            
-            resultado = cur.fetchone()
-            if resultado:
-                referencias_com_ids.append((resultado[0], referencia, tipo_veiculo))
-        
-        cur.close()
-        conn.close()
-        return referencias_com_ids
+        with conexoes.conexao() as conn, conn.cursor() as cur:
+            ids, nomes = get_referencias_ids(
+                cur,
+                {referencia for referencia, _ in falhas_marcas},
+                {int(referencia_id) for referencia_id, _, _ in falhas_crawler}
+            )
     except Exception as e:
         print(f"Erro ao obter IDs das referências: {e}")
-        return []
+        return
+    finally:
+        conexoes.encerrar()
 
-def main():
-    # Extrai as referências que não retornaram marcas
-    referencias = extrair_referencias_sem_marcas()
-    print(f"Encontradas {len(referencias)} referências sem marcas no log")
-    
-    # Obtém os IDs das referências
-    referencias_com_ids = get_referencias_ids(referencias)
+    referencias_com_ids = sorted(
+        (ids[referencia], referencia, tipo_veiculo)
+        for referencia, tipo_veiculo in falhas_marcas if referencia in ids
+    )
     print(f"Encontrados {len(referencias_com_ids)} IDs de referências no banco")
-    
+
+    # Resumo das falhas do crawler por referência, tipo de veículo e etapa
+    for chave, total in sorted(estado['falhas_crawler'].items(), key=lambda item: -item[1]):
+        referencia_id, tipo_veiculo, etapa = chave.split('|')
+        referencia = nomes.get(int(referencia_id), f"id {referencia_id}")
+        print(f"Crawler: {referencia} {tipo_veiculo} etapa {etapa}: {total} falhas")
+
     # Salva as referências em um arquivo
-    with open('referencias_sem_marcas.txt', 'w') as arquivo:
+    with open(args.saida, 'w') as arquivo:
         for ref_id, referencia, tipo_veiculo in referencias_com_ids:
             arquivo.write(f"{ref_id},{referencia},{tipo_veiculo}\n")
-    
-    print("Arquivo 'referencias_sem_marcas.txt' criado com sucesso!")
+    salvar_estado(ARQUIVO_ESTADO, estado)
+
+    print(f"Arquivo '{args.saida}' criado com sucesso!")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
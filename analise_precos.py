@@ -0,0 +1,382 @@
+import argparse
+import logging
+import struct
+import time
+import numpy as np
+from psycopg2.extras import execute_values
+import conexoes
+
+# ano_modelo usado pela FIPE para os veículos zero km
+ANO_ZERO_KM = 32000
+
+# Tipos de veículo, na ordem dos índices usados nas matrizes
+TIPOS_VEICULOS = ['carro', 'moto', 'caminhao']
+
+# Linhas codificadas por vez na gravação em COPY binário
+LINHAS_POR_BLOCO = 500000
+
+# Bytes do COPY dos preços acumulados antes de cada conversão
+BYTES_POR_BLOCO = 8 * 1024 ** 2
+
+# Cabeçalho (assinatura, flags e tamanho da extensão) e fim do COPY binário
+CABECALHO_COPY = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+FIM_COPY = struct.pack('>h', -1)
+
+# Veículos (modelo da dimensão + ano) com preço, na mesma ordem do dense_rank da consulta dos preços
+CONSULTA_VEICULOS = """
+    SELECT dim_modelo_id, ano, MIN(ano_modelo), MIN(tipo_veiculo) FROM mv_precos
+    WHERE valor_numerico IS NOT NULL AND (%(tipos)s::text[] IS NULL OR tipo_veiculo = ANY(%(tipos)s))
+    GROUP BY dim_modelo_id, ano
+    ORDER BY dim_modelo_id, ano
+"""
+
+# Preços em COPY binário: três campos não nulos de tamanho fixo, então toda linha tem FORMATO_PRECOS
+CONSULTA_PRECOS = """
+    COPY (
+        SELECT (dense_rank() OVER (ORDER BY dim_modelo_id, ano) - 1)::int4, referencia_id::int4, valor_numerico::float8
+        FROM mv_precos
+        WHERE valor_numerico IS NOT NULL AND (%(tipos)s::text[] IS NULL OR tipo_veiculo = ANY(%(tipos)s))
+    ) TO STDOUT WITH (FORMAT binary)
+"""
+
+# Linha do COPY binário dos preços: número de campos e (comprimento, valor) de cada um, em big-endian
+FORMATO_PRECOS = np.dtype([
+    ('campos', '>i2'), ('comprimento_veiculo', '>i4'), ('veiculo', '>i4'),
+    ('comprimento_referencia', '>i4'), ('referencia', '>i4'), ('comprimento_preco', '>i4'), ('preco', '>f8')
+])
+
+class HistoricoPrecos:
+    """Preços de todos os veículos em todos os meses, em matrizes NumPy contíguas.
+
+    precos[i, j] é o preço do veículo i no mês j (float64) e presente[i, j] indica
+    se há preço naquele mês. As colunas cobrem todos os meses entre a primeira e
+    a última referência, então a coluna j - 12 é sempre o mesmo mês do ano
+    anterior; meses sem referência ficam com a coluna inteira ausente.
+    """
+
+    def __init__(self, meses, referencia_ids, ano_modelo, tipos, precos, presente, dim_modelo_ids=None, anos=None):
+        self.meses = meses
+        self.referencia_ids = referencia_ids
+        self.ano_modelo = ano_modelo
+        self.tipos = tipos
+        self.precos = precos
+        self.presente = presente
+        self.dim_modelo_ids = dim_modelo_ids
+        self.anos = anos
+
+    @property
+    def forma(self):
+        return self.precos.shape
+
+class LeitorPrecos:
+    """Destino do COPY TO STDOUT binário: converte as linhas (veículo, referência, preço) direto para as matrizes.
+
+    Os dados recebidos são acumulados em blocos de BYTES_POR_BLOCO, e cada bloco
+    é lido de uma vez com np.frombuffer como um array de FORMATO_PRECOS, sem
+    criar objetos Python por linha; só a linha incompleta do fim fica para o seguinte.
+    """
+
+    def __init__(self, precos, presente, colunas):
+        self.precos = precos
+        self.presente = presente
+        self.colunas = colunas
+        self.partes = []
+        self.tamanho = 0
+        self.resto = b''
+        self.cabecalho_lido = False
+        self.linhas = 0
+
+    def write(self, dados):
+        self.partes.append(dados)
+        self.tamanho += len(dados)
+        if self.tamanho >= BYTES_POR_BLOCO:
+            self._converter()
+
+    def _converter(self):
+        dados = b''.join([self.resto] + self.partes)
+        self.partes, self.tamanho = [], 0
+        inicio = 0
+        if not self.cabecalho_lido:
+            if len(dados) < len(CABECALHO_COPY):
+                self.resto = dados
+                return
+            if not dados.startswith(CABECALHO_COPY[:11]):
+                raise ValueError("Cabeçalho do COPY binário inválido")
+            # Depois das flags vem o tamanho da área de extensão, que é ignorada
+            inicio = len(CABECALHO_COPY) + struct.unpack_from('>i', dados, len(CABECALHO_COPY) - 4)[0]
+            if len(dados) < inicio:
+                self.resto = dados
+                return
+            self.cabecalho_lido = True
+
+        quantidade = (len(dados) - inicio) // FORMATO_PRECOS.itemsize
+        self.resto = dados[inicio + quantidade * FORMATO_PRECOS.itemsize:]
+        tuplas = np.frombuffer(dados, dtype=FORMATO_PRECOS, count=quantidade, offset=inicio)
+        if ((tuplas['campos'] != 3).any() or (tuplas['comprimento_veiculo'] != 4).any()
+                or (tuplas['comprimento_referencia'] != 4).any() or (tuplas['comprimento_preco'] != 8).any()):
+            raise ValueError("Linha inesperada no COPY binário dos preços")
+        linhas = tuplas['veiculo'].astype(np.int64)
+        colunas = self.colunas[tuplas['referencia'].astype(np.int64)]
+        self.precos[linhas, colunas] = tuplas['preco']
+        self.presente[linhas, colunas] = True
+        self.linhas += quantidade
+
+    def concluir(self):
+        self._converter()
+        if self.resto != FIM_COPY:
+            raise ValueError("COPY binário dos preços incompleto")
+        self.resto = b''
+
+def indice_mes(data):
+    return data.year * 12 + data.month - 1
+
+def carregar(conn, tipos_veiculos=None):
+    """Carrega os preços de mv_precos em um HistoricoPrecos (uma consulta dos veículos e um COPY dos preços)"""
+    parametros = {'tipos': tipos_veiculos or None}
+    with conn.cursor() as cur:
+        # As duas consultas precisam ver a mesma versão da view
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cur.execute("SELECT id, data FROM referencias ORDER BY data")
+        referencias = cur.fetchall()
+        cur.execute(CONSULTA_VEICULOS, parametros)
+        veiculos = cur.fetchall()
+        if not referencias or not veiculos:
+            conn.commit()
+            return None
+
+        primeiro = indice_mes(referencias[0][1])
+        meses = np.arange(primeiro, indice_mes(referencias[-1][1]) + 1, dtype=np.int32)
+        referencia_ids = np.zeros(len(meses), dtype=np.int32)
+        colunas = np.full(max(referencia_id for referencia_id, _ in referencias) + 1, -1, dtype=np.int64)
+        for referencia_id, data in referencias:
+            colunas[referencia_id] = indice_mes(data) - primeiro
+            referencia_ids[colunas[referencia_id]] = referencia_id
+
+        precos = np.zeros((len(veiculos), len(meses)), dtype=np.float64)
+        presente = np.zeros((len(veiculos), len(meses)), dtype=bool)
+        leitor = LeitorPrecos(precos, presente, colunas)
+        cur.copy_expert(cur.mogrify(CONSULTA_PRECOS, parametros).decode('utf-8'), leitor)
+        leitor.concluir()
+    conn.commit()
+
+    indices_tipos = {tipo: indice for indice, tipo in enumerate(TIPOS_VEICULOS)}
+    return HistoricoPrecos(
+        meses, referencia_ids,
+        np.array([ano_modelo or 0 for _, _, ano_modelo, _ in veiculos], dtype=np.int32),
+        np.array([indices_tipos[tipo] for _, _, _, tipo in veiculos], dtype=np.int8),
+        precos, presente,
+        np.array([dim_modelo_id for dim_modelo_id, _, _, _ in veiculos], dtype=np.int32),
+        [ano for _, ano, _, _ in veiculos]
+    )
+
+# Cálculos, todos sobre as matrizes inteiras (sem laços por veículo ou por mês)
+
+def variacao(precos, presente, defasagem):
+    """Variação do preço em relação a `defasagem` meses antes; retorna (variações, válidas)"""
+    variacoes = np.zeros(precos.shape, dtype=np.float64)
+    validas = np.zeros(precos.shape, dtype=bool)
+    if defasagem >= precos.shape[1]:
+        return variacoes, validas
+    validas[:, defasagem:] = presente[:, defasagem:] & presente[:, :-defasagem]
+    np.divide(precos[:, defasagem:], precos[:, :-defasagem], out=variacoes[:, defasagem:], where=validas[:, defasagem:])
+    variacoes[:, defasagem:] -= 1
+    variacoes[~validas] = 0
+    return variacoes, validas
+
+def media_movel(precos, presente, janela):
+    """Média dos preços existentes nos últimos `janela` meses (inclusive o atual), por somas acumuladas"""
+    somas = np.zeros((precos.shape[0], precos.shape[1] + 1), dtype=np.float64)
+    np.cumsum(precos, axis=1, out=somas[:, 1:])
+    contagens = np.zeros(somas.shape, dtype=np.int32)
+    np.cumsum(presente, axis=1, dtype=np.int32, out=contagens[:, 1:])
+    # Coluna j: soma acumulada até j menos a soma acumulada antes do início da janela
+    inicios = np.maximum(np.arange(precos.shape[1]) - janela + 1, 0)
+    somas_janela = somas[:, 1:] - somas[:, inicios]
+    contagens_janela = contagens[:, 1:] - contagens[:, inicios]
+    medias = np.zeros(precos.shape, dtype=np.float64)
+    np.divide(somas_janela, contagens_janela, out=medias, where=presente)
+    return medias
+
+def idades(historico):
+    """Idade (anos) de cada veículo em cada mês: ano do mês menos o ano do modelo (zero km = 0)"""
+    resultado = (historico.meses // 12)[None, :] - historico.ano_modelo[:, None]
+    resultado[historico.ano_modelo == ANO_ZERO_KM] = 0
+    return np.clip(resultado, 0, np.iinfo(np.int16).max).astype(np.int16)
+
+def curva_depreciacao(historico, idade, variacoes_anuais, validas):
+    """Variação anual mediana e média do preço por (tipo de veículo, idade), com o valor residual acumulado.
+
+    Retorna uma lista de (tipo_veiculo, idade, mediana, média, valor residual, quantidade).
+    As variações são agrupadas por uma ordenação estável das chaves (inteiros
+    pequenos, ordenados por radix sort); a mediana é calculada em cada grupo, um
+    laço pelos grupos (tipo × idade), não pelas linhas.
+    """
+    if not validas.any():
+        return []
+    idade_maxima = int(idade.max()) + 1
+    chaves = (historico.tipos.astype(np.int32)[:, None] * idade_maxima + idade)[validas]
+    if chaves.max() <= np.iinfo(np.int16).max:
+        chaves = chaves.astype(np.int16)
+    ordem = np.argsort(chaves, kind='stable')
+    chaves, valores = chaves[ordem], variacoes_anuais[validas][ordem]
+    grupos, inicios, quantidades = np.unique(chaves, return_index=True, return_counts=True)
+    medianas = [float(np.median(valores[inicio:inicio + quantidade])) for inicio, quantidade in zip(inicios, quantidades)]
+    medias = np.add.reduceat(valores, inicios) / quantidades
+
+    curva = []
+    residuais = {}
+    for grupo, mediana, media, quantidade in zip(grupos.tolist(), medianas, medias.tolist(), quantidades.tolist()):
+        tipo, idade_grupo = divmod(grupo, idade_maxima)
+        # Valor residual: fração do preço do veículo novo que resta na idade, pelas medianas das idades anteriores
+        residuais[tipo] = residuais.get(tipo, 1.0) * (1 + mediana)
+        curva.append((TIPOS_VEICULOS[tipo], idade_grupo, mediana, media, residuais[tipo], quantidade))
+    return curva
+
+def calcular(historico, janela=12):
+    """Calcula todas as métricas; retorna um dicionário de matrizes (veículo × mês) e a curva de depreciação"""
+    resultado = {}
+    inicio = time.perf_counter()
+    resultado['variacao_mensal'], resultado['mensal_valida'] = variacao(historico.precos, historico.presente, 1)
+    resultado['variacao_anual'], resultado['anual_valida'] = variacao(historico.precos, historico.presente, 12)
+    resultado['media_movel'] = media_movel(historico.precos, historico.presente, janela)
+    resultado['idade'] = idades(historico)
+    resultado['depreciacao'] = curva_depreciacao(
+        historico, resultado['idade'], resultado['variacao_anual'], resultado['anual_valida']
+    )
+    logging.info(f"Métricas de {historico.forma[0]} veículos em {historico.forma[1]} meses calculadas em {time.perf_counter() - inicio:.1f}s")
+    return resultado
+
+# Gravação em COPY binário, montado também com operações sobre os vetores
+
+FORMATOS_BINARIOS = {'int2': np.dtype('>i2'), 'int4': np.dtype('>i4'), 'float8': np.dtype('>f8')}
+
+def codificar_tuplas(colunas):
+    """Tuplas do COPY binário de colunas [(valores, tipo, válidos ou None)] com o mesmo número de linhas.
+
+    As linhas são montadas em um array estruturado big-endian com todos os
+    campos; depois uma única máscara de bytes retira os valores dos campos NULL
+    (que no formato binário ficam só com o comprimento -1).
+    """
+    linhas = len(colunas[0][0])
+    campos = [('campos', '>i2')]
+    for indice, (_, tipo, _) in enumerate(colunas):
+        campos += [(f'comprimento{indice}', '>i4'), (f'valor{indice}', FORMATOS_BINARIOS[tipo])]
+    formato = np.dtype(campos)
+    tuplas = np.empty(linhas, dtype=formato)
+    tuplas['campos'] = len(colunas)
+    manter = None
+    for indice, (valores, tipo, validos) in enumerate(colunas):
+        tamanho = FORMATOS_BINARIOS[tipo].itemsize
+        tuplas[f'valor{indice}'] = valores
+        tuplas[f'comprimento{indice}'] = tamanho
+        if validos is not None and not validos.all():
+            tuplas[f'comprimento{indice}'][~validos] = -1
+            if manter is None:
+                manter = np.ones((linhas, formato.itemsize), dtype=bool)
+            deslocamento = formato.fields[f'valor{indice}'][1]
+            manter[~validos, deslocamento:deslocamento + tamanho] = False
+    dados = tuplas.view(np.uint8).reshape(linhas, formato.itemsize)
+    return dados[manter] if manter is not None else dados.reshape(-1)
+
+class FluxoCopy:
+    """Arquivo somente leitura para o COPY FROM STDIN: entrega os blocos gerados sob demanda"""
+
+    def __init__(self, blocos):
+        self.blocos = iter(blocos)
+        self.atual = memoryview(b'')
+        self.bytes = 0
+
+    def read(self, tamanho=-1):
+        while not len(self.atual):
+            bloco = next(self.blocos, None)
+            if bloco is None:
+                return b''
+            self.atual = memoryview(bloco).cast('B')
+        tamanho = len(self.atual) if tamanho is None or tamanho < 0 else tamanho
+        parte, self.atual = self.atual[:tamanho], self.atual[tamanho:]
+        self.bytes += len(parte)
+        return parte.tobytes()
+
+def blocos_variacoes(historico, resultado, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """Blocos do COPY binário de analise_variacoes: uma linha por veículo e mês com preço"""
+    veiculos, colunas = np.nonzero(historico.presente)
+    yield CABECALHO_COPY
+    for inicio in range(0, len(veiculos), linhas_por_bloco):
+        v = veiculos[inicio:inicio + linhas_por_bloco]
+        c = colunas[inicio:inicio + linhas_por_bloco]
+        yield codificar_tuplas([
+            (v, 'int4', None),
+            (historico.referencia_ids[c], 'int4', None),
+            (resultado['idade'][v, c], 'int2', None),
+            (resultado['variacao_mensal'][v, c], 'float8', resultado['mensal_valida'][v, c]),
+            (resultado['variacao_anual'][v, c], 'float8', resultado['anual_valida'][v, c]),
+            (resultado['media_movel'][v, c], 'float8', None),
+        ])
+    yield FIM_COPY
+
+def gravar(conn, historico, resultado):
+    """Substitui as tabelas de análise pelos resultados (veículos, variações em COPY binário e depreciação)"""
+    inicio = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE analise_veiculos, analise_variacoes, analise_depreciacao")
+        execute_values(cur, "INSERT INTO analise_veiculos (id, dim_modelo_id, ano, ano_modelo) VALUES %s", [
+            (indice, dim_modelo_id, ano, ano_modelo)
+            for indice, (dim_modelo_id, ano, ano_modelo) in enumerate(zip(
+                historico.dim_modelo_ids.tolist(), historico.anos, historico.ano_modelo.tolist()
+            ))
+        ], page_size=10000)
+        fluxo = FluxoCopy(blocos_variacoes(historico, resultado))
+        cur.copy_expert("""
+            COPY analise_variacoes (veiculo_id, referencia_id, idade, variacao_mensal, variacao_anual, media_movel)
+            FROM STDIN WITH (FORMAT binary)
+        """, fluxo)
+        linhas = cur.rowcount
+        execute_values(cur, """
+            INSERT INTO analise_depreciacao
+                (tipo_veiculo, idade, variacao_anual_mediana, variacao_anual_media, valor_residual, quantidade)
+            VALUES %s
+        """, resultado['depreciacao'])
+    conn.commit()
+    logging.info(
+        f"{linhas} variações ({fluxo.bytes / 1024 ** 2:.1f} MB) e {len(resultado['depreciacao'])} pontos "
+        f"da curva de depreciação gravados em {time.perf_counter() - inicio:.1f}s"
+    )
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(
+        description="Calcula a variação mensal e anual, a média móvel e a depreciação por idade dos preços"
+    )
+    parser.add_argument('--tipos', nargs='*', choices=TIPOS_VEICULOS, help="Tipos de veículo; padrão: todos")
+    parser.add_argument('--janela', type=int, default=12, help="Meses da média móvel")
+    return parser.parse_args()
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('analise_precos.log'),
+            logging.StreamHandler()
+        ]
+    )
+    args = parse_argumentos()
+    try:
+        with conexoes.conexao() as conn:
+            inicio = time.perf_counter()
+            historico = carregar(conn, args.tipos)
+            if historico is None:
+                logging.info("Não há preços para analisar")
+                return
+            logging.info(
+                f"{int(historico.presente.sum())} preços de {historico.forma[0]} veículos em "
+                f"{historico.forma[1]} meses carregados em {time.perf_counter() - inicio:.1f}s"
+            )
+            resultado = calcular(historico, args.janela)
+            gravar(conn, historico, resultado)
+    except Exception as e:
+        logging.error(f"Erro durante a análise: {e}")
+    finally:
+        conexoes.encerrar()
+
+if __name__ == "__main__":
+    main()
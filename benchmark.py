@@ -0,0 +1,254 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import conexoes
+import replica_fipe
+
+# Configuração do logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('benchmark.log'),
+        logging.StreamHandler()
+    ]
+)
+
+DIRETORIO_PROJETO = os.path.dirname(os.path.abspath(__file__))
+
+# Scripts medidos, na ordem em que são executados
+SCRIPTS = ['gerenciar_referencias', 'gerenciar_marcas', 'reprocessar_marcas']
+
+# Histogramas das métricas cujos percentis entram no relatório
+METRICAS_PASSOS = ('fipe_etapa_segundos', 'fipe_requisicao_segundos', 'fipe_banco_segundos', 'fipe_espera_segundos')
+
+def versao_codigo():
+    """Commit atual do repositório e se há alterações não commitadas"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIRETORIO_PROJETO,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        alteracoes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=DIRETORIO_PROJETO,
+                                    capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(alteracoes)
+    except Exception:
+        return None, False
+
+def conectar_servidor():
+    """Conexão ao banco de manutenção do servidor configurado, para criar e remover o banco descartável"""
+    return conexoes.conectar(autocommit=True, dbname='postgres')
+
+def criar_banco(nome):
+    conn = conectar_servidor()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{nome}"')
+            cur.execute(f'CREATE DATABASE "{nome}"')
+    finally:
+        conn.close()
+
+def remover_banco(nome):
+    conn = conectar_servidor()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{nome}"')
+    finally:
+        conn.close()
+
+def executar_script(script, argumentos, ambiente, diretorio):
+    """Executa um script do projeto e retorna (código de saída, duração, pico de memória em MB).
+
+    O pico de memória é o maior RSS do processo (e dos processos filhos que ele aguardou),
+    obtido do kernel pelo wait4 ao final da execução.
+    """
+    comando = [sys.executable, os.path.join(DIRETORIO_PROJETO, f"{script}.py")] + argumentos
+    inicio = time.perf_counter()
+    with open(os.path.join(diretorio, f"{script}.saida"), 'w') as saida:
+        processo = subprocess.Popen(comando, cwd=diretorio, env=ambiente, stdout=saida, stderr=subprocess.STDOUT)
+        _, status, uso = os.wait4(processo.pid, 0)
+    duracao = time.perf_counter() - inicio
+    processo.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    pico = uso.ru_maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    return processo.returncode, duracao, pico
+
+def somar_contadores(contadores, metrica):
+    return sum(valor for chave, valor in contadores.items() if chave.split('{')[0] == metrica)
+
+def resumir_execucao(arquivo_metricas, codigo, duracao, pico_memoria):
+    """Resultado de um script: throughput, erros, pico de memória e p50/p99 de cada passo"""
+    resultado = {
+        'codigo_saida': codigo,
+        'duracao_segundos': round(duracao, 3),
+        'pico_memoria_mb': round(pico_memoria, 1)
+    }
+    if not os.path.exists(arquivo_metricas):
+        return resultado
+    with open(arquivo_metricas, 'r', encoding='utf-8') as arquivo:
+        metricas = json.load(arquivo)
+
+    contadores = metricas['contadores']
+    itens = somar_contadores(contadores, 'fipe_itens_total')
+    linhas = somar_contadores(contadores, 'fipe_linhas_gravadas_total')
+    resultado.update({
+        'itens': itens,
+        'linhas_gravadas': linhas,
+        'erros': somar_contadores(contadores, 'fipe_erros_total'),
+        'itens_por_segundo': round(itens / duracao, 2) if duracao else 0,
+        'linhas_por_segundo': round(linhas / duracao, 2) if duracao else 0,
+        'passos': {
+            chave: {'total': h['total'], 'p50': h['p50'], 'p99': h['p99'], 'soma_segundos': h['soma_segundos']}
+            for chave, h in metricas['histogramas'].items() if chave.split('{')[0] in METRICAS_PASSOS
+        }
+    })
+    return resultado
+
+def medir(args):
+    """Sobe a réplica e o banco descartável, executa os scripts e retorna o resultado da rodada"""
+    servidor = replica_fipe.iniciar(
+        replica_fipe.criar_dados(args), 0, args.latencia, args.variacao,
+        args.taxa_erros, args.taxa_vazias, args.semente
+    )
+    url = f"http://127.0.0.1:{servidor.server_address[1]}"
+    banco = f"fipe_benchmark_{os.getpid()}"
+    diretorio = tempfile.mkdtemp(prefix='fipe_benchmark_')
+    logging.info(f"Réplica em {url}, banco {banco}, arquivos em {diretorio}")
+
+    # Cada script usa a réplica e o banco descartável; o cache de respostas fica desligado
+    ambiente = dict(os.environ, DB_NAME=banco, FIPE_URL=url, SELENIUM_URL=url,
+                    CACHE_ARQUIVO='', METRICAS_PORTA='0', METRICAS_JSON='')
+    if args.taxa:
+        ambiente.update(LIMITADOR_TAXA_INICIAL=str(args.taxa), LIMITADOR_TAXA_MAXIMA=str(args.taxa))
+
+    resultados = {}
+    try:
+        criar_banco(banco)
+        codigo, _, _ = executar_script('setup_database', [], ambiente, diretorio)
+        if codigo != 0:
+            raise RuntimeError(f"setup_database terminou com código {codigo}")
+
+        for script in SCRIPTS:
+            arquivo_metricas = os.path.join(diretorio, f"{script}.json")
+            argumentos = ['--engine', args.engine, '--metricas-json', arquivo_metricas]
+            if script == 'gerenciar_marcas':
+                argumentos += ['--workers', str(args.workers)]
+            codigo, duracao, pico = executar_script(script, argumentos, ambiente, diretorio)
+            resultados[script] = resumir_execucao(arquivo_metricas, codigo, duracao, pico)
+            logging.info(
+                f"{script}: {duracao:.1f}s, {resultados[script].get('itens_por_segundo', 0)} itens/s, "
+                f"pico de memória {pico:.1f} MB, código de saída {codigo}"
+            )
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+        if not args.manter:
+            remover_banco(banco)
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+    commit, alterado = versao_codigo()
+    return {
+        'commit': commit,
+        'alterado': alterado,
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'parametros': parametros(args),
+        'replica': dict(replica_fipe.ReplicaFipeHandler.contadores),
+        'scripts': resultados
+    }
+
+def parametros(args):
+    """Parâmetros que precisam coincidir para duas rodadas serem comparáveis"""
+    return {
+        'engine': args.engine, 'workers': args.workers, 'taxa': args.taxa,
+        'referencias': args.referencias, 'marcas': args.marcas, 'modelos': args.modelos, 'anos': args.anos,
+        'latencia': args.latencia, 'variacao': args.variacao, 'taxa_erros': args.taxa_erros,
+        'taxa_vazias': args.taxa_vazias, 'semente': args.semente
+    }
+
+def carregar_resultados(caminho):
+    if not os.path.exists(caminho):
+        return []
+    with open(caminho, 'r', encoding='utf-8') as arquivo:
+        return [json.loads(linha) for linha in arquivo if linha.strip()]
+
+def salvar_resultado(caminho, resultado):
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    with open(caminho, 'a', encoding='utf-8') as arquivo:
+        arquivo.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+
+def escolher_base(resultados, atual, commit=None):
+    """Rodada anterior com os mesmos parâmetros (do commit informado, se houver)"""
+    for resultado in reversed(resultados):
+        if resultado['parametros'] != atual['parametros']:
+            continue
+        if commit is None or (resultado['commit'] or '').startswith(commit):
+            return resultado
+    return None
+
+def variacao(atual, anterior):
+    if not anterior:
+        return ''
+    return f" ({(atual - anterior) / anterior * 100:+.1f}%)"
+
+def imprimir_relatorio(atual, base=None):
+    """Relatório da rodada e, se houver base, a variação de cada número em relação a ela"""
+    marcador = '+' if atual['alterado'] else ''
+    print(f"Commit {atual['commit']}{marcador} em {atual['data']}")
+    if base:
+        print(f"Comparado com o commit {base['commit']}{'+' if base['alterado'] else ''} em {base['data']}")
+    replica = atual['replica']
+    print(f"Réplica: {replica['requisicoes']} requisições, {replica['erros']} erros 500, {replica['vazias']} listas vazias")
+
+    for script, resultado in atual['scripts'].items():
+        anterior = (base or {}).get('scripts', {}).get(script, {})
+        print(f"\n{script} (código de saída {resultado['codigo_saida']})")
+        for campo, rotulo in (('duracao_segundos', 'duração (s)'), ('itens_por_segundo', 'itens/s'),
+                              ('linhas_por_segundo', 'linhas gravadas/s'), ('erros', 'erros'),
+                              ('pico_memoria_mb', 'pico de memória (MB)')):
+            if campo in resultado:
+                print(f"  {rotulo}: {resultado[campo]}{variacao(resultado[campo], anterior.get(campo))}")
+        passos_anteriores = anterior.get('passos', {})
+        for chave, passo in sorted(resultado.get('passos', {}).items()):
+            antes = passos_anteriores.get(chave, {})
+            print(
+                f"  {chave}: n={passo['total']} p50={passo['p50'] * 1000:.1f}ms{variacao(passo['p50'], antes.get('p50'))} "
+                f"p99={passo['p99'] * 1000:.1f}ms{variacao(passo['p99'], antes.get('p99'))}"
+            )
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(
+        description="Mede os scripts de extração contra uma réplica local da FIPE e um banco descartável"
+    )
+    parser.add_argument('--engine', choices=['http', 'selenium'], default='http', help="Engine usado pelos scripts")
+    parser.add_argument('--workers', type=int, default=1, help="Workers do gerenciar_marcas.py")
+    parser.add_argument('--taxa', type=float,
+                        help="Fixa a taxa do limitador (req/s) nos scripts; padrão: a configurada no ambiente")
+    replica_fipe.adicionar_argumentos(parser)
+    parser.add_argument('--resultados', default=os.path.join(DIRETORIO_PROJETO, 'benchmarks', 'resultados.jsonl'),
+                        help="Arquivo em que cada rodada é acrescentada")
+    parser.add_argument('--comparar', metavar='COMMIT',
+                        help="Compara com a última rodada deste commit (padrão: a última com os mesmos parâmetros)")
+    parser.add_argument('--nao-salvar', action='store_true', help="Não acrescenta a rodada ao arquivo de resultados")
+    parser.add_argument('--manter', action='store_true', help="Mantém o banco e os logs da rodada para inspeção")
+    return parser.parse_args()
+
+def main():
+    args = parse_argumentos()
+    try:
+        anteriores = carregar_resultados(args.resultados)
+        atual = medir(args)
+        imprimir_relatorio(atual, escolher_base(anteriores, atual, args.comparar))
+        if not args.nao_salvar:
+            salvar_resultado(args.resultados, atual)
+            logging.info(f"Resultado gravado em {args.resultados}")
+    except Exception as e:
+        logging.error(f"Erro durante o benchmark: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
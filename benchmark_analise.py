@@ -0,0 +1,189 @@
+import argparse
+import logging
+import resource
+import sys
+import time
+import numpy as np
+import analise_precos
+
+# Configuração do logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('benchmark_analise.log'),
+        logging.StreamHandler()
+    ]
+)
+
+# Último mês da série sintética (dezembro/2024)
+ULTIMO_MES = 2024 * 12 + 11
+
+def gerar_historico(veiculos, meses, semente=1, lacunas=0.02, zero_km=0.02):
+    """Histórico sintético com o formato do real: cada veículo aparece a partir do ano anterior ao do
+    modelo, pode sair de linha antes do fim, tem meses faltando e perde valor com a idade"""
+    gerador = np.random.default_rng(semente)
+    meses_serie = np.arange(ULTIMO_MES - meses + 1, ULTIMO_MES + 1, dtype=np.int32)
+    primeiro_ano, ultimo_ano = int(meses_serie[0] // 12), int(meses_serie[-1] // 12)
+    ano_modelo = gerador.integers(primeiro_ano - 5, ultimo_ano + 2, veiculos).astype(np.int32)
+
+    # Do lançamento (julho do ano anterior ao do modelo) até sair de linha (ou o fim da série)
+    lancamento = (ano_modelo - 1) * 12 + 6
+    saida = np.where(gerador.random(veiculos) < 0.3, lancamento + gerador.integers(24, 240, veiculos), ULTIMO_MES)
+    presente = (meses_serie[None, :] >= lancamento[:, None]) & (meses_serie[None, :] <= saida[:, None])
+    presente &= gerador.random(presente.shape, dtype=np.float32) >= lacunas
+
+    # Preço de lançamento lognormal, depreciação anual entre 5% e 15% e ruído de 1% ao mês
+    base = np.exp(gerador.normal(np.log(60000), 0.8, veiculos))
+    depreciacao = gerador.uniform(0.05, 0.15, veiculos)
+    idade_meses = np.clip(meses_serie[None, :] - lancamento[:, None], 0, None)
+    precos = base[:, None] * (1 - depreciacao[:, None]) ** (idade_meses / 12)
+    precos *= 1 + gerador.normal(0, 0.01, precos.shape)
+    precos = np.round(precos, 2)
+    precos[~presente] = 0
+
+    ano_modelo[gerador.random(veiculos) < zero_km] = analise_precos.ANO_ZERO_KM
+    referencia_ids = np.arange(1, meses + 1, dtype=np.int32)
+    tipos = gerador.choice(len(analise_precos.TIPOS_VEICULOS), veiculos, p=[0.7, 0.2, 0.1]).astype(np.int8)
+    return analise_precos.HistoricoPrecos(meses_serie, referencia_ids, ano_modelo, tipos, precos, presente)
+
+def subconjunto(historico, linhas):
+    return analise_precos.HistoricoPrecos(
+        historico.meses, historico.referencia_ids, historico.ano_modelo[linhas], historico.tipos[linhas],
+        np.ascontiguousarray(historico.precos[linhas]), np.ascontiguousarray(historico.presente[linhas])
+    )
+
+def calcular_python(historico, janela):
+    """Mesmos cálculos com laços em Python puro, linha a linha, para comparar tempo e resultados"""
+    variacoes_mensais, variacoes_anuais, medias = {}, {}, {}
+    grupos = {}
+    for i in range(historico.forma[0]):
+        precos = historico.precos[i].tolist()
+        presente = historico.presente[i].tolist()
+        ano_modelo = int(historico.ano_modelo[i])
+        for j in range(len(precos)):
+            if not presente[j]:
+                continue
+            if j >= 1 and presente[j - 1]:
+                variacoes_mensais[(i, j)] = precos[j] / precos[j - 1] - 1
+            if j >= 12 and presente[j - 12]:
+                variacoes_anuais[(i, j)] = precos[j] / precos[j - 12] - 1
+                if ano_modelo == analise_precos.ANO_ZERO_KM:
+                    idade = 0
+                else:
+                    idade = max(int(historico.meses[j]) // 12 - ano_modelo, 0)
+                grupos.setdefault((int(historico.tipos[i]), idade), []).append(variacoes_anuais[(i, j)])
+            janela_precos = [precos[k] for k in range(max(j - janela + 1, 0), j + 1) if presente[k]]
+            medias[(i, j)] = sum(janela_precos) / len(janela_precos)
+    curva = {}
+    for chave, valores in grupos.items():
+        valores.sort()
+        meio = len(valores) // 2
+        curva[chave] = valores[meio] if len(valores) % 2 else (valores[meio - 1] + valores[meio]) / 2
+    return variacoes_mensais, variacoes_anuais, medias, curva
+
+def maior_diferenca(esperados, valores, validas):
+    """Maior diferença entre os resultados em Python e os vetorizados (inclusive células a mais ou a menos)"""
+    if set(esperados) != set(zip(*np.nonzero(validas))):
+        return float('inf')
+    return max((abs(valor - valores[chave]) for chave, valor in esperados.items()), default=0.0)
+
+def conferir(historico, resultado, janela):
+    """Compara o cálculo vetorizado com o em Python puro; retorna (segundos em Python, maior diferença)"""
+    inicio = time.perf_counter()
+    mensais, anuais, medias, curva = calcular_python(historico, janela)
+    segundos = time.perf_counter() - inicio
+    indices_tipos = {tipo: indice for indice, tipo in enumerate(analise_precos.TIPOS_VEICULOS)}
+    curva_vetorizada = {(indices_tipos[tipo], idade): mediana for tipo, idade, mediana, _, _, _ in resultado['depreciacao']}
+    diferencas = [
+        maior_diferenca(mensais, resultado['variacao_mensal'], resultado['mensal_valida']),
+        maior_diferenca(anuais, resultado['variacao_anual'], resultado['anual_valida']),
+        maior_diferenca(medias, resultado['media_movel'], historico.presente),
+        float('inf') if set(curva) != set(curva_vetorizada) else
+        max((abs(valor - curva_vetorizada[chave]) for chave, valor in curva.items()), default=0.0)
+    ]
+    return segundos, max(diferencas)
+
+def medir(args):
+    inicio = time.perf_counter()
+    historico = gerar_historico(args.veiculos, args.meses, args.semente, args.lacunas)
+    logging.info(
+        f"Histórico sintético de {args.veiculos} veículos × {args.meses} meses "
+        f"({int(historico.presente.sum())} preços) gerado em {time.perf_counter() - inicio:.1f}s"
+    )
+
+    tempos = {}
+    resultado = {}
+    for nome, funcao in (
+        ('variacao_mensal', lambda: analise_precos.variacao(historico.precos, historico.presente, 1)),
+        ('variacao_anual', lambda: analise_precos.variacao(historico.precos, historico.presente, 12)),
+        ('media_movel', lambda: analise_precos.media_movel(historico.precos, historico.presente, args.janela)),
+        ('idade', lambda: analise_precos.idades(historico)),
+    ):
+        inicio = time.perf_counter()
+        resultado[nome] = funcao()
+        tempos[nome] = time.perf_counter() - inicio
+    resultado['variacao_mensal'], resultado['mensal_valida'] = resultado['variacao_mensal']
+    resultado['variacao_anual'], resultado['anual_valida'] = resultado['variacao_anual']
+
+    inicio = time.perf_counter()
+    resultado['depreciacao'] = analise_precos.curva_depreciacao(
+        historico, resultado['idade'], resultado['variacao_anual'], resultado['anual_valida']
+    )
+    tempos['depreciacao'] = time.perf_counter() - inicio
+
+    # Codificação do COPY binário de analise_variacoes (o que o banco receberia)
+    inicio = time.perf_counter()
+    tamanho = sum(len(bloco) for bloco in analise_precos.blocos_variacoes(historico, resultado))
+    tempos['copy_binario'] = time.perf_counter() - inicio
+
+    # Amostra calculada também em Python puro, para a estimativa do tempo total e a conferência
+    linhas = np.random.default_rng(args.semente).choice(args.veiculos, min(args.amostra, args.veiculos), replace=False)
+    amostra = subconjunto(historico, np.sort(linhas))
+    segundos_python, diferenca = conferir(amostra, analise_precos.calcular(amostra, args.janela), args.janela)
+
+    return {
+        'precos': int(historico.presente.sum()),
+        'tempos': tempos,
+        'copy_mb': tamanho / 1024 ** 2,
+        'python_estimado': segundos_python * args.veiculos / len(linhas),
+        'amostra': len(linhas),
+        'diferenca': diferenca,
+        # ru_maxrss vem em KB no Linux e em bytes no macOS
+        'pico_memoria_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    }
+
+def imprimir_relatorio(args, medidas):
+    # O Python puro só faz os cálculos, então a comparação deixa a codificação do COPY de fora
+    calculos = sum(segundos for nome, segundos in medidas['tempos'].items() if nome != 'copy_binario')
+    print(f"{args.veiculos} veículos × {args.meses} meses, {medidas['precos']} preços, média móvel de {args.janela} meses")
+    for nome, segundos in medidas['tempos'].items():
+        print(f"  {nome}: {segundos:.2f}s ({medidas['precos'] / segundos / 1e6:.1f} M preços/s)")
+    print(f"  COPY binário: {medidas['copy_mb']:.1f} MB ({medidas['copy_mb'] / medidas['tempos']['copy_binario']:.0f} MB/s)")
+    print(f"Cálculos vetorizados: {calculos:.2f}s; em Python puro (estimado por {medidas['amostra']} veículos): "
+          f"{medidas['python_estimado']:.1f}s ({medidas['python_estimado'] / calculos:.0f}x)")
+    print(f"Maior diferença em relação ao Python puro na amostra: {medidas['diferenca']:.2e}")
+    print(f"Pico de memória: {medidas['pico_memoria_mb']:.0f} MB")
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(
+        description="Mede o analise_precos.py sobre um histórico sintético (sem banco de dados)"
+    )
+    parser.add_argument('--veiculos', type=int, default=100000, help="Veículos (modelo + ano) do histórico")
+    parser.add_argument('--meses', type=int, default=300, help="Meses do histórico")
+    parser.add_argument('--janela', type=int, default=12, help="Meses da média móvel")
+    parser.add_argument('--lacunas', type=float, default=0.02, help="Fração dos meses sem preço na vida de cada veículo")
+    parser.add_argument('--amostra', type=int, default=1000, help="Veículos calculados também em Python puro")
+    parser.add_argument('--semente', type=int, default=1, help="Semente dos dados sintéticos")
+    return parser.parse_args()
+
+def main():
+    args = parse_argumentos()
+    try:
+        imprimir_relatorio(args, medir(args))
+    except Exception as e:
+        logging.error(f"Erro durante o benchmark: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
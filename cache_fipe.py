@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date
+import config
+from conversoes import data_referencia
+
+# Cache aberto pelo script em execução (None quando desativado)
+CACHE = None
+
+def referencia_historica(mes_ano):
+    """Indica se a referência (ex: "janeiro/2025") é de um mês anterior ao atual.
+
+    Os dados de meses anteriores não mudam mais; os do mês atual ainda podem mudar.
+    """
+    data = data_referencia(mes_ano)
+    return data is not None and data < date.today().replace(day=1)
+
+def chave_cache(endpoint, dados):
+    """Chave da resposta: hash do endpoint e de todos os parâmetros da consulta"""
+    parametros = '&'.join(f"{k}={v}" for k, v in sorted((dados or {}).items()))
+    return hashlib.sha1(f"{endpoint}?{parametros}".encode('utf-8')).hexdigest()
+
+class CacheRespostas:
+    """Cache em disco (SQLite) das respostas da FIPE, com TTL e remoção LRU por tamanho.
+
+    Respostas de referências históricas ficam válidas por CACHE_TTL_HISTORICO_HORAS
+    (0 = para sempre); as do mês atual e a tabela de referências, por
+    CACHE_TTL_ATUAL_HORAS. Quando o total passa de CACHE_TAMANHO_MAXIMO_MB, as
+    respostas acessadas há mais tempo são removidas. Pode ser usado por várias
+    threads ao mesmo tempo.
+    """
+
+    def __init__(self, caminho, tamanho_maximo_mb=None, ttl_atual_horas=None, ttl_historico_horas=None):
+        self.caminho = caminho
+        self.tamanho_maximo = int((tamanho_maximo_mb or config.CACHE_CONFIG['tamanho_maximo_mb']) * 1024 * 1024)
+        self.ttl_atual = (ttl_atual_horas if ttl_atual_horas is not None else config.CACHE_CONFIG['ttl_atual_horas']) * 3600
+        self.ttl_historico = (ttl_historico_horas if ttl_historico_horas is not None else config.CACHE_CONFIG['ttl_historico_horas']) * 3600
+        self.lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.expirados = 0
+        self.gravados = 0
+        self.removidos = 0
+
+        self.conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS respostas (
+                chave TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                conteudo BLOB NOT NULL,
+                tamanho INTEGER NOT NULL,
+                criado_em REAL NOT NULL,
+                expira_em REAL,
+                acessado_em REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_respostas_acesso ON respostas (acessado_em)")
+        self.tamanho_total = self.conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+
+    def obter(self, endpoint, dados):
+        """Retorna a resposta guardada (já decodificada) ou None se não houver ou tiver expirado"""
+        chave = chave_cache(endpoint, dados)
+        agora = time.time()
+        with self.lock:
+            linha = self.conn.execute(
+                "SELECT conteudo, expira_em FROM respostas WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None:
+                self.falhas += 1
+                return None
+            conteudo, expira_em = linha
+            if expira_em is not None and expira_em <= agora:
+                self.expirados += 1
+                self.falhas += 1
+                return None
+            self.conn.execute("UPDATE respostas SET acessado_em = ? WHERE chave = ?", (agora, chave))
+            self.acertos += 1
+        return json.loads(conteudo)
+
+    def gravar(self, endpoint, dados, conteudo, mes_ano=None):
+        """Guarda a resposta; o TTL depende de a referência (mes_ano) ser histórica ou não"""
+        ttl = self.ttl_historico if referencia_historica(mes_ano) else self.ttl_atual
+        agora = time.time()
+        expira_em = agora + ttl if ttl > 0 else None
+        corpo = json.dumps(conteudo, ensure_ascii=False).encode('utf-8')
+        chave = chave_cache(endpoint, dados)
+        with self.lock:
+            anterior = self.conn.execute("SELECT tamanho FROM respostas WHERE chave = ?", (chave,)).fetchone()
+            self.conn.execute("""
+                INSERT OR REPLACE INTO respostas (chave, endpoint, conteudo, tamanho, criado_em, expira_em, acessado_em)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (chave, endpoint, corpo, len(corpo), agora, expira_em, agora))
+            self.tamanho_total += len(corpo) - (anterior[0] if anterior else 0)
+            self.gravados += 1
+            if self.tamanho_total > self.tamanho_maximo:
+                self._remover_excedente()
+
+    def _remover_excedente(self):
+        """Remove as respostas expiradas e as menos acessadas até ficar em 90% do limite"""
+        self.conn.execute("DELETE FROM respostas WHERE expira_em IS NOT NULL AND expira_em <= ?", (time.time(),))
+        self.tamanho_total = self.conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+        alvo = self.tamanho_maximo * 0.9
+        while self.tamanho_total > alvo:
+            removidas = self.conn.execute("""
+                DELETE FROM respostas WHERE chave IN (
+                    SELECT chave FROM respostas ORDER BY acessado_em LIMIT 100
+                ) RETURNING tamanho
+            """).fetchall()
+            if not removidas:
+                break
+            self.removidos += len(removidas)
+            self.tamanho_total -= sum(tamanho for tamanho, in removidas)
+
+    def resumo(self):
+        """Registra no log os contadores de uso do cache"""
+        consultas = self.acertos + self.falhas
+        taxa = self.acertos / consultas * 100 if consultas else 0
+        logging.info(
+            f"Cache {self.caminho}: {self.acertos} acertos, {self.falhas} falhas ({self.expirados} expirados), "
+            f"taxa de acerto {taxa:.1f}%, {self.gravados} gravados, {self.removidos} removidos, "
+            f"{self.tamanho_total / 1024 / 1024:.1f} MB"
+        )
+
+    def fechar(self):
+        with self.lock:
+            self.conn.close()
+
+def adicionar_argumentos(parser):
+    """Adiciona aos scripts a opção de escolha do arquivo de cache"""
+    parser.add_argument('--cache', metavar='ARQUIVO',
+                        help="Arquivo SQLite do cache de respostas da FIPE (padrão: CACHE_ARQUIVO)")
+
+def configurar(caminho=None):
+    """Abre o cache do arquivo informado (ou de CACHE_ARQUIVO) para uso pelos scripts"""
+    global CACHE
+    caminho = caminho or config.CACHE_CONFIG['arquivo']
+    if caminho and CACHE is None:
+        CACHE = CacheRespostas(caminho)
+        logging.info(f"Usando o cache de respostas {caminho}")
+    return CACHE
+
+def obter(endpoint, dados):
+    """Consulta o cache configurado (None se desativado ou sem a resposta)"""
+    return CACHE.obter(endpoint, dados) if CACHE else None
+
+def gravar(endpoint, dados, conteudo, mes_ano=None):
+    """Guarda a resposta no cache configurado, se houver"""
+    if CACHE:
+        CACHE.gravar(endpoint, dados, conteudo, mes_ano)
+
+def encerrar():
+    """Registra os contadores e fecha o cache configurado"""
+    global CACHE
+    if CACHE:
+        CACHE.resumo()
+        CACHE.fechar()
+        CACHE = None
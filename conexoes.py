@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool as pool_psycopg2
+import config
+import metricas
+
+# Erros que indicam conexão perdida (servidor reiniciado, queda de rede, proxy que fechou a conexão)
+ERROS_CONEXAO = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# Conexões paradas no pool por mais tempo que isso são testadas antes de serem entregues
+VALIDAR_APOS_SEGUNDOS = 30
+
+# Consultas frequentes preparadas no servidor: {nome: consulta com %s}
+CONSULTAS_PREPARADAS = {}
+
+class ConexaoFipe(psycopg2.extensions.connection):
+    """Conexão que lembra as consultas já preparadas nela (PREPARE vale para a sessão inteira)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+        self.devolvida_em = None
+
+def preparar(nome, consulta):
+    """Registra uma consulta frequente (com parâmetros %s) para ser executada como prepared statement"""
+    CONSULTAS_PREPARADAS[nome] = consulta
+    return nome
+
+def executar_preparada(cur, nome, parametros):
+    """Executa a consulta registrada em preparar().
+
+    Na primeira execução em cada conexão a consulta é preparada (PREPARE); as
+    seguintes só enviam EXECUTE com os parâmetros, sem novo parse e planejamento.
+    Em conexões que não são ConexaoFipe a consulta é executada normalmente.
+    """
+    consulta = CONSULTAS_PREPARADAS[nome]
+    preparadas = getattr(cur.connection, 'preparadas', None)
+    if preparadas is None:
+        cur.execute(consulta, parametros)
+        return
+    if nome not in preparadas:
+        contador = iter(range(1, len(parametros) + 1))
+        cur.execute(f"PREPARE {nome} AS {re.sub('%s', lambda _: f'${next(contador)}', consulta)}")
+        preparadas.add(nome)
+    cur.execute(f"EXECUTE {nome} ({', '.join(['%s'] * len(parametros))})", parametros)
+
+def conectar(autocommit=False, **parametros):
+    """Conexão dedicada (fora do pool), ex: migrações, cursores longos ou conexões em autocommit"""
+    conn = psycopg2.connect(**dict(config.DB_CONFIG, **parametros), connection_factory=ConexaoFipe)
+    conn.autocommit = autocommit
+    return conn
+
+class PoolConexoes:
+    """Pool de conexões compartilhado pelas threads do processo.
+
+    Quando todas as conexões estão em uso, obter() aguarda uma ser devolvida.
+    Conexões perdidas são descartadas e substituídas; executar() repete a
+    função com uma nova conexão até POOL_CONFIG['tentativas'] vezes, então as
+    funções passadas para ele devem fazer a própria transação (e o commit).
+    """
+
+    def __init__(self, minimo=None, maximo=None, tentativas=None):
+        self.minimo = minimo or config.POOL_CONFIG['minimo']
+        self.maximo = max(maximo or config.POOL_CONFIG['maximo'], self.minimo)
+        self.tentativas = tentativas or config.POOL_CONFIG['tentativas']
+        self.pool = pool_psycopg2.ThreadedConnectionPool(
+            self.minimo, self.maximo, connection_factory=ConexaoFipe, **config.DB_CONFIG
+        )
+        self.vagas = threading.BoundedSemaphore(self.maximo)
+        self.reconexoes = 0
+
+    def _valida(self, conn):
+        if conn.closed:
+            return False
+        if conn.devolvida_em is None or time.monotonic() - conn.devolvida_em < VALIDAR_APOS_SEGUNDOS:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except ERROS_CONEXAO:
+            return False
+
+    def obter(self):
+        """Retira uma conexão do pool (aguarda se todas estiverem em uso)"""
+        self.vagas.acquire()
+        try:
+            conn = self.pool.getconn()
+            while not self._valida(conn):
+                self.reconexoes += 1
+                logging.warning("Conexão com o banco perdida, abrindo outra")
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+            return conn
+        except Exception:
+            self.vagas.release()
+            raise
+
+    def devolver(self, conn, descartar=False):
+        """Devolve a conexão ao pool; transações abertas são desfeitas"""
+        try:
+            if not conn.closed and not descartar:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = False
+                conn.devolvida_em = time.monotonic()
+        except ERROS_CONEXAO:
+            descartar = True
+        finally:
+            self.pool.putconn(conn, close=descartar or bool(conn.closed))
+            self.vagas.release()
+
+    @contextmanager
+    def conexao(self):
+        """Conexão do pool durante o bloco; em caso de erro a transação é desfeita"""
+        conn = self.obter()
+        descartar = False
+        try:
+            yield conn
+        except ERROS_CONEXAO:
+            descartar = True
+            raise
+        finally:
+            self.devolver(conn, descartar)
+
+    def executar(self, funcao, *args):
+        """Executa funcao(conn, *args) com uma conexão do pool, reconectando se a conexão cair"""
+        for tentativa in range(1, self.tentativas + 1):
+            try:
+                with metricas.medir('fipe_banco_segundos', operacao=funcao.__name__):
+                    with self.conexao() as conn:
+                        return funcao(conn, *args)
+            except ERROS_CONEXAO as e:
+                if tentativa == self.tentativas:
+                    raise
+                self.reconexoes += 1
+                logging.warning(f"Conexão perdida em {funcao.__name__} ({e}), tentativa {tentativa + 1}...")
+                time.sleep(min(2 ** tentativa, 30))
+
+    def fechar(self):
+        self.pool.closeall()
+        if self.reconexoes:
+            logging.info(f"Pool de conexões: {self.reconexoes} reconexões")
+
+class PoolConexoesAsync:
+    """Pool para código asyncio: cada chamada roda em uma thread com uma conexão do pool.
+
+    Até `maximo` funções de banco rodam em paralelo; as demais aguardam sem
+    bloquear o event loop.
+    """
+
+    def __init__(self, minimo=None, maximo=None, tentativas=None):
+        self.pool = PoolConexoes(minimo, maximo, tentativas)
+        self.semaforo = asyncio.Semaphore(self.pool.maximo)
+
+    async def executar(self, funcao, *args):
+        async with self.semaforo:
+            return await asyncio.to_thread(self.pool.executar, funcao, *args)
+
+    def fechar(self):
+        self.pool.fechar()
+
+class AgrupadorCommits:
+    """Agrupa várias unidades de trabalho (ex: jobs) em uma transação.
+
+    Faz commit a cada `unidades` unidades concluídas ou quando `intervalo`
+    segundos se passaram desde o último commit, o que vier primeiro. Cada
+    unidade começa com iniciar() (um SAVEPOINT), então o erro de uma unidade
+    desfaz só o que ela gravou. Se nem isso for possível, desfazer() descarta
+    todas as unidades ainda sem commit e as retorna, para o chamador poder
+    devolvê-las (ex: jobs.liberar_jobs).
+    """
+
+    def __init__(self, conn, unidades=None, intervalo=None):
+        self.conn = conn
+        self.unidades = unidades or config.POOL_CONFIG['commit_unidades']
+        self.intervalo = intervalo if intervalo is not None else config.POOL_CONFIG['commit_intervalo']
+        self.pendentes = []
+        self.ultimo_commit = time.monotonic()
+        self.commits = 0
+
+    def iniciar(self):
+        """Marca o início de uma unidade na transação"""
+        with self.conn.cursor() as cur:
+            cur.execute("SAVEPOINT unidade")
+
+    def concluir(self, unidade=None):
+        """Registra uma unidade concluída; faz commit se o grupo encheu ou o intervalo expirou"""
+        self.pendentes.append(unidade)
+        if len(self.pendentes) >= self.unidades or time.monotonic() - self.ultimo_commit >= self.intervalo:
+            self.confirmar()
+
+    def confirmar(self):
+        with metricas.medir('fipe_banco_segundos', operacao='commit'):
+            self.conn.commit()
+        self.pendentes = []
+        self.ultimo_commit = time.monotonic()
+        self.commits += 1
+
+    def desfazer_unidade(self):
+        """Desfaz a unidade em andamento; se não der (ex: conexão perdida), a transação inteira.
+
+        Retorna as unidades concluídas perdidas junto (vazio quando só a unidade foi desfeita).
+        """
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT unidade")
+            return []
+        except psycopg2.Error:
+            return self.desfazer()
+
+    def desfazer(self):
+        """Desfaz a transação e retorna as unidades que estavam sem commit"""
+        self.conn.rollback()
+        perdidas = [unidade for unidade in self.pendentes if unidade is not None]
+        self.pendentes = []
+        return perdidas
+
+POOL = None
+POOL_LOCK = threading.Lock()
+
+def configurar(minimo=None, maximo=None):
+    """Cria o pool do processo; maximo deve cobrir as conexões usadas ao mesmo tempo (ex: 2 por worker)"""
+    global POOL
+    with POOL_LOCK:
+        if POOL is None:
+            POOL = PoolConexoes(minimo, maximo)
+        return POOL
+
+def pool():
+    return POOL or configurar()
+
+def obter():
+    return pool().obter()
+
+def devolver(conn, descartar=False):
+    pool().devolver(conn, descartar)
+
+def conexao():
+    return pool().conexao()
+
+def executar(funcao, *args):
+    return pool().executar(funcao, *args)
+
+def encerrar():
+    """Fecha todas as conexões do pool do processo"""
+    global POOL
+    with POOL_LOCK:
+        if POOL is not None:
+            POOL.fechar()
+            POOL = None
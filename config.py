@@ -13,8 +13,78 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT', '5432')
 }
 
+# Configurações do pool de conexões e do agrupamento de commits
+POOL_CONFIG = {
+    'minimo': int(os.getenv('DB_POOL_MINIMO', '1')),
+    'maximo': int(os.getenv('DB_POOL_MAXIMO', '10')),
+    'tentativas': int(os.getenv('DB_TENTATIVAS_RECONEXAO', '3')),
+    'commit_unidades': int(os.getenv('DB_COMMIT_UNIDADES', '20')),
+    'commit_intervalo': float(os.getenv('DB_COMMIT_INTERVALO', '5'))
+}
+
 # Configurações do Selenium
 SELENIUM_CONFIG = {
     'headless': os.getenv('SELENIUM_HEADLESS', 'true').lower() == 'true',
-    'timeout': int(os.getenv('SELENIUM_TIMEOUT', '5'))
-} 
\ No newline at end of file
+    'timeout': int(os.getenv('SELENIUM_TIMEOUT', '5')),
+    'url': os.getenv('SELENIUM_URL', 'https://veiculos.fipe.org.br/'),
+    'depurador': os.getenv('SELENIUM_DEPURADOR', ''),
+    'pool_reserva': int(os.getenv('SELENIUM_POOL_RESERVA', '1')),
+    'max_operacoes': int(os.getenv('SELENIUM_MAX_OPERACOES', '500')),
+    'max_memoria_mb': float(os.getenv('SELENIUM_MAX_MEMORIA_MB', '512')),
+    'bloqueio': os.getenv('SELENIUM_BLOQUEIO', 'nenhum'),
+    'captura_rede': os.getenv('SELENIUM_CAPTURA_REDE', 'false').lower() == 'true',
+    'bloquear_urls': [padrao.strip() for padrao in os.getenv('SELENIUM_BLOQUEAR_URLS', '').split(',') if padrao.strip()]
+}
+
+# Configurações do cliente HTTP da FIPE
+FIPE_CONFIG = {
+    'url': os.getenv('FIPE_URL', 'https://veiculos.fipe.org.br'),
+    'timeout': int(os.getenv('FIPE_TIMEOUT', '30')),
+    'pool': int(os.getenv('FIPE_POOL', '10'))
+}
+
+# Configurações da gravação em lote no banco
+GRAVACAO_CONFIG = {
+    'tamanho_lote': int(os.getenv('GRAVACAO_TAMANHO_LOTE', '1000')),
+    'intervalo': float(os.getenv('GRAVACAO_INTERVALO', '5'))
+}
+
+# Configurações do controle de jobs (tabela scrape_jobs)
+JOBS_CONFIG = {
+    'max_tentativas': int(os.getenv('JOBS_MAX_TENTATIVAS', '5')),
+    'expiracao_minutos': int(os.getenv('JOBS_EXPIRACAO_MINUTOS', '30'))
+}
+
+# Configurações do cache de respostas da FIPE (desativado se CACHE_ARQUIVO estiver vazio)
+CACHE_CONFIG = {
+    'arquivo': os.getenv('CACHE_ARQUIVO', ''),
+    'tamanho_maximo_mb': float(os.getenv('CACHE_TAMANHO_MAXIMO_MB', '512')),
+    'ttl_atual_horas': float(os.getenv('CACHE_TTL_ATUAL_HORAS', '6')),
+    'ttl_historico_horas': float(os.getenv('CACHE_TTL_HISTORICO_HORAS', '0'))
+}
+
+# Configurações da API de consulta de preços (consultas.py)
+CONSULTAS_CONFIG = {
+    'tamanho_cache': int(os.getenv('CONSULTAS_TAMANHO_CACHE', '10000')),
+    'intervalo_verificacao': float(os.getenv('CONSULTAS_INTERVALO_VERIFICACAO', '5')),
+    'porta': int(os.getenv('CONSULTAS_PORTA', '8080'))
+}
+
+# Configurações das métricas (servidor desativado se METRICAS_PORTA for 0, resumo JSON se METRICAS_JSON for informado)
+METRICAS_CONFIG = {
+    'porta': int(os.getenv('METRICAS_PORTA', '0')),
+    'arquivo_json': os.getenv('METRICAS_JSON', '')
+}
+
+# Configurações do limitador de taxa e do disjuntor das chamadas ao site da FIPE
+LIMITADOR_CONFIG = {
+    'taxa_inicial': float(os.getenv('LIMITADOR_TAXA_INICIAL', '5')),
+    'taxa_minima': float(os.getenv('LIMITADOR_TAXA_MINIMA', '0.2')),
+    'taxa_maxima': float(os.getenv('LIMITADOR_TAXA_MAXIMA', '50')),
+    'incremento': float(os.getenv('LIMITADOR_INCREMENTO', '0.1')),
+    'fator_reducao': float(os.getenv('LIMITADOR_FATOR_REDUCAO', '0.5')),
+    'rajada': float(os.getenv('LIMITADOR_RAJADA', '5')),
+    'limite_falhas': int(os.getenv('LIMITADOR_LIMITE_FALHAS', '5')),
+    'pausa_segundos': float(os.getenv('LIMITADOR_PAUSA_SEGUNDOS', '60')),
+    'intervalo_log': float(os.getenv('LIMITADOR_INTERVALO_LOG', '30'))
+}
@@ -0,0 +1,240 @@
+import argparse
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import conexoes
+import config
+
+COLUNAS_PRECO = ['tipo_veiculo', 'marca', 'modelo', 'ano', 'ano_modelo', 'combustivel', 'mes_ano', 'data', 'valor', 'valor_numerico']
+
+def atualizar_views(conn):
+    """Atualiza mv_precos sem bloquear as leituras e registra a atualização (invalida os caches)"""
+    with conn.cursor() as cur:
+        inicio = time.perf_counter()
+        cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_precos")
+        cur.execute("""
+            INSERT INTO atualizacoes_views (nome) VALUES ('mv_precos')
+            ON CONFLICT (nome) DO UPDATE SET atualizada_em = now()
+        """)
+    conn.commit()
+    logging.info(f"View mv_precos atualizada em {time.perf_counter() - inicio:.1f}s")
+
+def versao_dados(cur):
+    """Última referência cadastrada e última atualização de mv_precos; muda quando os dados mudam"""
+    cur.execute("""
+        SELECT (SELECT MAX(id) FROM referencias),
+               (SELECT atualizada_em FROM atualizacoes_views WHERE nome = 'mv_precos')
+    """)
+    return cur.fetchone()
+
+class CacheLRU:
+    """Dicionário limitado que descarta as chaves usadas há mais tempo"""
+
+    def __init__(self, tamanho_maximo):
+        self.tamanho_maximo = tamanho_maximo
+        self.itens = OrderedDict()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave):
+        """Retorna (True, valor) se a chave estiver no cache, senão (False, None)"""
+        if chave not in self.itens:
+            self.falhas += 1
+            return False, None
+        self.itens.move_to_end(chave)
+        self.acertos += 1
+        return True, self.itens[chave]
+
+    def gravar(self, chave, valor):
+        self.itens[chave] = valor
+        self.itens.move_to_end(chave)
+        if len(self.itens) > self.tamanho_maximo:
+            self.itens.popitem(last=False)
+
+    def limpar(self):
+        self.itens.clear()
+
+class ApiPrecos:
+    """Consultas de preço e de histórico de preços sobre mv_precos, com cache LRU em memória.
+
+    A cada CONSULTAS_INTERVALO_VERIFICACAO segundos confere se chegou uma nova
+    referência ou se a view foi atualizada; nesse caso o cache é esvaziado. Entre
+    as verificações, as consultas repetidas são respondidas sem ir ao banco.
+    Pode ser usada por várias threads ao mesmo tempo.
+    """
+
+    def __init__(self, conn=None, tamanho_cache=None, intervalo_verificacao=None):
+        self.conn = conn or conexoes.conectar()
+        self.conn.autocommit = True
+        self.cache = CacheLRU(tamanho_cache or config.CONSULTAS_CONFIG['tamanho_cache'])
+        self.intervalo_verificacao = (
+            intervalo_verificacao if intervalo_verificacao is not None
+            else config.CONSULTAS_CONFIG['intervalo_verificacao']
+        )
+        self.lock = threading.Lock()
+        self.versao = None
+        self.verificado_em = 0
+        self.invalidacoes = 0
+
+    def _verificar_versao(self):
+        agora = time.monotonic()
+        if agora - self.verificado_em < self.intervalo_verificacao:
+            return
+        self.verificado_em = agora
+        with self.conn.cursor() as cur:
+            versao = versao_dados(cur)
+        if versao != self.versao:
+            if self.versao is not None:
+                logging.info(f"Dados alterados ({versao[0]}, {versao[1]}), cache de consultas esvaziado")
+                self.invalidacoes += 1
+            self.cache.limpar()
+            self.versao = versao
+
+    def _consultar(self, chave, consulta, parametros, uma_linha):
+        with self.lock:
+            self._verificar_versao()
+            encontrado, resultado = self.cache.obter(chave)
+            if encontrado:
+                return resultado
+            with self.conn.cursor() as cur:
+                cur.execute(consulta, parametros)
+                linhas = [dict(zip(COLUNAS_PRECO, linha)) for linha in cur.fetchall()]
+            resultado = (linhas[0] if linhas else None) if uma_linha else linhas
+            self.cache.gravar(chave, resultado)
+            return resultado
+
+    def preco(self, tipo_veiculo, marca, modelo, ano, mes_ano=None):
+        """Preço do veículo na referência mes_ano (a mais recente se None); None se não houver"""
+        colunas = ', '.join(COLUNAS_PRECO)
+        if mes_ano:
+            consulta = f"""
+                SELECT {colunas} FROM mv_precos
+                WHERE tipo_veiculo = %s AND marca = %s AND modelo = %s AND ano = %s AND mes_ano = %s
+            """
+            parametros = (tipo_veiculo, marca, modelo, ano, mes_ano)
+        else:
+            consulta = f"""
+                SELECT {colunas} FROM mv_precos
+                WHERE tipo_veiculo = %s AND marca = %s AND modelo = %s AND ano = %s
+                ORDER BY data DESC LIMIT 1
+            """
+            parametros = (tipo_veiculo, marca, modelo, ano)
+        return self._consultar(('preco',) + parametros + (mes_ano,), consulta, parametros, True)
+
+    def historico(self, tipo_veiculo, marca, modelo, ano=None):
+        """Preços do veículo em todas as referências, em ordem de data (todos os anos se ano for None)"""
+        colunas = ', '.join(COLUNAS_PRECO)
+        consulta = f"""
+            SELECT {colunas} FROM mv_precos
+            WHERE tipo_veiculo = %s AND marca = %s AND modelo = %s AND (%s::text IS NULL OR ano = %s)
+            ORDER BY ano, data
+        """
+        parametros = (tipo_veiculo, marca, modelo, ano, ano)
+        return self._consultar(('historico', tipo_veiculo, marca, modelo, ano), consulta, parametros, False)
+
+    def resumo(self):
+        consultas = self.cache.acertos + self.cache.falhas
+        taxa = self.cache.acertos / consultas * 100 if consultas else 0
+        logging.info(
+            f"Consultas: {consultas}, taxa de acerto do cache {taxa:.1f}%, "
+            f"{len(self.cache.itens)} itens em cache, {self.invalidacoes} invalidações"
+        )
+
+    def fechar(self):
+        with self.lock:
+            self.conn.close()
+
+def serializar(valor):
+    """Converte Decimal e date para JSON"""
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, date):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+class ConsultasHandler(BaseHTTPRequestHandler):
+    """GET /preco?tipo=&marca=&modelo=&ano=[&referencia=] e GET /historico?tipo=&marca=&modelo=[&ano=]"""
+
+    api = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parametros = dict(parse_qsl(url.query))
+        try:
+            if url.path == '/preco':
+                resultado = self.api.preco(
+                    parametros['tipo'], parametros['marca'], parametros['modelo'], parametros['ano'],
+                    parametros.get('referencia')
+                )
+                if resultado is None:
+                    self.send_error(404, "Preço não encontrado")
+                    return
+            elif url.path == '/historico':
+                resultado = self.api.historico(
+                    parametros['tipo'], parametros['marca'], parametros['modelo'], parametros.get('ano')
+                )
+            else:
+                self.send_error(404)
+                return
+        except KeyError as e:
+            self.send_error(400, f"Parâmetro obrigatório ausente: {e.args[0]}")
+            return
+        except Exception as e:
+            logging.error(f"Erro na consulta {self.path}: {e}")
+            self.send_error(500)
+            return
+
+        conteudo = json.dumps(resultado, ensure_ascii=False, default=serializar).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def main():
+    # Configuração do logging (só ao executar o servidor; como módulo, vale a dos scripts)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('consultas.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description="Servidor HTTP da API de consulta de preços")
+    parser.add_argument('--porta', type=int, default=config.CONSULTAS_CONFIG['porta'], help="Porta do servidor")
+    parser.add_argument('--host', default='127.0.0.1', help="Endereço do servidor")
+    parser.add_argument('--atualizar', action='store_true', help="Atualiza as views materializadas antes de iniciar")
+    args = parser.parse_args()
+
+    try:
+        api = ApiPrecos()
+        if args.atualizar:
+            atualizar_views(api.conn)
+        ConsultasHandler.api = api
+        servidor = ThreadingHTTPServer((args.host, args.porta), ConsultasHandler)
+        logging.info(f"API de consulta de preços em http://{args.host}:{args.porta}")
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logging.error(f"Erro durante a execução: {e}")
+    finally:
+        if 'servidor' in locals():
+            servidor.server_close()
+        if 'api' in locals():
+            api.resumo()
+            api.fechar()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+MESES = {
+    'janeiro': 1, 'fevereiro': 2, 'março': 3, 'abril': 4, 'maio': 5, 'junho': 6,
+    'julho': 7, 'agosto': 8, 'setembro': 9, 'outubro': 10, 'novembro': 11, 'dezembro': 12
+}
+
+# "2024 Gasolina", "32000 Diesel" (32000 é o código da FIPE para zero km)
+PADRAO_ANO = re.compile(r'^\s*(\d{4,5})\s+(.+?)\s*$')
+
+def data_referencia(mes_ano):
+    """Converte "janeiro/2025" no primeiro dia do mês (None se inválida)"""
+    try:
+        mes, ano = mes_ano.split('/')
+        return date(int(ano), MESES[mes.strip().lower()], 1)
+    except (AttributeError, ValueError, KeyError):
+        return None
+
+def converter_valor(texto):
+    """Converte "R$ 45.321,00" em Decimal('45321.00') (None se inválido)"""
+    try:
+        numero = texto.replace('R$', '').strip().replace('.', '').replace(',', '.')
+        return Decimal(numero)
+    except (AttributeError, InvalidOperation):
+        return None
+
+def separar_ano(texto):
+    """Separa "2024 Gasolina" em (2024, 'Gasolina') ((None, None) se inválido)"""
+    encontrado = PADRAO_ANO.match(texto or '')
+    if not encontrado:
+        return None, None
+    return int(encontrado.group(1)), encontrado.group(2)
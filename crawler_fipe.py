@@ -0,0 +1,540 @@
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import Counter, defaultdict
+import cache_fipe
+import config
+import conexoes
+import consultas
+import conversoes
+import diferencas
+import dimensoes
+import fipe_http
+import heranca
+import jobs
+import limitador
+import metricas
+import particoes
+from escritor_lote import EscritorLote
+
+# Configuração do logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('crawler.log'),
+        logging.StreamHandler()
+    ]
+)
+
+# Etapas do pipeline, na ordem em que os resultados são repassados
+ETAPAS = ['marcas', 'modelos', 'anos', 'valores']
+
+# Colunas gravadas em cada nível da hierarquia (na ordem: nome, pai, referência,
+# colunas derivadas do nome e id na dimensão ou código da FIPE); as três primeiras formam a restrição UNIQUE
+COLUNAS_NIVEIS = {
+    'marcas': ['nome', 'tipo_veiculo', 'referencia_id', 'dim_marca_id'],
+    'modelos': ['nome', 'marca_id', 'referencia_id', 'dim_modelo_id'],
+    'anos': ['ano', 'modelo_id', 'referencia_id', 'ano_modelo', 'combustivel', 'codigo_fipe']
+}
+
+# Colunas derivadas do nome em cada nível
+DERIVADAS_NIVEIS = {
+    'anos': conversoes.separar_ano
+}
+
+# Níveis registrados nas tabelas de dimensão: recebem o pai na dimensão
+# (tipo de veículo das marcas, dim_marca_id dos modelos) e os itens (código, nome)
+DIMENSOES_NIVEIS = {
+    'marcas': dimensoes.marcas,
+    'modelos': dimensoes.modelos
+}
+
+# Níveis sem dimensão, que guardam o código da FIPE na própria linha
+CODIGOS_NIVEIS = {'anos'}
+
+def get_referencias(cur, filtro=None):
+    """Obtém as referências (id, mes_ano, código) do banco, opcionalmente apenas as informadas em filtro (mes_ano)"""
+    if filtro:
+        cur.execute("SELECT id, mes_ano, codigo_fipe FROM referencias WHERE mes_ano = ANY(%s) ORDER BY data DESC", (filtro,))
+    else:
+        cur.execute("SELECT id, mes_ano, codigo_fipe FROM referencias ORDER BY data DESC")
+    return [(row[0], row[1], row[2]) for row in cur.fetchall()]
+
+def salvar_nivel(conn, nivel, itens, pai, referencia_id, dim_pai=None, existentes=None):
+    """Grava os itens (código, nome) de um nível em lote.
+
+    Com o índice existentes (diferencas.ChavesExistentes do nível), só os itens
+    que ainda não estão nele vão para o banco. Retorna {nome: (id, id na dimensão)},
+    inclusive dos que já existiam; o id na dimensão é None nos níveis sem dimensão.
+    """
+    colunas = COLUNAS_NIVEIS[nivel]
+    derivar = DERIVADAS_NIVEIS.get(nivel)
+    resolver = DIMENSOES_NIVEIS.get(nivel)
+    dims = resolver(dim_pai, itens) if resolver else {}
+    codigos = {nome: codigo for codigo, nome in itens} if nivel in CODIGOS_NIVEIS else {}
+    nomes = [nome for _, nome in itens]
+    novos = nomes
+    ids = {}
+    if existentes is not None:
+        novos, removidos = existentes.diferenca(pai, nomes)
+        diferencas.registrar_removidas(nivel, removidos, f"{pai} na referência {referencia_id}")
+        ids = {nome: existentes.obter(pai, nome) for nome in set(nomes).difference(novos)}
+
+    linhas = []
+    for nome in novos:
+        linha = (nome, pai, referencia_id) + (tuple(derivar(nome)) if derivar else ())
+        if resolver:
+            linha += (dims[nome],)
+        if codigos:
+            linha += (codigos[nome],)
+        linhas.append(linha)
+    if linhas:
+        escritor = EscritorLote(conn, nivel, colunas, chave=colunas[:3])
+        gravados = {nome: item_id for (nome, _, _), item_id in escritor.gravar(linhas, retornar_ids=True).items()}
+        conn.commit()
+        ids.update(gravados)
+        if existentes is not None:
+            existentes.adicionar(pai, gravados)
+    return {nome: (item_id, dims.get(nome)) for nome, item_id in ids.items()}
+
+def carregar_existentes(conn, tipo_veiculo, referencia_id):
+    """Índices das marcas, modelos e anos já gravados de um job (referência, tipo de veículo)"""
+    with conn.cursor() as cur:
+        indices = diferencas.carregar_referencia(cur, tipo_veiculo, referencia_id)
+    conn.commit()
+    return indices
+
+def carregar_arvore(conn, tipo_veiculo, referencia_id):
+    """Árvore marca → modelo → anos da referência anterior já coletada (crawl com --herdar)"""
+    with conn.cursor() as cur:
+        arvore = heranca.carregar(cur, tipo_veiculo, referencia_id)
+    conn.commit()
+    return arvore
+
+def remover_ano(conn, ano_id, referencia_id):
+    """Remove um ano herdado que não existe mais na referência"""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM anos WHERE id = %s AND referencia_id = %s", (ano_id, referencia_id))
+    conn.commit()
+
+def salvar_valores(conn, valores):
+    """Grava uma lista de (valor, ano_id, referencia_id) em lote, com o valor também em NUMERIC"""
+    escritor = EscritorLote(
+        conn, 'valores', ['valor', 'ano_id', 'referencia_id', 'valor_numerico'], chave=['ano_id', 'referencia_id']
+    )
+    escritor.gravar([(valor, ano_id, referencia_id, conversoes.converter_valor(valor)) for valor, ano_id, referencia_id in valores])
+    conn.commit()
+
+class Pipeline:
+    """Pipeline marcas → modelos → anos → valores com concorrência limitada por etapa.
+
+    Cada etapa tem uma fila limitada: quando a fila seguinte está cheia, os
+    workers da etapa anterior ficam bloqueados no put, mantendo a memória estável.
+    Só max_jobs jobs ficam em andamento ao mesmo tempo: o próximo só é reivindicado
+    (e tem os índices carregados) quando um deles termina.
+    """
+
+    def __init__(self, cliente, banco, concorrencia, tamanho_fila, tamanho_lote, max_jobs):
+        self.cliente = cliente
+        self.banco = banco
+        self.concorrencia = concorrencia
+        self.tamanho_lote = tamanho_lote
+        self.filas = {etapa: asyncio.Queue(maxsize=tamanho_fila) for etapa in ETAPAS}
+        self.fila_gravacao = asyncio.Queue(maxsize=tamanho_fila)
+        self.contadores = {etapa: {'ok': 0, 'erros': 0} for etapa in ETAPAS}
+        self.valores_gravados = 0
+        # Itens ainda em processamento e último erro de cada job (referência, tipo de veículo)
+        self.pendentes = defaultdict(int)
+        self.erros_jobs = {}
+        # Índices dos itens já gravados de cada job em andamento (diferencas.ChavesExistentes por nível)
+        self.existentes = {}
+        # Árvores das referências anteriores (heranca.ArvoreAnterior) dos jobs com --herdar
+        self.arvores = {}
+        self.jobs_finalizados = {'concluidos': 0, 'falhos': 0}
+        self.max_jobs = max_jobs
+        self.vagas_jobs = asyncio.Semaphore(max_jobs)
+
+    async def aguardar_vaga(self):
+        """Aguarda até haver menos de max_jobs jobs em andamento e reserva a vaga"""
+        await self.vagas_jobs.acquire()
+
+    def liberar_vaga(self):
+        self.vagas_jobs.release()
+
+    async def aguardar_jobs(self):
+        """Aguarda todos os jobs em andamento terminarem"""
+        for _ in range(self.max_jobs):
+            await self.vagas_jobs.acquire()
+        for _ in range(self.max_jobs):
+            self.vagas_jobs.release()
+
+    async def repassar(self, fila, item):
+        """Envia um item para a fila seguinte; o primeiro campo de todo item é o job de origem"""
+        self.pendentes[item[0]] += 1
+        await fila.put(item)
+
+    async def item_finalizado(self, job_id, erro=None):
+        """Quando todos os itens de um job terminam, registra o job como concluído ou falho"""
+        if erro is not None:
+            self.erros_jobs[job_id] = erro
+        self.pendentes[job_id] -= 1
+        if self.pendentes[job_id]:
+            return
+        del self.pendentes[job_id]
+        self.existentes.pop(job_id, None)
+        arvore = self.arvores.pop(job_id, None)
+        if arvore is not None:
+            arvore.resumo(f"Job {job_id}")
+        erro = self.erros_jobs.pop(job_id, None)
+        try:
+            await self.banco.executar(finalizar_job, job_id, erro)
+        finally:
+            self.liberar_vaga()
+        self.jobs_finalizados['falhos' if erro else 'concluidos'] += 1
+        metricas.fechar_unidade(job_id, erro)
+
+    def indice(self, job_id, nivel):
+        indices = self.existentes.get(job_id)
+        return indices[nivel] if indices else None
+
+    async def etapa_marcas(self, item):
+        job_id, referencia_id, codigo_referencia, tipo_veiculo = item
+        marcas = await self.cliente.consultar_marcas(codigo_referencia, tipo_veiculo)
+        ids = await self.banco.executar(
+            salvar_nivel, 'marcas', marcas, tipo_veiculo, referencia_id, tipo_veiculo, self.indice(job_id, 'marcas')
+        )
+        arvore = self.arvores.get(job_id)
+        if arvore is not None:
+            arvore.comparar_marcas(nome for _, nome in marcas)
+        for codigo_marca, nome in marcas:
+            marca_id, dim_marca_id = ids[nome]
+            await self.repassar(
+                self.filas['modelos'],
+                (job_id, referencia_id, codigo_referencia, tipo_veiculo, codigo_marca, marca_id, dim_marca_id)
+            )
+
+    async def etapa_modelos(self, item):
+        job_id, referencia_id, codigo_referencia, tipo_veiculo, codigo_marca, marca_id, dim_marca_id = item
+        modelos, anos_marca = await self.cliente.consultar_modelos_anos(codigo_referencia, tipo_veiculo, codigo_marca)
+        ids = await self.banco.executar(
+            salvar_nivel, 'modelos', modelos, marca_id, referencia_id, dim_marca_id, self.indice(job_id, 'modelos')
+        )
+        # Com a árvore da referência anterior, os modelos já conhecidos reaproveitam os anos dela
+        herdados = {}
+        arvore = self.arvores.get(job_id)
+        if arvore is not None:
+            herdados = arvore.herdaveis(dim_marca_id, [ids[nome][1] for _, nome in modelos], anos_marca)
+        for codigo_modelo, nome in modelos:
+            modelo_id, dim_modelo_id = ids[nome]
+            await self.repassar(
+                self.filas['anos'],
+                (job_id, referencia_id, codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, modelo_id,
+                 herdados.get(dim_modelo_id))
+            )
+
+    async def etapa_anos(self, item):
+        job_id, referencia_id, codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, modelo_id, herdados = item
+        anos = herdados
+        if anos is None:
+            anos = await self.cliente.consultar_ano_modelo(codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo)
+        else:
+            metricas.contar('fipe_herdados_total', len(anos), unidade=job_id, etapa='anos')
+        ids = await self.banco.executar(salvar_nivel, 'anos', anos, modelo_id, referencia_id, None, self.indice(job_id, 'anos'))
+        for codigo_ano, nome in anos:
+            await self.repassar(
+                self.filas['valores'],
+                (job_id, referencia_id, codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, codigo_ano, ids[nome][0],
+                 herdados is not None)
+            )
+
+    async def etapa_valores(self, item):
+        job_id, referencia_id, codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, codigo_ano, ano_id, herdado = item
+        try:
+            resposta = await self.cliente.consultar_valor(codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, codigo_ano)
+        except fipe_http.ErroFipe:
+            if not herdado:
+                raise
+            # O ano veio da referência anterior e não existe mais nesta: sai dela em vez de falhar o job
+            await self.banco.executar(remover_ano, ano_id, referencia_id)
+            self.arvores[job_id].contagem['anos_removidos'] += 1
+            logging.warning(f"Ano {codigo_ano} do modelo {codigo_modelo} herdado, mas inexistente na referência {codigo_referencia}")
+            return
+        await self.repassar(self.fila_gravacao, (job_id, resposta['Valor'], ano_id, referencia_id))
+
+    async def worker(self, etapa):
+        fila = self.filas[etapa]
+        processar = getattr(self, f"etapa_{etapa}")
+        while True:
+            item = await fila.get()
+            erro = None
+            try:
+                with metricas.medir('fipe_etapa_segundos', unidade=item[0], etapa=etapa):
+                    await processar(item)
+                self.contadores[etapa]['ok'] += 1
+                metricas.contar('fipe_itens_total', unidade=item[0], etapa=etapa)
+            except Exception as e:
+                erro = f"{etapa}: {e}"
+                self.contadores[etapa]['erros'] += 1
+                metricas.contar('fipe_erros_total', etapa=etapa)
+                logging.error(f"Erro na etapa {etapa} para {item[1:]}: {e}")
+            try:
+                await self.item_finalizado(item[0], erro)
+            except Exception as e:
+                logging.error(f"Erro ao finalizar o job {item[0]}: {e}")
+            finally:
+                fila.task_done()
+
+    async def gravador(self):
+        """Agrupa os valores em lotes para reduzir as idas ao banco"""
+        while True:
+            lote = [await self.fila_gravacao.get()]
+            while len(lote) < self.tamanho_lote and not self.fila_gravacao.empty():
+                lote.append(self.fila_gravacao.get_nowait())
+            erro = None
+            try:
+                await self.banco.executar(salvar_valores, [item[1:] for item in lote])
+                self.valores_gravados += len(lote)
+                for job_id, total in Counter(item[0] for item in lote).items():
+                    metricas.contar('fipe_itens_total', total, unidade=job_id, etapa='gravacao')
+            except Exception as e:
+                erro = f"gravação: {e}"
+                metricas.contar('fipe_erros_total', etapa='gravacao')
+                logging.error(f"Erro ao gravar {len(lote)} valores: {e}")
+            # Cada item é finalizado separadamente: um erro não pode deixar os jobs dos outros em aberto
+            for item in lote:
+                try:
+                    await self.item_finalizado(item[0], erro)
+                except Exception as e:
+                    logging.error(f"Erro ao finalizar o job {item[0]}: {e}")
+                finally:
+                    self.fila_gravacao.task_done()
+
+    async def progresso(self, intervalo):
+        while True:
+            await asyncio.sleep(intervalo)
+            self.registrar_progresso()
+
+    def registrar_progresso(self):
+        etapas = ', '.join(
+            f"{etapa}: {c['ok']} ok/{c['erros']} erros/{self.filas[etapa].qsize()} na fila"
+            for etapa, c in self.contadores.items()
+        )
+        logging.info(
+            f"Progresso - {etapas}, {self.valores_gravados} valores gravados, "
+            f"jobs: {self.jobs_finalizados['concluidos']} concluídos/{self.jobs_finalizados['falhos']} falhos"
+        )
+
+    async def executar(self, fonte):
+        """Processa os jobs (job_id, referencia_id, codigo_referencia, tipo_veiculo) de uma fonte assíncrona"""
+        tarefas = [
+            asyncio.create_task(self.worker(etapa))
+            for etapa in ETAPAS
+            for _ in range(self.concorrencia[etapa])
+        ]
+        tarefas.append(asyncio.create_task(self.gravador()))
+        tarefas.append(asyncio.create_task(self.progresso(30)))
+
+        try:
+            async for item in fonte:
+                await self.repassar(self.filas['marcas'], item)
+
+            # Cada etapa só termina depois da anterior ter repassado todos os seus itens
+            for etapa in ETAPAS:
+                await self.filas[etapa].join()
+            await self.fila_gravacao.join()
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+            await asyncio.gather(*tarefas, return_exceptions=True)
+
+        self.registrar_progresso()
+
+def registrar_jobs(conn, itens, reiniciar):
+    with conn.cursor() as cur:
+        jobs.registrar_jobs(cur, 'crawl', itens)
+        if reiniciar:
+            logging.info(f"{jobs.reiniciar_jobs(cur, 'crawl')} jobs voltaram para pendente")
+    conn.commit()
+
+def reivindicar_job(conn, worker, status, inicio, referencia_ids, tipos_veiculos):
+    with conn.cursor() as cur:
+        job = jobs.reivindicar_job(cur, 'crawl', worker, status=status, finalizados_antes_de=inicio,
+                                   referencia_ids=referencia_ids, tipos_veiculos=tipos_veiculos)
+    conn.commit()
+    return job
+
+def instante_atual(conn):
+    with conn.cursor() as cur:
+        return jobs.agora(cur)
+
+def resumo_jobs(conn):
+    with conn.cursor() as cur:
+        jobs.resumo_jobs(cur, 'crawl')
+
+def finalizar_job(conn, job_id, erro):
+    with conn.cursor() as cur:
+        if erro:
+            jobs.falhar_job(cur, job_id, erro)
+        else:
+            jobs.concluir_jobs(cur, [job_id])
+    conn.commit()
+
+async def crawl(args, referencias):
+    # As etapas gravam em paralelo, cada chamada com uma conexão do pool
+    banco = conexoes.PoolConexoesAsync(maximo=args.conexoes)
+    try:
+        async with fipe_http.ClienteFipeAsync(pool=sum(args.concorrencia.values())) as cliente:
+            # Códigos da tabela de referência da FIPE para cada mes_ano do banco (a API os
+            # trata como números); a tabela só é consultada se faltar algum código no banco
+            conhecidas = [(int(codigo), mes_ano) for _, mes_ano, codigo in referencias if codigo]
+            cliente.registrar_referencias(conhecidas)
+            codigos = {mes_ano: codigo for codigo, mes_ano in conhecidas}
+            if len(codigos) < len(referencias):
+                codigos.update({mes_ano: codigo for codigo, mes_ano in await cliente.consultar_tabela_referencia()})
+
+            itens = []
+            for referencia_id, mes_ano, _ in referencias:
+                if mes_ano not in codigos:
+                    logging.warning(f"Referência {mes_ano} não encontrada na tabela da FIPE")
+                    continue
+                for tipo_veiculo in args.tipos:
+                    itens.append((referencia_id, tipo_veiculo))
+
+            # Um job por (referência, tipo de veículo); os já concluídos não são refeitos
+            await banco.executar(registrar_jobs, itens, args.reiniciar)
+            referencia_ids = sorted({referencia_id for referencia_id, _ in itens})
+            nome_worker = f"{socket.gethostname()}-{os.getpid()}"
+            status = (jobs.PENDENTE, jobs.FALHOU) if args.falhas else (jobs.PENDENTE,)
+            inicio = await banco.executar(instante_atual)
+
+            pipeline = Pipeline(cliente, banco, args.concorrencia, args.tamanho_fila, args.tamanho_lote, args.jobs)
+
+            # Com --herdar as referências vão da mais antiga para a mais nova e cada uma só começa
+            # depois da anterior terminar, para partir da árvore coletada nesta mesma execução
+            if args.herdar:
+                grupos = [[referencia_id] for referencia_id in reversed(list(dict.fromkeys(r for r, _ in itens)))]
+            else:
+                grupos = [referencia_ids]
+
+            async def jobs_pendentes():
+                for grupo in grupos:
+                    while True:
+                        # O job só é reivindicado quando há vaga, então não expira esperando na fila
+                        await pipeline.aguardar_vaga()
+                        job = await banco.executar(reivindicar_job, nome_worker, status, inicio, grupo, args.tipos)
+                        if job is None:
+                            pipeline.liberar_vaga()
+                            break
+                        job_id, referencia_id, mes_ano, tipo_veiculo = job
+                        logging.info(f"Iniciando crawl da referência {mes_ano} do tipo {tipo_veiculo}")
+                        metricas.abrir_unidade(job_id, tipo_veiculo, mes_ano)
+                        try:
+                            # Itens já gravados (ex: crawl retomado): só os novos serão gravados
+                            pipeline.existentes[job_id] = await banco.executar(carregar_existentes, tipo_veiculo, referencia_id)
+                            if args.herdar:
+                                arvore = await banco.executar(carregar_arvore, tipo_veiculo, referencia_id)
+                                if arvore is None:
+                                    logging.info(f"Nenhuma referência anterior coletada para {tipo_veiculo}, crawl completo de {mes_ano}")
+                                else:
+                                    logging.info(f"Partindo da árvore de {arvore.mes_ano} para {mes_ano} do tipo {tipo_veiculo}")
+                                    pipeline.arvores[job_id] = arvore
+                        except Exception as e:
+                            erro = f"carga: {e}"
+                            logging.error(f"Erro ao carregar o job {job_id}: {e}")
+                            pipeline.existentes.pop(job_id, None)
+                            try:
+                                await banco.executar(finalizar_job, job_id, erro)
+                            finally:
+                                pipeline.liberar_vaga()
+                            metricas.fechar_unidade(job_id, erro)
+                            continue
+                        yield (job_id, referencia_id, codigos[mes_ano], tipo_veiculo)
+                    if args.herdar:
+                        await pipeline.aguardar_jobs()
+
+            await pipeline.executar(jobs_pendentes())
+            await banco.executar(resumo_jobs)
+    finally:
+        banco.fechar()
+
+CONCORRENCIA_PADRAO = {'marcas': 2, 'modelos': 8, 'anos': 16, 'valores': 32}
+
+def parse_concorrencia(texto):
+    """Converte "marcas=2,modelos=8,anos=16,valores=32" em dicionário"""
+    concorrencia = dict(CONCORRENCIA_PADRAO)
+    for parte in texto.split(','):
+        etapa, valor = parte.split('=')
+        if etapa not in concorrencia:
+            raise argparse.ArgumentTypeError(f"Etapa inválida: {etapa}")
+        concorrencia[etapa] = int(valor)
+    return concorrencia
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(description="Coleta marcas, modelos, anos e valores pela API da FIPE")
+    parser.add_argument('--referencias', nargs='*',
+                        help="Referências a coletar (ex: janeiro/2025); padrão: todas do banco")
+    parser.add_argument('--tipos', nargs='*', default=['carro', 'caminhao', 'moto'],
+                        choices=list(fipe_http.CODIGOS_TIPO_VEICULO), help="Tipos de veículo")
+    parser.add_argument('--concorrencia', type=parse_concorrencia, default=dict(CONCORRENCIA_PADRAO),
+                        help="Requisições simultâneas por etapa (ex: marcas=2,modelos=8,anos=16,valores=32)")
+    parser.add_argument('--reiniciar', action='store_true',
+                        help="Coleta novamente os pares (referência, tipo) já concluídos")
+    parser.add_argument('--falhas', action='store_true',
+                        help="Tenta novamente os pares que falharam em execuções anteriores")
+    parser.add_argument('--herdar', action='store_true',
+                        help="Reaproveita os anos dos modelos da referência anterior já coletada e consulta só os preços deles. "
+                             "Anos novos de um modelo conhecido só são vistos se forem novos para a marca inteira; "
+                             "faça periodicamente um crawl sem --herdar")
+    parser.add_argument('--jobs', type=int, default=4,
+                        help="Jobs (referência, tipo de veículo) em andamento ao mesmo tempo")
+    parser.add_argument('--tamanho-fila', type=int, default=1000, help="Tamanho máximo de cada fila entre etapas")
+    parser.add_argument('--tamanho-lote', type=int, default=config.GRAVACAO_CONFIG['tamanho_lote'],
+                        help="Valores gravados por lote")
+    parser.add_argument('--conexoes', type=int, default=config.POOL_CONFIG['maximo'],
+                        help="Conexões com o banco usadas ao mesmo tempo pelas etapas")
+    cache_fipe.adicionar_argumentos(parser)
+    metricas.adicionar_argumentos(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_argumentos()
+    inicio = time.perf_counter()
+    try:
+        cache_fipe.configurar(args.cache)
+        metricas.configurar(args.metricas_porta, args.metricas_json)
+
+        # Obtém as referências do banco
+        logging.info("Conectando ao banco de dados...")
+        with conexoes.conexao() as conn, conn.cursor() as cur:
+            referencias = get_referencias(cur, args.referencias)
+            # Garante as partições das referências (caso tenham sido cadastradas antes do particionamento)
+            particoes.criar_particoes(cur, [referencia_id for referencia_id, _, _ in referencias])
+            conn.commit()
+        logging.info(f"Encontradas {len(referencias)} referências no banco")
+
+        if not referencias:
+            logging.info("Não há referências para processar")
+            return
+
+        asyncio.run(crawl(args, referencias))
+        
+        # Atualiza as views de consulta com os preços novos
+        with conexoes.conexao() as conn:
+            consultas.atualizar_views(conn)
+        logging.info(f"Processo concluído em {time.perf_counter() - inicio:.1f}s")
+
+    except Exception as e:
+        logging.error(f"Erro durante a execução: {e}")
+    finally:
+        limitador.registrar_estado()
+        cache_fipe.encerrar()
+        dimensoes.encerrar()
+        conexoes.encerrar()
+        metricas.encerrar()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+import metricas
+
+# Acima deste número de chaves o índice usa tuplas ordenadas (busca binária) em vez de dicionários
+LIMITE_DICIONARIOS = 200000
+
+# Chaves já gravadas de cada nível: (pai, nome, id). O pai é o mesmo usado na gravação
+# do nível: a referência nas marcas de um tipo de veículo, a marca nos modelos e o modelo nos anos
+CONSULTAS_TIPO_VEICULO = {
+    'marcas': """
+        SELECT referencia_id, nome, id FROM marcas
+        WHERE tipo_veiculo = %(tipo)s AND (%(referencias)s::int[] IS NULL OR referencia_id = ANY(%(referencias)s))
+    """,
+}
+
+CONSULTAS_REFERENCIA = {
+    'marcas': """
+        SELECT tipo_veiculo, nome, id FROM marcas
+        WHERE tipo_veiculo = %(tipo)s AND referencia_id = %(referencia)s
+    """,
+    'modelos': """
+        SELECT mo.marca_id, mo.nome, mo.id FROM modelos mo
+        JOIN marcas ma ON ma.id = mo.marca_id
+        WHERE ma.tipo_veiculo = %(tipo)s AND mo.referencia_id = %(referencia)s
+    """,
+    'anos': """
+        SELECT a.modelo_id, a.ano, a.id FROM anos a
+        JOIN modelos mo ON mo.id = a.modelo_id
+        JOIN marcas ma ON ma.id = mo.marca_id
+        WHERE ma.tipo_veiculo = %(tipo)s AND a.referencia_id = %(referencia)s
+    """,
+}
+
+class ChavesExistentes:
+    """Índice em memória dos nomes já gravados de um nível, agrupados pelo pai.
+
+    É carregado com uma única consulta e responde às buscas sem ir ao banco. Até
+    LIMITE_DICIONARIOS chaves cada pai guarda um dicionário {nome: id}; acima
+    disso, duas tuplas ordenadas (nomes e ids) consultadas por busca binária,
+    que ocupam bem menos memória nos níveis grandes (modelos e anos).
+    """
+
+    def __init__(self, linhas):
+        agrupados = defaultdict(list)
+        self.total = 0
+        for pai, nome, item_id in linhas:
+            agrupados[pai].append((nome, item_id))
+            self.total += 1
+        self.compacto = self.total > LIMITE_DICIONARIOS
+        self.por_pai = {pai: self._montar(itens) for pai, itens in agrupados.items()}
+
+    def _montar(self, itens):
+        if not self.compacto:
+            return dict(itens)
+        itens.sort()
+        return tuple(nome for nome, _ in itens), tuple(item_id for _, item_id in itens)
+
+    def obter(self, pai, nome):
+        """Id do item já gravado (None se não existir)"""
+        grupo = self.por_pai.get(pai)
+        if grupo is None:
+            return None
+        if not self.compacto:
+            return grupo.get(nome)
+        nomes, ids = grupo
+        posicao = bisect_left(nomes, nome)
+        if posicao < len(nomes) and nomes[posicao] == nome:
+            return ids[posicao]
+        return None
+
+    def nomes(self, pai):
+        grupo = self.por_pai.get(pai)
+        if grupo is None:
+            return ()
+        return grupo.keys() if not self.compacto else grupo[0]
+
+    def diferenca(self, pai, nomes_site):
+        """Retorna (novos, removidos): nomes do site ainda não gravados e nomes gravados que sumiram do site"""
+        no_site = dict.fromkeys(nomes_site)
+        novos = [nome for nome in no_site if self.obter(pai, nome) is None]
+        removidos = sorted(nome for nome in self.nomes(pai) if nome not in no_site)
+        return novos, removidos
+
+    def adicionar(self, pai, ids):
+        """Inclui no índice os itens {nome: id} recém-gravados"""
+        if not ids:
+            return
+        grupo = self.por_pai.get(pai)
+        if not self.compacto:
+            self.por_pai.setdefault(pai, {}).update(ids)
+        else:
+            atuais = dict(zip(*grupo)) if grupo else {}
+            atuais.update(ids)
+            self.por_pai[pai] = self._montar(list(atuais.items()))
+        self.total += len(ids)
+
+def carregar_tipo_veiculo(cur, nivel, tipo_veiculo, referencia_ids=None):
+    """Índice de um nível para todas as referências (ou as informadas) de um tipo de veículo"""
+    cur.execute(CONSULTAS_TIPO_VEICULO[nivel], {'tipo': tipo_veiculo, 'referencias': referencia_ids})
+    return ChavesExistentes(cur.fetchall())
+
+def carregar_referencia(cur, tipo_veiculo, referencia_id, niveis=('marcas', 'modelos', 'anos')):
+    """Índices {nível: ChavesExistentes} de uma referência e tipo de veículo, uma consulta por nível"""
+    indices = {}
+    for nivel in niveis:
+        cur.execute(CONSULTAS_REFERENCIA[nivel], {'tipo': tipo_veiculo, 'referencia': referencia_id})
+        indices[nivel] = ChavesExistentes(cur.fetchall())
+    return indices
+
+def registrar_removidas(nivel, removidas, origem):
+    """Registra os itens gravados que não aparecem mais no site (eles são mantidos no banco)"""
+    if not removidas:
+        return
+    metricas.contar('fipe_removidos_total', len(removidas), etapa=nivel)
+    exemplos = ', '.join(map(str, removidas[:10])) + (', ...' if len(removidas) > 10 else '')
+    logging.warning(f"{len(removidas)} itens de {nivel} gravados não aparecem mais no site para {origem}: {exemplos}")
+
+class IndiceMarcas:
+    """Marcas já gravadas de cada tipo de veículo, carregadas na primeira vez que o tipo é usado.
+
+    Substitui a consulta das marcas existentes feita a cada referência: cada
+    tipo de veículo custa uma consulta por execução. Quem grava marcas deve
+    chamar adicionar() para manter o índice em dia.
+    """
+
+    def __init__(self, referencia_ids=None):
+        self.referencia_ids = referencia_ids
+        self.indices = {}
+
+    def indice(self, cur, tipo_veiculo):
+        if tipo_veiculo not in self.indices:
+            self.indices[tipo_veiculo] = carregar_tipo_veiculo(cur, 'marcas', tipo_veiculo, self.referencia_ids)
+        return self.indices[tipo_veiculo]
+
+    def diferenca(self, cur, tipo_veiculo, referencia_id, marcas_site):
+        """(novas, removidas) das marcas do site em relação às gravadas para a referência"""
+        return self.indice(cur, tipo_veiculo).diferenca(referencia_id, marcas_site)
+
+    def adicionar(self, tipo_veiculo, referencia_id, marcas):
+        """Registra marcas gravadas (ou a gravar) na referência; o id não é usado pelos scripts de marcas"""
+        if tipo_veiculo in self.indices:
+            self.indices[tipo_veiculo].adicionar(referencia_id, {marca: 0 for marca in marcas})
+
+    def descartar(self, tipo_veiculo=None):
+        """Força a recarga do índice (de um tipo ou de todos), ex: após um rollback"""
+        if tipo_veiculo is None:
+            self.indices.clear()
+        else:
+            self.indices.pop(tipo_veiculo, None)
@@ -0,0 +1,137 @@
+import logging
+import threading
+from psycopg2.extras import execute_values
+import conexoes
+
+class CacheDimensoes:
+    """Cache de internação das marcas e modelos nas tabelas de dimensão.
+
+    dim_marcas e dim_modelos guardam cada marca/modelo uma única vez, independente
+    da referência, identificado pelo código da FIPE; o nome é um atributo, com o
+    da última gravação (uma marca renomeada continua com o mesmo id). Itens sem
+    código caem no nome. Cada item é resolvido para o seu id no máximo uma vez
+    por execução: os seguintes vêm da memória. Usa uma conexão própria em autocommit,
+    então os ids devolvidos já estão gravados e continuam válidos mesmo que a
+    transação de quem os usa seja desfeita. Pode ser usado por várias threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = None
+        self.ids_marcas = {}
+        self.ids_modelos = {}
+        self.acertos = 0
+        self.resolvidos = 0
+
+    def _conectar(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = conexoes.conectar(autocommit=True)
+        return self.conn
+
+    def _resolver(self, ids, tabela, pai, coluna_pai, itens):
+        """Retorna {nome: id} dos itens (codigo_fipe, nome), gravando na dimensão os que faltarem"""
+        with self.lock:
+            resultado = {}
+            faltantes = {}
+            for codigo, nome in itens:
+                chave = (pai, codigo) if codigo is not None else (pai, None, nome)
+                guardado = ids.get(chave)
+                # Mesmo código com outro nome (marca/modelo renomeado) vai ao banco para atualizar o nome
+                if guardado is not None and guardado[1] == nome:
+                    resultado[nome] = guardado[0]
+                    self.acertos += 1
+                else:
+                    faltantes[chave] = (codigo, nome)
+            if not faltantes:
+                return resultado
+
+            conn = self._conectar()
+            com_codigo = [(pai, codigo, nome) for codigo, nome in faltantes.values() if codigo is not None]
+            sem_codigo = sorted({nome for codigo, nome in faltantes.values() if codigo is None})
+            with conn.cursor() as cur:
+                if com_codigo:
+                    for chave_gravada, item in self._gravar_codigos(cur, tabela, coluna_pai, com_codigo).items():
+                        ids[(pai, chave_gravada)] = item
+                if sem_codigo:
+                    for nome, id_dim in self._gravar_nomes(cur, tabela, coluna_pai, pai, sem_codigo).items():
+                        ids[(pai, None, nome)] = (id_dim, nome)
+
+            for chave, (codigo, nome) in faltantes.items():
+                resultado[nome] = ids[chave][0]
+            self.resolvidos += len(faltantes)
+            return resultado
+
+    def _gravar_codigos(self, cur, tabela, coluna_pai, itens):
+        """Grava os itens (pai, codigo_fipe, nome) pelo código e retorna {codigo: (id, nome)}"""
+        # Um código aparece uma vez por comando (o ON CONFLICT não atualiza a mesma linha duas vezes)
+        itens = list({codigo: (pai, codigo, nome) for pai, codigo, nome in itens}.values())
+        # Linhas antigas sem o código (ex: gravadas antes de o código ser extraído) o recebem agora
+        execute_values(cur, f"""
+            UPDATE {tabela} d SET codigo_fipe = v.codigo
+            FROM (VALUES %s) AS v (pai, codigo, nome)
+            WHERE d.{coluna_pai} = v.pai AND d.nome = v.nome AND d.codigo_fipe IS NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM {tabela} c WHERE c.{coluna_pai} = v.pai AND c.codigo_fipe = v.codigo
+              )
+        """, itens)
+        gravados = execute_values(cur, f"""
+            INSERT INTO {tabela} ({coluna_pai}, codigo_fipe, nome) VALUES %s
+            ON CONFLICT ({coluna_pai}, codigo_fipe) WHERE codigo_fipe IS NOT NULL
+            DO UPDATE SET nome = EXCLUDED.nome
+            RETURNING codigo_fipe, id, nome
+        """, itens, fetch=True)
+        return {codigo: (id_dim, nome) for codigo, id_dim, nome in gravados}
+
+    def _gravar_nomes(self, cur, tabela, coluna_pai, pai, nomes):
+        """Resolve pelo nome os itens sem código (ex: engine Selenium sem os códigos) e retorna {nome: id}"""
+        cur.execute(f"""
+            SELECT DISTINCT ON (nome) nome, id FROM {tabela}
+            WHERE {coluna_pai} = %s AND nome = ANY(%s)
+            ORDER BY nome, codigo_fipe IS NULL, id
+        """, (pai, nomes))
+        encontrados = dict(cur.fetchall())
+        novos = [(pai, nome) for nome in nomes if nome not in encontrados]
+        if novos:
+            encontrados.update(execute_values(cur, f"""
+                INSERT INTO {tabela} ({coluna_pai}, nome) VALUES %s
+                ON CONFLICT ({coluna_pai}, nome) WHERE codigo_fipe IS NULL
+                DO UPDATE SET nome = EXCLUDED.nome
+                RETURNING nome, id
+            """, novos, fetch=True))
+        return encontrados
+
+    def marcas(self, tipo_veiculo, itens):
+        """Ids em dim_marcas das marcas (codigo_fipe, nome) de um tipo de veículo"""
+        return self._resolver(self.ids_marcas, 'dim_marcas', tipo_veiculo, 'tipo_veiculo', itens)
+
+    def modelos(self, dim_marca_id, itens):
+        """Ids em dim_modelos dos modelos (codigo_fipe, nome) de uma marca da dimensão"""
+        return self._resolver(self.ids_modelos, 'dim_modelos', dim_marca_id, 'dim_marca_id', itens)
+
+    def resumo(self):
+        if self.acertos or self.resolvidos:
+            logging.info(
+                f"Dimensões: {len(self.ids_marcas)} marcas e {len(self.ids_modelos)} modelos em memória, "
+                f"{self.resolvidos} itens resolvidos no banco, {self.acertos} acertos"
+            )
+
+    def fechar(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            self.ids_marcas.clear()
+            self.ids_modelos.clear()
+
+DIMENSOES = CacheDimensoes()
+
+def marcas(tipo_veiculo, itens):
+    return DIMENSOES.marcas(tipo_veiculo, itens)
+
+def modelos(dim_marca_id, itens):
+    return DIMENSOES.modelos(dim_marca_id, itens)
+
+def encerrar():
+    """Registra os contadores e fecha a conexão das dimensões"""
+    DIMENSOES.resumo()
+    DIMENSOES.fechar()
@@ -0,0 +1,147 @@
+import io
+import logging
+import time
+from psycopg2 import sql
+import config
+import metricas
+
+def formatar_copy(valor):
+    """Formata um valor no formato texto do COPY (NULL como \\N e caracteres especiais escapados)"""
+    if valor is None:
+        return '\\N'
+    return (
+        str(valor)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+class EscritorLote:
+    """Acumula linhas e grava em lote com COPY em uma tabela temporária seguido de um único
+    INSERT ... ON CONFLICT DO NOTHING na tabela final.
+
+    O escritor não faz commit: o controle da transação continua com quem o usa.
+    """
+
+    def __init__(self, conn, tabela, colunas, chave=None, tamanho_lote=None, intervalo=None):
+        self.conn = conn
+        self.tabela = tabela
+        self.colunas = list(colunas)
+        # Colunas da restrição UNIQUE, usadas para devolver os ids das linhas gravadas
+        self.chave = list(chave or colunas)
+        self.tamanho_lote = tamanho_lote or config.GRAVACAO_CONFIG['tamanho_lote']
+        self.intervalo = intervalo if intervalo is not None else config.GRAVACAO_CONFIG['intervalo']
+        self.staging = f"lote_{tabela}"
+        self.linhas = []
+        self.ultimo_flush = time.monotonic()
+        self.total_inseridas = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traceback):
+        if tipo is None:
+            self.flush()
+
+    def adicionar(self, linha):
+        """Adiciona uma linha (na ordem de colunas); grava se o lote encheu ou o intervalo expirou"""
+        self.linhas.append(linha)
+        if len(self.linhas) >= self.tamanho_lote or time.monotonic() - self.ultimo_flush >= self.intervalo:
+            self.flush()
+
+    def gravar(self, linhas, retornar_ids=False):
+        """Grava as linhas informadas (e as já acumuladas) em um único lote"""
+        self.linhas.extend(linhas)
+        return self.flush(retornar_ids)
+
+    def _criar_staging(self, cur):
+        # Recriada se necessário, pois um rollback desfaz a criação feita na mesma transação
+        cur.execute(sql.SQL(
+            "CREATE TEMP TABLE IF NOT EXISTS {staging} AS SELECT {colunas} FROM {tabela} WITH NO DATA"
+        ).format(
+            staging=sql.Identifier(self.staging),
+            colunas=sql.SQL(', ').join(map(sql.Identifier, self.colunas)),
+            tabela=sql.Identifier(self.tabela)
+        ))
+
+    def _copiar(self, cur, linhas):
+        """Envia as linhas acumuladas para a tabela temporária com COPY FROM STDIN"""
+        cur.execute(sql.SQL("TRUNCATE {}").format(sql.Identifier(self.staging)))
+        buffer = io.StringIO()
+        for linha in linhas:
+            buffer.write('\t'.join(formatar_copy(valor) for valor in linha))
+            buffer.write('\n')
+        buffer.seek(0)
+        cur.copy_expert(
+            sql.SQL("COPY {staging} ({colunas}) FROM STDIN").format(
+                staging=sql.Identifier(self.staging),
+                colunas=sql.SQL(', ').join(map(sql.Identifier, self.colunas))
+            ).as_string(cur),
+            buffer
+        )
+
+    def flush(self, retornar_ids=False):
+        """Grava as linhas acumuladas.
+
+        Com retornar_ids=True, retorna {chave: id} de todas as linhas do lote,
+        tanto as inseridas quanto as que já existiam. Caso contrário retorna
+        o número de linhas inseridas.
+        """
+        if not self.linhas:
+            self.ultimo_flush = time.monotonic()
+            return {} if retornar_ids else 0
+
+        lote = self.linhas
+        # Em caso de erro o lote é descartado, para não repetir linhas inválidas no próximo flush
+        self.linhas = []
+        self.ultimo_flush = time.monotonic()
+
+        colunas = sql.SQL(', ').join(map(sql.Identifier, self.colunas))
+        chave = sql.SQL(', ').join(map(sql.Identifier, self.chave))
+        inicio = time.perf_counter()
+        with self.conn.cursor() as cur:
+            self._criar_staging(cur)
+            self._copiar(cur, lote)
+
+            if not retornar_ids:
+                cur.execute(sql.SQL(
+                    "INSERT INTO {tabela} ({colunas}) SELECT DISTINCT {colunas} FROM {staging} ON CONFLICT DO NOTHING"
+                ).format(tabela=sql.Identifier(self.tabela), colunas=colunas, staging=sql.Identifier(self.staging)))
+                inseridas = cur.rowcount
+                resultado = inseridas
+            else:
+                # O SELECT externo não enxerga as linhas inseridas pela CTE, então a
+                # segunda parte do UNION traz exatamente as que já existiam
+                juncao = sql.SQL(' AND ').join(
+                    sql.SQL("t.{c} = s.{c}").format(c=sql.Identifier(c)) for c in self.chave
+                )
+                cur.execute(sql.SQL("""
+                    WITH inseridas AS (
+                        INSERT INTO {tabela} ({colunas})
+                        SELECT DISTINCT {colunas} FROM {staging}
+                        ON CONFLICT DO NOTHING
+                        RETURNING id, {chave}
+                    )
+                    SELECT id, {chave}, TRUE FROM inseridas
+                    UNION ALL
+                    SELECT DISTINCT t.id, {chave_t}, FALSE FROM {tabela} t JOIN {staging} s ON {juncao}
+                """).format(
+                    tabela=sql.Identifier(self.tabela),
+                    colunas=colunas,
+                    staging=sql.Identifier(self.staging),
+                    chave=chave,
+                    chave_t=sql.SQL(', ').join(sql.SQL("t.{}").format(sql.Identifier(c)) for c in self.chave),
+                    juncao=juncao
+                ))
+                resultado = {}
+                inseridas = 0
+                for linha in cur.fetchall():
+                    resultado[tuple(linha[1:-1])] = linha[0]
+                    inseridas += linha[-1]
+
+        metricas.observar('fipe_banco_segundos', time.perf_counter() - inicio, operacao='gravar_lote', tabela=self.tabela)
+        metricas.contar('fipe_linhas_gravadas_total', inseridas, tabela=self.tabela)
+        logging.debug(f"Lote de {len(lote)} linhas gravado em {self.tabela} ({inseridas} novas)")
+        self.total_inseridas += inseridas
+        return resultado
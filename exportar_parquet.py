@@ -0,0 +1,189 @@
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import conexoes
+
+# Configuração do logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('exportar_parquet.log'),
+        logging.StreamHandler()
+    ]
+)
+
+# Arquivo com o estado da última exportação de cada partição (ignorado pelos leitores de Parquet)
+ARQUIVO_ESTADO = '_estado_exportacao.json'
+
+# Esquema dos arquivos: nomes com codificação de dicionário e preços em decimal. O tipo
+# de veículo não é gravado nos arquivos: vem do diretório da partição (tipo_veiculo=carro)
+ESQUEMA = pa.schema([
+    ('mes_ano', pa.dictionary(pa.int32(), pa.string())),
+    ('data', pa.date32()),
+    ('dim_marca_id', pa.int32()),
+    ('marca', pa.dictionary(pa.int32(), pa.string())),
+    ('dim_modelo_id', pa.int32()),
+    ('modelo', pa.dictionary(pa.int32(), pa.string())),
+    ('ano', pa.dictionary(pa.int32(), pa.string())),
+    ('ano_modelo', pa.int32()),
+    ('combustivel', pa.dictionary(pa.int32(), pa.string())),
+    ('valor', pa.string()),
+    ('valor_numerico', pa.decimal128(14, 2)),
+])
+
+COLUNAS_DICIONARIO = [campo.name for campo in ESQUEMA if pa.types.is_dictionary(campo.type)]
+
+def get_particoes(cur, filtro_referencias=None, tipos_veiculos=None):
+    """Lista as partições (referência, tipo de veículo) com o número de valores e o maior id de valor.
+
+    O par (linhas, maior id) identifica o conteúdo da partição: muda sempre que
+    valores são gravados para aquela referência e tipo de veículo.
+    """
+    cur.execute("""
+        SELECT r.id, r.mes_ano, r.data, ma.tipo_veiculo, COUNT(*), MAX(v.id)
+        FROM valores v
+        JOIN anos a ON a.id = v.ano_id AND a.referencia_id = v.referencia_id
+        JOIN modelos mo ON mo.id = a.modelo_id
+        JOIN marcas ma ON ma.id = mo.marca_id
+        JOIN referencias r ON r.id = v.referencia_id
+        WHERE (%(referencias)s::text[] IS NULL OR r.mes_ano = ANY(%(referencias)s))
+          AND (%(tipos)s::text[] IS NULL OR ma.tipo_veiculo = ANY(%(tipos)s))
+        GROUP BY r.id, r.mes_ano, r.data, ma.tipo_veiculo
+        ORDER BY r.data, ma.tipo_veiculo
+    """, {'referencias': filtro_referencias or None, 'tipos': tipos_veiculos or None})
+    return cur.fetchall()
+
+def caminho_particao(destino, data, tipo_veiculo):
+    """Diretório da partição no formato hive (referencia=2025-01/tipo_veiculo=carro)"""
+    return os.path.join(destino, f"referencia={data:%Y-%m}", f"tipo_veiculo={tipo_veiculo}")
+
+def carregar_estado(destino):
+    caminho = os.path.join(destino, ARQUIVO_ESTADO)
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, 'r', encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+def salvar_estado(destino, estado):
+    """Grava o estado em um arquivo temporário e o renomeia, para nunca deixar um estado truncado"""
+    caminho = os.path.join(destino, ARQUIVO_ESTADO)
+    with open(caminho + '.tmp', 'w', encoding='utf-8') as arquivo:
+        json.dump(estado, arquivo, ensure_ascii=False, indent=2)
+    os.replace(caminho + '.tmp', caminho)
+
+def criar_lote(linhas):
+    """Converte uma lista de tuplas (na ordem do ESQUEMA) em um RecordBatch"""
+    colunas = list(zip(*linhas))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(coluna, type=campo.type) for coluna, campo in zip(colunas, ESQUEMA)],
+        schema=ESQUEMA
+    )
+
+def exportar_particao(conn, referencia_id, tipo_veiculo, arquivo, tamanho_lote):
+    """Exporta os valores de uma referência e tipo de veículo para um arquivo Parquet.
+
+    Os dados vêm de um cursor do lado do servidor e são escritos lote a lote, então
+    a memória usada depende só de tamanho_lote. O arquivo é escrito com outro nome
+    (iniciado por _, ignorado pelos leitores) e renomeado no final: leitores nunca
+    veem um arquivo pela metade.
+    """
+    temporario = os.path.join(os.path.dirname(arquivo), f"_{os.path.basename(arquivo)}.tmp")
+    total = 0
+    with conn.cursor(name=f"exportacao_{referencia_id}_{tipo_veiculo}") as cur:
+        cur.itersize = tamanho_lote
+        cur.execute("""
+            SELECT r.mes_ano, r.data, ma.dim_marca_id, ma.nome, mo.dim_modelo_id, mo.nome,
+                   a.ano, a.ano_modelo, a.combustivel, v.valor, v.valor_numerico
+            FROM valores v
+            JOIN anos a ON a.id = v.ano_id AND a.referencia_id = v.referencia_id
+            JOIN modelos mo ON mo.id = a.modelo_id
+            JOIN marcas ma ON ma.id = mo.marca_id
+            JOIN referencias r ON r.id = v.referencia_id
+            WHERE v.referencia_id = %s AND ma.tipo_veiculo = %s
+            ORDER BY ma.nome, mo.nome, a.ano
+        """, (referencia_id, tipo_veiculo))
+
+        with pq.ParquetWriter(temporario, ESQUEMA, compression='zstd', use_dictionary=COLUNAS_DICIONARIO) as escritor:
+            while True:
+                linhas = cur.fetchmany(tamanho_lote)
+                if not linhas:
+                    break
+                escritor.write_batch(criar_lote(linhas))
+                total += len(linhas)
+    conn.commit()
+    os.replace(temporario, arquivo)
+    return total
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(description="Exporta o histórico da FIPE para arquivos Parquet")
+    parser.add_argument('--destino', default='exportacao', help="Diretório dos arquivos Parquet")
+    parser.add_argument('--referencias', nargs='*', metavar='MES_ANO', help="Exporta apenas estas referências")
+    parser.add_argument('--tipos', nargs='*', choices=['carro', 'moto', 'caminhao'], help="Exporta apenas estes tipos de veículo")
+    parser.add_argument('--completo', action='store_true', help="Exporta todas as partições, mesmo as inalteradas")
+    parser.add_argument('--tamanho-lote', type=int, default=50000, help="Linhas lidas e escritas por lote")
+    return parser.parse_args()
+
+def main():
+    args = parse_argumentos()
+    inicio = time.perf_counter()
+    try:
+        logging.info("Conectando ao banco de dados...")
+        conn = conexoes.obter()
+        cur = conn.cursor()
+
+        os.makedirs(args.destino, exist_ok=True)
+        estado = carregar_estado(args.destino)
+        particoes = get_particoes(cur, args.referencias, args.tipos)
+        conn.commit()
+        logging.info(f"Encontradas {len(particoes)} partições (referência, tipo de veículo) com valores")
+
+        exportadas = 0
+        linhas_exportadas = 0
+        for referencia_id, mes_ano, data, tipo_veiculo, linhas, maior_id in particoes:
+            diretorio = caminho_particao(args.destino, data, tipo_veiculo)
+            arquivo = os.path.join(diretorio, 'dados.parquet')
+            chave = f"{data:%Y-%m}/{tipo_veiculo}"
+            anterior = estado.get(chave)
+            if (not args.completo and anterior and os.path.exists(arquivo)
+                    and anterior['linhas'] == linhas and anterior['maior_id'] == maior_id):
+                logging.debug(f"Partição {chave} inalterada")
+                continue
+
+            os.makedirs(diretorio, exist_ok=True)
+            inicio_particao = time.perf_counter()
+            total = exportar_particao(conn, referencia_id, tipo_veiculo, arquivo, args.tamanho_lote)
+            estado[chave] = {
+                'mes_ano': mes_ano,
+                'linhas': linhas,
+                'maior_id': maior_id,
+                'exportado_em': datetime.now().isoformat(timespec='seconds')
+            }
+            salvar_estado(args.destino, estado)
+            exportadas += 1
+            linhas_exportadas += total
+            logging.info(f"Partição {chave} exportada: {total} linhas em {time.perf_counter() - inicio_particao:.1f}s")
+
+        logging.info(
+            f"Exportação concluída em {time.perf_counter() - inicio:.1f}s: {exportadas} partições exportadas "
+            f"({linhas_exportadas} linhas), {len(particoes) - exportadas} inalteradas"
+        )
+
+    except Exception as e:
+        logging.error(f"Erro durante a execução: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conexoes.devolver(conn)
+        conexoes.encerrar()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import cache_fipe
+import config
+import limitador
+import metricas
+
+# Códigos usados pela API da FIPE para cada tipo de veículo
+CODIGOS_TIPO_VEICULO = {
+    'carro': 1,
+    'moto': 2,
+    'caminhao': 3
+}
+
+class ErroFipe(Exception):
+    """Erro retornado pela API da FIPE"""
+
+def cabecalhos(url):
+    """Cabeçalhos enviados pela página da FIPE nas chamadas AJAX"""
+    return {
+        'Referer': f"{url}/",
+        'X-Requested-With': 'XMLHttpRequest',
+        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0 Safari/537.36'
+    }
+
+def chave_gravacao(endpoint, dados):
+    """Gera o nome do arquivo de gravação de uma consulta (endpoint + parâmetros)"""
+    parametros = '&'.join(f"{k}={v}" for k, v in sorted((dados or {}).items()))
+    resumo = hashlib.sha1(parametros.encode('utf-8')).hexdigest()[:16]
+    return f"{endpoint}_{resumo}.json"
+
+# Montagem das requisições e leitura das respostas, comuns aos clientes síncrono e assíncrono
+
+def requisicao_marcas(codigo_referencia, tipo_veiculo):
+    return 'ConsultarMarcas', {
+        'codigoTabelaReferencia': codigo_referencia,
+        'codigoTipoVeiculo': CODIGOS_TIPO_VEICULO[tipo_veiculo]
+    }
+
+def requisicao_modelos(codigo_referencia, tipo_veiculo, codigo_marca):
+    return 'ConsultarModelos', {
+        'codigoTabelaReferencia': codigo_referencia,
+        'codigoTipoVeiculo': CODIGOS_TIPO_VEICULO[tipo_veiculo],
+        'codigoMarca': codigo_marca
+    }
+
+def requisicao_ano_modelo(codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo):
+    return 'ConsultarAnoModelo', {
+        'codigoTabelaReferencia': codigo_referencia,
+        'codigoTipoVeiculo': CODIGOS_TIPO_VEICULO[tipo_veiculo],
+        'codigoMarca': codigo_marca,
+        'codigoModelo': codigo_modelo
+    }
+
+def requisicao_valor(codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, codigo_ano):
+    ano_modelo, codigo_combustivel = codigo_ano.split('-')
+    return 'ConsultarValorComTodosParametros', {
+        'codigoTabelaReferencia': codigo_referencia,
+        'codigoTipoVeiculo': CODIGOS_TIPO_VEICULO[tipo_veiculo],
+        'codigoMarca': codigo_marca,
+        'codigoModelo': codigo_modelo,
+        'anoModelo': ano_modelo,
+        'codigoTipoCombustivel': codigo_combustivel,
+        'tipoVeiculo': tipo_veiculo,
+        'modeloCodigoExterno': '',
+        'tipoConsulta': 'tradicional'
+    }
+
+def ler_tabela_referencia(tabela):
+    return [(item['Codigo'], item['Mes'].strip()) for item in tabela]
+
+def ler_opcoes(opcoes):
+    """Converte a lista de {Label, Value} da API em (codigo, nome)"""
+    return [(str(item['Value']), item['Label'].strip()) for item in opcoes]
+
+def ler_modelos(resposta):
+    return ler_opcoes(resposta['Modelos'])
+
+def ler_anos_marca(resposta):
+    """Anos de todos os modelos da marca, que a API devolve junto com os modelos"""
+    return ler_opcoes(resposta.get('Anos') or [])
+
+def verificar_erro(endpoint, conteudo):
+    """A API responde 200 com {"erro": ...} quando a consulta não encontra dados"""
+    if isinstance(conteudo, dict) and conteudo.get('erro'):
+        raise ErroFipe(f"{endpoint}: {conteudo['erro']}")
+    return conteudo
+
+def resposta_cacheavel(conteudo):
+    """Indica se a resposta pode ir para o cache: listas vazias (ex: marcas durante um bloqueio),
+    modelos vazios e erros não vão, pois nas referências históricas seriam servidos para sempre"""
+    if not conteudo:
+        return False
+    if isinstance(conteudo, dict):
+        return not conteudo.get('erro') and ('Modelos' not in conteudo or bool(conteudo['Modelos']))
+    return True
+
+def gravar_resposta(diretorio, endpoint, dados, conteudo):
+    """Salva a resposta para ser reproduzida pelo stub_fipe.py"""
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = os.path.join(diretorio, chave_gravacao(endpoint, dados))
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(conteudo, arquivo, ensure_ascii=False)
+
+class ClienteFipe:
+    """Cliente HTTP para os endpoints JSON consultados pela página da FIPE"""
+
+    def __init__(self, url=None, timeout=None, pool=None, gravar_em=None):
+        self.url = (url or config.FIPE_CONFIG['url']).rstrip('/')
+        self.timeout = timeout or config.FIPE_CONFIG['timeout']
+        self.gravar_em = gravar_em
+        pool = pool or config.FIPE_CONFIG['pool']
+
+        # Sessão persistente com pool de conexões (keep-alive)
+        self.session = requests.Session()
+        retry = Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['POST']
+        )
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(cabecalhos(self.url))
+        self._referencias = None
+        # mes_ano de cada código de referência, para o TTL do cache
+        self._meses = {}
+
+    def consultar(self, endpoint, dados=None):
+        """Envia um POST para um endpoint da API e retorna o JSON da resposta (consulta o cache antes)"""
+        conteudo = cache_fipe.obter(endpoint, dados)
+        if conteudo is not None:
+            return conteudo
+
+        limitador.aguardar()
+        inicio = time.perf_counter()
+        try:
+            resposta = self.session.post(
+                f"{self.url}/api/veiculos/{endpoint}",
+                data=dados or {},
+                timeout=self.timeout
+            )
+            resposta.raise_for_status()
+            conteudo = resposta.json()
+            verificar_erro(endpoint, conteudo)
+        except ErroFipe:
+            # O site respondeu normalmente (ex: ano inexistente na referência): não reduz a taxa
+            limitador.registrar_sucesso()
+            metricas.contar('fipe_erros_total', endpoint=endpoint)
+            raise
+        except Exception:
+            limitador.registrar_falha()
+            metricas.contar('fipe_erros_total', endpoint=endpoint)
+            raise
+        finally:
+            metricas.observar('fipe_requisicao_segundos', time.perf_counter() - inicio, endpoint=endpoint)
+        limitador.registrar_sucesso()
+
+        if self.gravar_em:
+            gravar_resposta(self.gravar_em, endpoint, dados, conteudo)
+        if resposta_cacheavel(conteudo):
+            cache_fipe.gravar(endpoint, dados, conteudo, self._meses.get((dados or {}).get('codigoTabelaReferencia')))
+        return conteudo
+
+    def consultar_tabela_referencia(self):
+        """Retorna a tabela de referências como lista de (codigo, mes_ano)"""
+        if self._referencias is None:
+            self._referencias = ler_tabela_referencia(self.consultar('ConsultarTabelaDeReferencia'))
+            self._meses = {codigo: mes_ano for codigo, mes_ano in self._referencias}
+        return self._referencias
+
+    def codigo_referencia(self, referencia):
+        """Obtém o código da tabela de referência a partir do texto (ex: "janeiro/2025")"""
+        for codigo, mes_ano in self.consultar_tabela_referencia():
+            if mes_ano == referencia:
+                return codigo
+        raise ErroFipe(f"Referência {referencia} não encontrada na tabela da FIPE")
+
+    def consultar_marcas(self, codigo_referencia, tipo_veiculo):
+        """Retorna as marcas como lista de (codigo, nome)"""
+        return ler_opcoes(self.consultar(*requisicao_marcas(codigo_referencia, tipo_veiculo)))
+
+    def consultar_modelos(self, codigo_referencia, tipo_veiculo, codigo_marca):
+        """Retorna os modelos de uma marca como lista de (codigo, nome)"""
+        return ler_modelos(self.consultar(*requisicao_modelos(codigo_referencia, tipo_veiculo, codigo_marca)))
+
+    def consultar_ano_modelo(self, codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo):
+        """Retorna os anos de um modelo como lista de (codigo, descricao), ex: ("2024-1", "2024 Gasolina")"""
+        return ler_opcoes(self.consultar(*requisicao_ano_modelo(
+            codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo
+        )))
+
+    def consultar_valor(self, codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, codigo_ano):
+        """Retorna o JSON completo do valor de um veículo (Valor, CodigoFipe, Combustivel...)"""
+        return self.consultar(*requisicao_valor(
+            codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, codigo_ano
+        ))
+
+    def quit(self):
+        """Fecha a sessão HTTP (mesmo nome do método do webdriver)"""
+        self.session.close()
+
+class ClienteFipeAsync:
+    """Versão assíncrona (aiohttp) do ClienteFipe, usada pelo crawler_fipe.py"""
+
+    def __init__(self, url=None, timeout=None, pool=None, tentativas=3):
+        self.url = (url or config.FIPE_CONFIG['url']).rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout or config.FIPE_CONFIG['timeout'])
+        self.pool = pool or config.FIPE_CONFIG['pool']
+        self.tentativas = tentativas
+        self.session = None
+        # mes_ano de cada código de referência, para o TTL do cache
+        self._meses = {}
+
+    async def __aenter__(self):
+        conector = aiohttp.TCPConnector(limit=self.pool)
+        self.session = aiohttp.ClientSession(
+            connector=conector,
+            timeout=self.timeout,
+            headers=cabecalhos(self.url)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def consultar(self, endpoint, dados=None):
+        """Envia um POST para um endpoint da API, com novas tentativas em erros transitórios (consulta o cache antes)"""
+        conteudo = cache_fipe.obter(endpoint, dados)
+        if conteudo is not None:
+            return conteudo
+
+        for tentativa in range(1, self.tentativas + 1):
+            await limitador.aguardar_async()
+            inicio = time.perf_counter()
+            try:
+                async with self.session.post(f"{self.url}/api/veiculos/{endpoint}", data=dados or {}) as resposta:
+                    resposta.raise_for_status()
+                    conteudo = await resposta.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                limitador.registrar_falha()
+                metricas.observar('fipe_requisicao_segundos', time.perf_counter() - inicio, endpoint=endpoint)
+                # Erros do cliente (4xx) não melhoram com novas tentativas, exceto 429
+                definitivo = isinstance(e, aiohttp.ClientResponseError) and e.status < 500 and e.status != 429
+                if definitivo or tentativa == self.tentativas:
+                    metricas.contar('fipe_erros_total', endpoint=endpoint)
+                    raise
+                # O intervalo até a nova tentativa vem do limitador, que reduziu a taxa
+                metricas.contar('fipe_tentativas_total', endpoint=endpoint)
+                continue
+            metricas.observar('fipe_requisicao_segundos', time.perf_counter() - inicio, endpoint=endpoint)
+
+            try:
+                verificar_erro(endpoint, conteudo)
+            except ErroFipe:
+                # O site respondeu normalmente (ex: ano inexistente na referência): não reduz a taxa
+                limitador.registrar_sucesso()
+                metricas.contar('fipe_erros_total', endpoint=endpoint)
+                raise
+            limitador.registrar_sucesso()
+            if resposta_cacheavel(conteudo):
+                cache_fipe.gravar(endpoint, dados, conteudo, self._meses.get((dados or {}).get('codigoTabelaReferencia')))
+            return conteudo
+
+    async def consultar_tabela_referencia(self):
+        referencias = ler_tabela_referencia(await self.consultar('ConsultarTabelaDeReferencia'))
+        self.registrar_referencias(referencias)
+        return referencias
+
+    def registrar_referencias(self, referencias):
+        """Informa referências (codigo, mes_ano) já conhecidas, ex: com o código gravado no banco"""
+        self._meses.update({codigo: mes_ano for codigo, mes_ano in referencias})
+
+    async def consultar_marcas(self, codigo_referencia, tipo_veiculo):
+        return ler_opcoes(await self.consultar(*requisicao_marcas(codigo_referencia, tipo_veiculo)))
+
+    async def consultar_modelos(self, codigo_referencia, tipo_veiculo, codigo_marca):
+        return ler_modelos(await self.consultar(*requisicao_modelos(codigo_referencia, tipo_veiculo, codigo_marca)))
+
+    async def consultar_modelos_anos(self, codigo_referencia, tipo_veiculo, codigo_marca):
+        """Modelos (codigo, nome) de uma marca e os anos de todos eles, na mesma requisição"""
+        resposta = await self.consultar(*requisicao_modelos(codigo_referencia, tipo_veiculo, codigo_marca))
+        return ler_modelos(resposta), ler_anos_marca(resposta)
+
+    async def consultar_ano_modelo(self, codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo):
+        return ler_opcoes(await self.consultar(*requisicao_ano_modelo(
+            codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo
+        )))
+
+    async def consultar_valor(self, codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, codigo_ano):
+        return await self.consultar(*requisicao_valor(
+            codigo_referencia, tipo_veiculo, codigo_marca, codigo_modelo, codigo_ano
+        ))
+
+# Funções com a mesma assinatura das versões em Selenium dos scripts
+
+def selecionar_tipo_veiculo(driver, tipo_veiculo):
+    """Na API não há aba a ser selecionada; apenas valida o tipo de veículo"""
+    if tipo_veiculo not in CODIGOS_TIPO_VEICULO:
+        logging.error(f"Tipo de veículo '{tipo_veiculo}' inválido")
+        return False
+    return True
+
+def get_referencias_site(driver):
+    """Obtém todas as referências (mes, ano, mes_ano, código) disponíveis na API"""
+    try:
+        referencias = []
+        for codigo, mes_ano in driver.consultar_tabela_referencia():
+            mes, ano = mes_ano.split('/')
+            referencias.append((mes, int(ano), mes_ano, str(codigo)))
+
+        logging.info(f"Encontradas {len(referencias)} referências no site")
+        return referencias
+
+    except Exception as e:
+        logging.error(f"Erro ao obter referências do site: {e}")
+        return []
+
+def get_marcas_site(driver, referencia, wait, tipo_veiculo):
+    """Obtém as marcas (código, nome) da API para uma referência e tipo de veículo"""
+    try:
+        codigo = driver.codigo_referencia(referencia)
+        marcas = [(codigo_marca, nome) for codigo_marca, nome in driver.consultar_marcas(codigo, tipo_veiculo) if nome]
+        if not marcas:
+            # Lista vazia costuma indicar bloqueio do site
+            limitador.registrar_falha()
+        logging.info(f"Encontradas {len(marcas)} marcas para a referência {referencia} do tipo {tipo_veiculo}")
+        return marcas
+
+    except Exception as e:
+        logging.error(f"Erro ao obter marcas do site para referência {referencia} e tipo {tipo_veiculo}: {e}")
+        return []
+
+def adicionar_argumentos(parser):
+    """Adiciona aos scripts as opções de escolha do engine de extração"""
+    parser.add_argument('--engine', choices=['http', 'selenium'], default='selenium',
+                        help="Extrai os dados pela API JSON (http) ou pelo navegador (selenium)")
+    parser.add_argument('--gravar', metavar='DIRETORIO',
+                        help="Grava as respostas da API para uso com o stub_fipe.py (apenas --engine http)")
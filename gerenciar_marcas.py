@@ -1,12 +1,26 @@
-import psycopg2
+import argparse
+import os
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+import socket
+import threading
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait, Select
+from selenium.webdriver.support.ui import Select
 from selenium.webdriver.support import expected_conditions as EC
 import time
+import cache_fipe
 import config
+import conexoes
+import diferencas
+import dimensoes
+import fipe_http
+import impressoes
+import jobs
+import limitador
+import metricas
+import navegador
+from escritor_lote import EscritorLote
+import prontidao
+import rede
 
 # Configuração do logging
 logging.basicConfig(
@@ -21,125 +35,355 @@ logging.basicConfig(
 def get_referencias(cur):
     """Obtém todas as referências do banco"""
     try:
-        cur.execute("SELECT id, mes_ano FROM referencias ORDER BY ano DESC, mes DESC")
+        cur.execute("SELECT id, mes_ano FROM referencias ORDER BY data DESC")
         return [(row[0], row[1]) for row in cur.fetchall()]
     except Exception as e:
         logging.error(f"Erro ao obter referências: {e}")
         return []
 
-def get_marcas_existentes(cur, tipo_veiculo, referencia_id):
-    """Obtém a lista de marcas já existentes no banco para um tipo de veículo e referência"""
-    try:
-        cur.execute(
-            "SELECT nome FROM marcas WHERE tipo_veiculo = %s AND referencia_id = %s",
-            (tipo_veiculo, referencia_id)
-        )
-        return [row[0] for row in cur.fetchall()]
-    except Exception as e:
-        logging.error(f"Erro ao obter marcas existentes: {e}")
-        return []
-
 def selecionar_tipo_veiculo(driver, tipo_veiculo):
     """Seleciona o tipo de veículo na página"""
+    if isinstance(driver, fipe_http.ClienteFipe):
+        return fipe_http.selecionar_tipo_veiculo(driver, tipo_veiculo)
+
+    limitador.aguardar()
     try:
         botao = driver.find_element(By.CSS_SELECTOR, f'div.tab-veiculos ul li.ilustra a[data-slug="{tipo_veiculo}"]')
         driver.execute_script("arguments[0].click();", botao)
+        # Aguarda as referências do tipo selecionado serem carregadas
+        prontidao.aguardar_opcoes(driver, f"selectTabelaReferencia{tipo_veiculo}", nome='tipo_veiculo')
+        limitador.registrar_sucesso()
         logging.info(f"Tipo de veículo '{tipo_veiculo}' selecionado com sucesso!")
-        time.sleep(2)  # Aumentado para garantir o carregamento
         return True
     except Exception as e:
+        limitador.registrar_falha()
         logging.error(f"Erro ao selecionar tipo de veículo '{tipo_veiculo}': {str(e)}")
         return False
 
 def get_marcas_site(driver, referencia, wait, tipo_veiculo):
-    """Obtém a lista de marcas do site para uma referência e tipo de veículo"""
+    """Obtém as marcas (código, nome) do site para uma referência e tipo de veículo"""
+    if isinstance(driver, fipe_http.ClienteFipe):
+        return fipe_http.get_marcas_site(driver, referencia, wait, tipo_veiculo)
+
+    # Lista já obtida em uma execução anterior
+    consulta_cache = {'referencia': referencia, 'tipoVeiculo': tipo_veiculo}
+    marcas = cache_fipe.obter('opcoes_marcas', consulta_cache)
+    if marcas is not None:
+        marcas = [(codigo, nome) for codigo, nome in marcas]
+        logging.info(f"Encontradas {len(marcas)} marcas em cache para a referência {referencia} do tipo {tipo_veiculo}")
+        return marcas
+
     max_retries = 3
     for attempt in range(max_retries):
+        # Respeita a taxa atual e o disjuntor, compartilhados com os outros workers
+        limitador.aguardar()
         try:
             # Encontra e seleciona a referência
-            select_ref = wait.until(
-                EC.presence_of_element_located((By.ID, f"selectTabelaReferencia{tipo_veiculo}"))
-            )
+            select_ref_id = f"selectTabelaReferencia{tipo_veiculo}"
+            select_ref = wait.until(EC.presence_of_element_located((By.ID, select_ref_id)))
             driver.execute_script("arguments[0].style.display = 'block';", select_ref)
-            select = Select(select_ref)
-            select.select_by_visible_text(referencia)
-            logging.info(f"Referência {referencia} selecionada para {tipo_veiculo}")
-            
-            # Aguarda o carregamento das marcas
-            time.sleep(2)  # Aumentado para garantir o carregamento
             
-            # Encontra e obtém a lista de marcas
-            select_marcas = wait.until(
-                EC.presence_of_element_located((By.ID, f"selectMarca{tipo_veiculo}"))
-            )
-            driver.execute_script("arguments[0].style.display = 'block';", select_marcas)
-            select = Select(select_marcas)
+            # Guarda o estado do select de marcas antes da seleção; na captura de rede
+            # basta descartar os eventos anteriores
+            select_marcas_id = f"selectMarca{tipo_veiculo}"
+            captura = config.SELENIUM_CONFIG['captura_rede']
+            if captura:
+                rede.descartar_eventos(driver)
+            else:
+                marcas_anteriores = prontidao.opcoes_select(driver, select_marcas_id)
+                _, concluidas_antes = prontidao.estado_xhr(driver)
             
-            # Obtém todas as opções do select
-            options = select.options
-            marcas = []
-            
-            # Itera sobre as opções para obter o texto
-            for option in options:
-                if option.text and option.text.strip():
-                    marcas.append(option.text.strip())
+            # Código da referência e se ela já está selecionada, em uma única chamada
+            opcao = prontidao.codigo_opcao(driver, select_ref_id, referencia)
+            if opcao is None:
+                raise ValueError(f"Referência {referencia} não encontrada no select")
+            codigo_referencia, selecionada = opcao
+            if selecionada:
+                # Já selecionada: a página não dispara nova requisição
+                marcas = prontidao.aguardar_opcoes(driver, select_marcas_id, nome='marcas')
+            else:
+                with metricas.medir('fipe_etapa_segundos', etapa='selecionar_referencia'):
+                    Select(select_ref).select_by_value(codigo_referencia)
+                logging.info(f"Referência {referencia} selecionada para {tipo_veiculo}")
+                
+                if captura:
+                    # Marcas (código, nome) da resposta JSON recebida pela página, sem ler o select
+                    resposta = rede.aguardar_resposta(
+                        driver, 'ConsultarMarcas', {'codigoTabelaReferencia': codigo_referencia}, nome='marcas'
+                    )
+                    marcas = [(codigo, nome) for codigo, nome in fipe_http.ler_opcoes(resposta) if nome]
+                else:
+                    # Aguarda o carregamento das marcas (nova resposta XHR ou lista alterada)
+                    marcas = prontidao.aguardar_atualizacao_select(
+                        driver, select_marcas_id, marcas_anteriores, concluidas_antes, nome='marcas'
+                    )
             
+            if not marcas:
+                raise ValueError("A página recebeu uma lista de marcas vazia")
+            limitador.registrar_sucesso()
             logging.info(f"Encontradas {len(marcas)} marcas para a referência {referencia} do tipo {tipo_veiculo}")
+            cache_fipe.gravar('opcoes_marcas', consulta_cache, marcas, referencia)
             return marcas
             
         except Exception as e:
+            # Erro ou lista vazia: reduz a taxa (o intervalo até a nova tentativa vem do limitador)
+            limitador.registrar_falha()
             if attempt == max_retries - 1:
+                metricas.contar('fipe_erros_total', etapa='marcas_site')
                 logging.error(f"Erro ao obter marcas do site para referência {referencia} e tipo {tipo_veiculo}: {e}")
                 return []
+            metricas.contar('fipe_tentativas_total', etapa='marcas_site')
             logging.warning(f"Tentativa {attempt + 1} falhou, tentando novamente...")
-            time.sleep(2)  # Espera antes de tentar novamente
 
-def processar_tipo_veiculo(driver, wait, cur, conn, referencias, tipo_veiculo):
-    """Processa as marcas para um tipo específico de veículo"""
-    if not selecionar_tipo_veiculo(driver, tipo_veiculo):
-        return
+def criar_escritor_marcas(conn):
+    """Escritor em lote (COPY) para a tabela de marcas"""
+    return EscritorLote(conn, 'marcas', ['nome', 'tipo_veiculo', 'referencia_id', 'dim_marca_id'])
+
+def processar_referencia(driver, wait, cur, escritor, indice, referencia_id, referencia, tipo_veiculo, usar_impressao=True):
+    """Processa as marcas de uma referência para um tipo de veículo.
+
+    As marcas já gravadas vêm do índice (diferencas.IndiceMarcas), sem consulta
+    por referência. Retorna (marcas adicionadas, impressão) onde a impressão é a
+    tupla a gravar em impressoes_marcas quando o job for concluído.
+    """
+    logging.info(f"Processando referência: {referencia} para {tipo_veiculo}")
+    
+    # Obtém marcas do site
+    marcas = get_marcas_site(driver, referencia, wait, tipo_veiculo)
+    
+    if not marcas:
+        logging.warning(f"Nenhuma marca encontrada para a referência {referencia} do tipo {tipo_veiculo}")
+        raise jobs.JobFalhou("Nenhuma marca encontrada")
+    
+    nomes = [nome for _, nome in marcas]
+    impressao = impressoes.calcular_impressao(nomes)
+    registro_impressao = (referencia_id, tipo_veiculo, impressao, len(marcas))
+    
+    # Lista idêntica à da última extração: nada a gravar
+    if usar_impressao and impressoes.get_impressao(cur, referencia_id, tipo_veiculo) == impressao:
+        logging.info(f"Marcas inalteradas para a referência {referencia} do tipo {tipo_veiculo}")
+        return 0, registro_impressao
+    
+    # Compara com as marcas já gravadas para esta referência
+    novas_marcas, removidas = indice.diferenca(cur, tipo_veiculo, referencia_id, nomes)
+    diferencas.registrar_removidas('marcas', removidas, f"a referência {referencia} do tipo {tipo_veiculo}")
+    
+    if not novas_marcas:
+        logging.info(f"Não há novas marcas para adicionar para a referência {referencia} do tipo {tipo_veiculo}")
+        return 0, registro_impressao
+    
+    # Acumula as novas marcas no lote (gravado ao encher ou ao expirar o intervalo);
+    # o código da FIPE de cada marca fica na dimensão
+    codigos = {nome: codigo for codigo, nome in marcas}
+    dims = dimensoes.marcas(tipo_veiculo, [(codigos[marca], marca) for marca in novas_marcas])
+    for marca in novas_marcas:
+        escritor.adicionar((marca, tipo_veiculo, referencia_id, dims[marca]))
+    indice.adicionar(tipo_veiculo, referencia_id, novas_marcas)
+    
+    logging.info(f"Adicionadas {len(novas_marcas)} novas marcas para a referência {referencia} do tipo {tipo_veiculo}")
+    return len(novas_marcas), registro_impressao
+
+def concluir_lote(cur, jobs_no_lote, impressoes_no_lote):
+    """Conclui os jobs cujas marcas já foram gravadas e grava suas impressões"""
+    jobs.concluir_jobs(cur, jobs_no_lote)
+    impressoes.salvar_impressoes(cur, impressoes_no_lote)
+
+def marcar_existentes_concluidas(cur, registrados_desde):
+    """Conclui os jobs recém-registrados de referências que já têm marcas no banco.
+
+    Cobre bases preenchidas antes do controle de jobs: no modo incremental só as
+    referências sem marcas (ex: o mês novo) são extraídas.
+    """
+    cur.execute("""
+        UPDATE scrape_jobs j
+        SET status = %s, concluido_em = now()
+        WHERE j.etapa = 'marcas' AND j.status = %s AND j.tentativas = 0 AND j.criado_em >= %s
+          AND (EXISTS (SELECT 1 FROM impressoes_marcas i
+                       WHERE i.referencia_id = j.referencia_id AND i.tipo_veiculo = j.tipo_veiculo)
+               OR EXISTS (SELECT 1 FROM marcas m
+                          WHERE m.referencia_id = j.referencia_id AND m.tipo_veiculo = j.tipo_veiculo))
+    """, (jobs.CONCLUIDO, jobs.PENDENTE, registrados_desde))
+    return cur.rowcount
+
+def reivindicar_job(conn, nome_worker):
+    """Reserva o próximo job em uma transação própria, fora do lote de commits do worker"""
+    with conn.cursor() as cur:
+        job = jobs.reivindicar_job(cur, 'marcas', nome_worker)
+    conn.commit()
+    return job
+
+def iniciar_driver(args, pool):
+    """Inicializa o engine escolhido e retorna (sessao, driver, wait).
+
+    No Selenium a sessão é um navegador do pool; no http é o próprio cliente.
+    """
+    if args.engine == 'http':
+        # Cliente HTTP com sessão persistente; não há página a aguardar
+        driver = fipe_http.ClienteFipe(gravar_em=args.gravar)
+        logging.info(f"Usando a API da FIPE em {driver.url}")
+        return driver, driver, None
     
-    for referencia_id, referencia in referencias:
-        logging.info(f"Processando referência: {referencia} para {tipo_veiculo}")
+    # Navegador já aberto na página da FIPE
+    nav = pool.obter()
+    return nav, nav.driver, nav.wait
+
+def worker(numero, args, estatisticas, pool):
+    """Reivindica jobs da etapa 'marcas' na tabela scrape_jobs e os processa com driver e conexão próprios"""
+    nome_worker = f"{socket.gethostname()}-{os.getpid()}-{numero}"
+    processados = 0
+    falhas = 0
+    marcas_adicionadas = 0
+    inicio = time.perf_counter()
+    try:
+        conn = conexoes.obter()
+        cur = conn.cursor()
+        # Os jobs concluídos são confirmados em grupos de POOL_CONFIG['commit_unidades'] (ou a cada intervalo)
+        agrupador = conexoes.AgrupadorCommits(conn)
+        escritor = criar_escritor_marcas(conn)
+        # Marcas já gravadas, carregadas uma vez por tipo de veículo
+        indice = diferencas.IndiceMarcas()
+        sessao, driver, wait = iniciar_driver(args, pool)
+        logging.info(f"Worker {numero} iniciado")
         
-        try:
-            # Obtém marcas existentes para esta referência
-            marcas_existentes = get_marcas_existentes(cur, tipo_veiculo, referencia_id)
-            
-            # Obtém marcas do site
-            marcas = get_marcas_site(driver, referencia, wait, tipo_veiculo)
-            
-            if not marcas:
-                logging.warning(f"Nenhuma marca encontrada para a referência {referencia} do tipo {tipo_veiculo}")
-                continue
-            
-            # Filtra apenas as marcas que não existem no banco para esta referência
-            novas_marcas = [marca for marca in marcas if marca not in marcas_existentes]
+        tipo_veiculo_atual = None
+        # Jobs cujas marcas ainda estão no lote do escritor; só são concluídos
+        # (e suas impressões gravadas) na mesma transação em que suas marcas forem gravadas
+        jobs_no_lote = []
+        impressoes_no_lote = []
+        while True:
+            job = conexoes.executar(reivindicar_job, nome_worker)
+            if job is None:
+                break
+            job_id, referencia_id, referencia, tipo_veiculo = job
             
-            if not novas_marcas:
-                logging.info(f"Não há novas marcas para adicionar para a referência {referencia} do tipo {tipo_veiculo}")
-                continue
+            try:
+                agrupador.iniciar()
+                # Span da unidade (tipo de veículo, referência): agrupa os tempos do job
+                with metricas.unidade(tipo_veiculo, referencia):
+                    # Se mudou o tipo de veículo, seleciona o novo tipo
+                    if tipo_veiculo != tipo_veiculo_atual:
+                        with metricas.medir('fipe_etapa_segundos', etapa='selecionar_tipo_veiculo'):
+                            selecionado = selecionar_tipo_veiculo(driver, tipo_veiculo)
+                        if not selecionado:
+                            tipo_veiculo_atual = None
+                            raise jobs.JobFalhou(f"Erro ao selecionar tipo de veículo '{tipo_veiculo}'")
+                        tipo_veiculo_atual = tipo_veiculo
+                    
+                    with metricas.medir('fipe_etapa_segundos', etapa='processar_referencia'):
+                        adicionadas, impressao = processar_referencia(
+                            driver, wait, cur, escritor, indice, referencia_id, referencia, tipo_veiculo,
+                            usar_impressao=not args.reiniciar
+                        )
+                    metricas.contar('fipe_itens_total', adicionadas, etapa='marcas')
+                marcas_adicionadas += adicionadas
+                jobs_no_lote.append(job_id)
+                impressoes_no_lote.append(impressao)
+                if not escritor.linhas:
+                    concluir_lote(cur, jobs_no_lote, impressoes_no_lote)
+                    jobs_no_lote = []
+                    impressoes_no_lote = []
+                agrupador.concluir(job_id)
+                processados += 1
             
-            # Insere as novas marcas no banco
-            for marca in novas_marcas:
-                cur.execute(
-                    "INSERT INTO marcas (nome, tipo_veiculo, referencia_id) VALUES (%s, %s, %s)",
-                    (marca, tipo_veiculo, referencia_id)
-                )
+            except Exception as e:
+                if not isinstance(e, jobs.JobFalhou):
+                    logging.error(f"Erro ao processar referência {referencia} do tipo {tipo_veiculo}: {str(e)}")
+                # Desfaz só o job atual; se a transação inteira for perdida, os jobs concluídos nela voltam para pendente
+                perdidos = agrupador.desfazer_unidade()
+                # As marcas do lote descartado podem já estar no índice
+                indice.descartar()
+                metricas.contar('fipe_erros_total', etapa='marcas')
+                jobs.falhar_job(cur, job_id, e)
+                if escritor.linhas:
+                    # Os jobs do lote do escritor continuam nele e serão concluídos com ele
+                    perdidos = [perdido for perdido in perdidos if perdido not in jobs_no_lote]
+                else:
+                    # O lote com as marcas dos jobs anteriores foi descartado
+                    perdidos = sorted(set(perdidos) | set(jobs_no_lote))
+                    jobs_no_lote = []
+                    impressoes_no_lote = []
+                jobs.liberar_jobs(cur, perdidos)
+                agrupador.confirmar()
+                falhas += 1
             
-            conn.commit()
-            logging.info(f"Adicionadas {len(novas_marcas)} novas marcas para a referência {referencia} do tipo {tipo_veiculo}")
-            
-        except Exception as e:
-            logging.error(f"Erro ao processar referência {referencia} do tipo {tipo_veiculo}: {str(e)}")
-            conn.rollback()
-            continue
+            # Troca o navegador por um da reserva após muitas operações ou uso excessivo de memória
+            if isinstance(sessao, navegador.Navegador):
+                sessao.registrar_operacao()
+                if sessao.precisa_reciclar():
+                    sessao = pool.reciclar(sessao)
+                    driver, wait = sessao.driver, sessao.wait
+                    tipo_veiculo_atual = None
+        
+        # Grava o que restou no lote
+        escritor.flush()
+        concluir_lote(cur, jobs_no_lote, impressoes_no_lote)
+        agrupador.confirmar()
+    
+    except Exception as e:
+        logging.error(f"Erro no worker {numero}: {e}")
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conexoes.devolver(conn)
+        if 'sessao' in locals():
+            sessao.quit()
+        estatisticas[numero] = (processados, falhas, marcas_adicionadas, time.perf_counter() - inicio)
+
+def executar_workers(args):
+    """Executa N workers paralelos que reivindicam os jobs pendentes do banco"""
+    estatisticas = {}
+    pool = None
+    if args.engine == 'selenium':
+        # Abre os navegadores de todos os workers em paralelo
+        pool = navegador.PoolNavegadores()
+        pool.aquecer(args.workers + pool.reserva)
+    threads = [
+        threading.Thread(target=worker, args=(numero, args, estatisticas, pool), name=f"worker-{numero}")
+        for numero in range(1, args.workers + 1)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if pool:
+        pool.encerrar()
+    
+    # Relatório de vazão por worker
+    for numero in sorted(estatisticas):
+        processados, falhas, marcas_adicionadas, duracao = estatisticas[numero]
+        por_minuto = processados / duracao * 60 if duracao else 0
+        logging.info(
+            f"Worker {numero}: {processados} referências em {duracao:.1f}s "
+            f"({por_minuto:.1f}/min), {falhas} falhas, {marcas_adicionadas} marcas adicionadas"
+        )
+    total = sum(processados for processados, _, _, _ in estatisticas.values())
+    logging.info(f"Total: {total} referências processadas por {len(estatisticas)} workers")
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(description="Coleta as marcas de veículos de todas as referências")
+    fipe_http.adicionar_argumentos(parser)
+    cache_fipe.adicionar_argumentos(parser)
+    metricas.adicionar_argumentos(parser)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Número de workers paralelos, cada um com driver e conexões próprios")
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument('--revalidar', action='store_true',
+                      help="Verifica novamente as referências já concluídas, gravando só as que mudaram")
+    modo.add_argument('--reiniciar', action='store_true',
+                      help="Processa novamente todas as referências, ignorando as impressões gravadas")
+    return parser.parse_args()
 
 def main():
+    args = parse_argumentos()
     try:
-        # Conecta ao banco de dados
+        cache_fipe.configurar(args.cache)
+        metricas.configurar(args.metricas_porta, args.metricas_json)
+        
+        # Conecta ao banco de dados; cada worker usa duas conexões do pool (jobs e gravação)
         logging.info("Conectando ao banco de dados...")
-        conn = psycopg2.connect(**config.DB_CONFIG)
+        conexoes.configurar(maximo=max(config.POOL_CONFIG['maximo'], 2 * args.workers + 1))
+        conn = conexoes.obter()
         cur = conn.cursor()
         
         # Obtém as referências do banco
@@ -150,35 +394,31 @@ def main():
             logging.info("Não há referências para processar")
             return
         
-        # Configuração do Chrome
-        chrome_options = Options()
-        if config.SELENIUM_CONFIG['headless']:
-            chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options.add_argument('--window-size=1920,1080')
-        chrome_options.add_argument('--disable-gpu')
-        chrome_options.add_argument('--disable-extensions')
-        chrome_options.add_argument('--disable-infobars')
-        
-        # Inicializa o driver
-        driver = webdriver.Chrome(options=chrome_options)
-        
-        # Acessa a página
-        url = "https://veiculos.fipe.org.br/"
-        driver.get(url)
-        logging.info(f"Acessando a página: {url}")
+        # Registra um job por (referência, tipo de veículo); os já existentes são mantidos,
+        # então uma execução interrompida continua de onde parou
+        tipos_veiculos = ['carro', 'caminhao', 'moto']
+        inicio_registro = jobs.agora(cur)
+        jobs.registrar_jobs(cur, 'marcas', [
+            (referencia_id, tipo_veiculo)
+            for tipo_veiculo in tipos_veiculos
+            for referencia_id, _ in referencias
+        ])
+        if args.reiniciar or args.revalidar:
+            logging.info(f"{jobs.reiniciar_jobs(cur, 'marcas')} jobs voltaram para pendente")
+        else:
+            # Modo incremental: só extrai as referências ainda sem marcas
+            existentes = marcar_existentes_concluidas(cur, inicio_registro)
+            if existentes:
+                logging.info(f"{existentes} referências já tinham marcas no banco e foram marcadas como concluídas")
+        conn.commit()
         
-        # Aguarda o carregamento da página
-        wait = WebDriverWait(driver, 10)
-        wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-        time.sleep(3)  # Aumentado para garantir o carregamento inicial
+        pendentes = jobs.contar_jobs(cur, 'marcas', jobs.PENDENTE)
+        logging.info(f"{pendentes} referências pendentes para extrair")
         
-        # Processa cada tipo de veículo
-        tipos_veiculos = ['carro', 'caminhao', 'moto']
-        for tipo_veiculo in tipos_veiculos:
-            logging.info(f"Iniciando processamento para {tipo_veiculo}")
-            processar_tipo_veiculo(driver, wait, cur, conn, referencias, tipo_veiculo)
+        # Sem jobs pendentes nem abandonados não há por que abrir navegadores
+        if pendentes or jobs.contar_jobs(cur, 'marcas', jobs.EM_ANDAMENTO):
+            executar_workers(args)
+        jobs.resumo_jobs(cur, 'marcas')
         
         logging.info("Processo concluído com sucesso!")
         
@@ -187,12 +427,16 @@ def main():
         if 'conn' in locals():
             conn.rollback()
     finally:
+        prontidao.resumo_esperas()
+        limitador.registrar_estado()
+        cache_fipe.encerrar()
+        dimensoes.encerrar()
+        metricas.encerrar()
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
-        if 'driver' in locals():
-            driver.quit()
+            conexoes.devolver(conn)
+        conexoes.encerrar()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,12 +1,20 @@
-import psycopg2
+import argparse
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from psycopg2.extras import execute_values
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait, Select
+from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import time
 import config
+import conexoes
+from conversoes import data_referencia
+import fipe_http
+import limitador
+import metricas
+import particoes
+import navegador
+from escritor_lote import EscritorLote
+import prontidao
+import rede
 
 # Configuração do logging
 logging.basicConfig(
@@ -19,11 +27,20 @@ logging.basicConfig(
 )
 
 def get_referencias_site(driver):
-    """Obtém todas as referências disponíveis no site"""
+    """Obtém todas as referências (mes, ano, mes_ano, código) disponíveis no site"""
+    if isinstance(driver, fipe_http.ClienteFipe):
+        return fipe_http.get_referencias_site(driver)
+
+    limitador.aguardar()
     try:
         # Aguarda o carregamento da página
         wait = WebDriverWait(driver, 10)
         
+        # Na captura de rede, só interessam as requisições feitas a partir do clique
+        captura = config.SELENIUM_CONFIG['captura_rede']
+        if captura:
+            rede.descartar_eventos(driver)
+        
         # Encontra e clica no botão de carros
         botao = wait.until(
             EC.presence_of_element_located((By.CSS_SELECTOR, 'div.tab-veiculos ul li.ilustra a[data-slug="carro"]'))
@@ -31,93 +48,110 @@ def get_referencias_site(driver):
         driver.execute_script("arguments[0].click();", botao)
         logging.info("Botão de carros clicado com sucesso!")
         
-        # Aguarda um pouco para o carregamento
-        time.sleep(3)
-        
-        # Encontra o select de referências
-        select_ref = wait.until(
-            EC.presence_of_element_located((By.ID, "selectTabelaReferenciacarro"))
-        )
-        # Usa JavaScript para tornar o elemento visível
-        driver.execute_script("arguments[0].style.display = 'block';", select_ref)
-        select = Select(select_ref)
+        if captura:
+            # Referências (código, mes_ano) da resposta JSON recebida pela página, sem ler o select
+            resposta = rede.aguardar_resposta(driver, 'ConsultarTabelaDeReferencia', nome='referencias')
+            opcoes = [(str(codigo), mes_ano) for codigo, mes_ano in fipe_http.ler_tabela_referencia(resposta)]
+        else:
+            # Aguarda as referências serem carregadas no select; as opções (código, texto)
+            # vêm todas em uma única chamada ao navegador
+            prontidao.instalar_monitor_xhr(driver)
+            opcoes = prontidao.aguardar_opcoes(driver, "selectTabelaReferenciacarro", nome='referencias')
         
-        # Obtém todas as opções do select
-        options = select.options
         referencias = []
+        for codigo, mes_ano in opcoes:
+            mes, ano = mes_ano.split('/')
+            referencias.append((mes, int(ano), mes_ano, codigo))
         
-        # Itera sobre as opções para obter o texto
-        for option in options:
-            if option.text and option.text.strip():
-                mes_ano = option.text.strip()
-                mes, ano = mes_ano.split('/')
-                referencias.append((mes, int(ano), mes_ano))
-        
+        limitador.registrar_sucesso()
         logging.info(f"Encontradas {len(referencias)} referências no site")
         return referencias
         
     except Exception as e:
+        limitador.registrar_falha()
         logging.error(f"Erro ao obter referências do site: {e}")
         return []
 
 def get_referencias_banco(cur):
-    """Obtém todas as referências já existentes no banco"""
+    """Obtém todas as referências já existentes no banco como {mes_ano: código}"""
     try:
-        cur.execute("SELECT mes, ano, mes_ano FROM referencias")
-        return [(row[0], row[1], row[2]) for row in cur.fetchall()]
+        cur.execute("SELECT mes_ano, codigo_fipe FROM referencias")
+        return {row[0]: row[1] for row in cur.fetchall()}
     except Exception as e:
         logging.error(f"Erro ao obter referências do banco: {e}")
-        return []
+        return {}
 
 def inserir_referencias(cur, referencias):
-    """Insere novas referências no banco"""
+    """Insere novas referências no banco em um único lote; retorna {mes_ano: id}"""
     try:
-        for mes, ano, mes_ano in referencias:
-            cur.execute(
-                "INSERT INTO referencias (mes, ano, mes_ano) VALUES (%s, %s, %s) ON CONFLICT (mes_ano) DO NOTHING",
-                (mes, ano, mes_ano)
-            )
+        escritor = EscritorLote(cur.connection, 'referencias', ['mes', 'ano', 'mes_ano', 'data', 'codigo_fipe'], chave=['mes_ano'])
+        gravadas = escritor.gravar(
+            [(mes, ano, mes_ano, data_referencia(mes_ano), codigo) for mes, ano, mes_ano, codigo in referencias],
+            retornar_ids=True
+        )
+        ids = {mes_ano: referencia_id for (mes_ano,), referencia_id in gravadas.items()}
+        # Partições do novo mês nas tabelas particionadas (anos e valores)
+        particoes.criar_particoes(cur, list(ids.values()))
+        for mes, ano, mes_ano, codigo in referencias:
             logging.info(f"Referência {mes_ano} processada")
+        return ids
         
     except Exception as e:
         logging.error(f"Erro ao inserir referências: {e}")
         raise
 
+def atualizar_codigos(cur, codigos):
+    """Grava o código da FIPE das referências já existentes que ainda não o têm; codigos é [(mes_ano, código)]"""
+    execute_values(cur, """
+        UPDATE referencias r SET codigo_fipe = v.codigo
+        FROM (VALUES %s) AS v (mes_ano, codigo)
+        WHERE r.mes_ano = v.mes_ano
+    """, codigos)
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(description="Coleta as referências disponíveis na tabela FIPE")
+    fipe_http.adicionar_argumentos(parser)
+    metricas.adicionar_argumentos(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_argumentos()
     try:
+        metricas.configurar(args.metricas_porta, args.metricas_json)
+        
         # Conecta ao banco de dados
         logging.info("Conectando ao banco de dados...")
-        conn = psycopg2.connect(**config.DB_CONFIG)
+        conn = conexoes.obter()
         cur = conn.cursor()
         
-        # Configuração do Chrome
-        chrome_options = Options()
-        if config.SELENIUM_CONFIG['headless']:
-            chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options.add_argument('--window-size=1920,1080')
-        chrome_options.add_argument('--disable-gpu')
-        chrome_options.add_argument('--disable-extensions')
-        chrome_options.add_argument('--disable-infobars')
-        
-        # Inicializa o driver
-        driver = webdriver.Chrome(options=chrome_options)
-        
-        # Acessa a página
-        url = "https://veiculos.fipe.org.br/"
-        driver.get(url)
-        logging.info(f"Acessando a página: {url}")
+        if args.engine == 'http':
+            # Cliente HTTP com sessão persistente
+            driver = fipe_http.ClienteFipe(gravar_em=args.gravar)
+            logging.info(f"Usando a API da FIPE em {driver.url}")
+        else:
+            # Navegador já aberto na página da FIPE
+            sessao = navegador.Navegador()
+            driver = sessao.driver
         
         # Obtém referências do site
-        referencias_site = get_referencias_site(driver)
+        with metricas.medir('fipe_etapa_segundos', etapa='referencias_site'):
+            referencias_site = get_referencias_site(driver)
+        metricas.contar('fipe_itens_total', len(referencias_site), etapa='referencias')
         
         # Obtém referências do banco
         referencias_banco = get_referencias_banco(cur)
         
         # Filtra apenas as novas referências
-        referencias_banco_set = {(m, a, ma) for m, a, ma in referencias_banco}
-        novas_referencias = [ref for ref in referencias_site if ref not in referencias_banco_set]
+        novas_referencias = [ref for ref in referencias_site if ref[2] not in referencias_banco]
+        
+        # Referências gravadas antes dos códigos (ou cujo código mudou) recebem o código do site
+        codigos = [
+            (mes_ano, codigo) for _, _, mes_ano, codigo in referencias_site
+            if mes_ano in referencias_banco and referencias_banco[mes_ano] != codigo
+        ]
+        if codigos:
+            atualizar_codigos(cur, codigos)
+            logging.info(f"Código da FIPE gravado em {len(codigos)} referências existentes")
         
         if not novas_referencias:
             logging.info("Não há novas referências para adicionar")
@@ -134,11 +168,17 @@ def main():
         if 'conn' in locals():
             conn.rollback()
     finally:
+        prontidao.resumo_esperas()
+        limitador.registrar_estado()
+        metricas.encerrar()
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
-        if 'driver' in locals():
+            conexoes.devolver(conn)
+        conexoes.encerrar()
+        if 'sessao' in locals():
+            sessao.quit()
+        elif 'driver' in locals():
             driver.quit()
 
 if __name__ == "__main__":
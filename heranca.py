@@ -0,0 +1,102 @@
+import logging
+from collections import Counter, defaultdict
+import jobs
+
+# Última referência anterior (pela data) com o job do tipo de veículo concluído
+CONSULTA_REFERENCIA_ANTERIOR = """
+    SELECT r.id, r.mes_ano FROM referencias r
+    JOIN scrape_jobs j ON j.referencia_id = r.id
+    WHERE j.etapa = %(etapa)s AND j.tipo_veiculo = %(tipo)s AND j.status = %(concluido)s
+      AND r.data < (SELECT data FROM referencias WHERE id = %(referencia)s)
+    ORDER BY r.data DESC
+    LIMIT 1
+"""
+
+# Árvore marca → modelo → ano gravada em uma referência, pelos ids nas dimensões
+CONSULTA_ARVORE = """
+    SELECT ma.dim_marca_id, ma.nome, mo.dim_modelo_id, a.codigo_fipe, a.ano FROM anos a
+    JOIN modelos mo ON mo.id = a.modelo_id
+    JOIN marcas ma ON ma.id = mo.marca_id
+    WHERE ma.tipo_veiculo = %(tipo)s AND a.referencia_id = %(referencia)s
+      AND mo.dim_modelo_id IS NOT NULL
+"""
+
+class ArvoreAnterior:
+    """Árvore marca → modelo → anos de uma referência já coletada, ponto de partida da seguinte.
+
+    Guarda os anos (código, descrição) de cada modelo (id em dim_modelos). Os
+    modelos com algum ano sem o código da FIPE (gravados antes da coluna existir)
+    ficam de fora e têm os anos consultados normalmente. Também conta as
+    diferenças encontradas em relação à referência nova, para o resumo do job.
+    """
+
+    def __init__(self, mes_ano, linhas):
+        self.mes_ano = mes_ano
+        self.nomes_marcas = set()
+        self.modelos_marcas = defaultdict(set)
+        self.anos_modelos = defaultdict(list)
+        sem_codigo = set()
+        for dim_marca_id, marca, dim_modelo_id, codigo, ano in linhas:
+            self.nomes_marcas.add(marca)
+            self.modelos_marcas[dim_marca_id].add(dim_modelo_id)
+            if codigo is None:
+                sem_codigo.add(dim_modelo_id)
+            else:
+                self.anos_modelos[dim_modelo_id].append((codigo, ano))
+        for dim_modelo_id in sem_codigo:
+            self.anos_modelos.pop(dim_modelo_id, None)
+        self.contagem = Counter()
+
+    def comparar_marcas(self, marcas):
+        """Conta as marcas novas e as que sumiram em relação à referência anterior"""
+        atuais = set(marcas)
+        self.contagem['marcas_novas'] += len(atuais - self.nomes_marcas)
+        self.contagem['marcas_removidas'] += len(self.nomes_marcas - atuais)
+
+    def herdaveis(self, dim_marca_id, dim_modelo_ids, anos_marca):
+        """Anos {dim_modelo_id: [(código, descrição)]} que podem ser reaproveitados nos modelos de uma marca.
+
+        anos_marca são os anos (código, descrição) que a API devolve junto com os
+        modelos da marca. Se eles não forem exatamente os anos herdados, a marca
+        ganhou ou perdeu anos e nenhum modelo dela é herdado; se a resposta não os
+        trouxer, os anos dos modelos já conhecidos são herdados.
+
+        A lista da marca não diz a que modelo cada ano pertence, então isso não
+        prova que os anos de cada modelo continuam os mesmos: um ano que um modelo
+        conhecido ganhe e que outro modelo da marca já tivesse (ex: "2025-1") não
+        muda a lista e não é consultado. Esses anos só entram no crawl completo.
+        """
+        atuais = set(dim_modelo_ids)
+        anteriores = self.modelos_marcas.get(dim_marca_id, set())
+        self.contagem['modelos_novos'] += len(atuais - anteriores)
+        self.contagem['modelos_removidos'] += len(anteriores - atuais)
+
+        herdados = {m: self.anos_modelos[m] for m in atuais if m in self.anos_modelos}
+        if herdados and anos_marca:
+            codigos = {codigo for anos in herdados.values() for codigo, _ in anos}
+            if codigos != {codigo for codigo, _ in anos_marca}:
+                self.contagem['marcas_alteradas'] += 1
+                herdados = {}
+        self.contagem['modelos_herdados'] += len(herdados)
+        self.contagem['modelos_consultados'] += len(atuais) - len(herdados)
+        return herdados
+
+    def resumo(self, origem):
+        c = self.contagem
+        logging.info(
+            f"{origem} em relação a {self.mes_ano}: marcas +{c['marcas_novas']}/-{c['marcas_removidas']}, "
+            f"modelos +{c['modelos_novos']}/-{c['modelos_removidos']}, "
+            f"{c['modelos_herdados']} modelos com os anos herdados e {c['modelos_consultados']} consultados "
+            f"({c['marcas_alteradas']} marcas com anos alterados, {c['anos_removidos']} anos herdados removidos)"
+        )
+
+def carregar(cur, tipo_veiculo, referencia_id, etapa='crawl'):
+    """Árvore da última referência anterior já coletada do tipo de veículo (None se não houver)"""
+    cur.execute(CONSULTA_REFERENCIA_ANTERIOR, {
+        'etapa': etapa, 'tipo': tipo_veiculo, 'concluido': jobs.CONCLUIDO, 'referencia': referencia_id
+    })
+    anterior = cur.fetchone()
+    if anterior is None:
+        return None
+    cur.execute(CONSULTA_ARVORE, {'tipo': tipo_veiculo, 'referencia': anterior[0]})
+    return ArvoreAnterior(anterior[1], cur.fetchall())
@@ -0,0 +1,37 @@
+import hashlib
+from psycopg2.extras import execute_values
+import conexoes
+
+GET_IMPRESSAO = conexoes.preparar(
+    'get_impressao', "SELECT impressao FROM impressoes_marcas WHERE referencia_id = %s AND tipo_veiculo = %s"
+)
+
+def calcular_impressao(opcoes):
+    """Impressão digital (sha1) de uma lista de opções, independente da ordem"""
+    conteudo = '\n'.join(sorted(set(opcoes)))
+    return hashlib.sha1(conteudo.encode('utf-8')).hexdigest()
+
+def get_impressao(cur, referencia_id, tipo_veiculo):
+    """Impressão das marcas gravada na última extração bem-sucedida (None se não houver)"""
+    conexoes.executar_preparada(cur, GET_IMPRESSAO, (referencia_id, tipo_veiculo))
+    linha = cur.fetchone()
+    return linha[0] if linha else None
+
+def salvar_impressoes(cur, impressoes):
+    """Grava as impressões (referencia_id, tipo_veiculo, impressao, total_marcas).
+
+    alterado_em só muda quando a impressão é diferente da gravada anteriormente.
+    O chamador deve fazer commit.
+    """
+    if not impressoes:
+        return
+    execute_values(cur, """
+        INSERT INTO impressoes_marcas (referencia_id, tipo_veiculo, impressao, total_marcas)
+        VALUES %s
+        ON CONFLICT (referencia_id, tipo_veiculo) DO UPDATE
+        SET impressao = EXCLUDED.impressao,
+            total_marcas = EXCLUDED.total_marcas,
+            verificado_em = now(),
+            alterado_em = CASE WHEN impressoes_marcas.impressao = EXCLUDED.impressao
+                               THEN impressoes_marcas.alterado_em ELSE now() END
+    """, list(impressoes))
@@ -0,0 +1,135 @@
+import logging
+import config
+import conexoes
+from escritor_lote import EscritorLote
+
+# Status possíveis de um job
+PENDENTE = 'pendente'
+EM_ANDAMENTO = 'em_andamento'
+CONCLUIDO = 'concluido'
+FALHOU = 'falhou'
+
+class JobFalhou(Exception):
+    """Falha esperada de um job (ex: site não retornou marcas), já registrada no log"""
+
+def chave_job(etapa, tipo_veiculo, referencia_id):
+    return f"{etapa}:{tipo_veiculo}:{referencia_id}"
+
+def agora(cur):
+    """Instante atual no relógio do banco (mesma referência das colunas de tempo dos jobs)"""
+    cur.execute("SELECT localtimestamp")
+    return cur.fetchone()[0]
+
+def registrar_jobs(cur, etapa, itens):
+    """Registra os jobs (referencia_id, tipo_veiculo) de uma etapa; os já existentes são mantidos"""
+    escritor = EscritorLote(cur.connection, 'scrape_jobs', ['chave', 'etapa', 'referencia_id', 'tipo_veiculo'], chave=['chave'])
+    return escritor.gravar(
+        [(chave_job(etapa, tipo_veiculo, referencia_id), etapa, referencia_id, tipo_veiculo) for referencia_id, tipo_veiculo in itens]
+    )
+
+# Consultas executadas a cada job, preparadas no servidor
+REIVINDICAR_JOB = conexoes.preparar('reivindicar_job', """
+    UPDATE scrape_jobs j
+    SET status = %s, tentativas = j.tentativas + 1, worker = %s,
+        iniciado_em = now(), concluido_em = NULL, duracao_segundos = NULL
+    FROM referencias r
+    WHERE r.id = j.referencia_id AND j.id = (
+        SELECT id FROM scrape_jobs
+        WHERE etapa = %s
+          AND tentativas < %s
+          AND (%s::timestamp IS NULL OR concluido_em IS NULL OR concluido_em < %s)
+          AND (%s::integer[] IS NULL OR referencia_id = ANY(%s))
+          AND (%s::varchar[] IS NULL OR tipo_veiculo = ANY(%s))
+          AND (status = ANY(%s)
+               OR (status = %s AND iniciado_em < now() - make_interval(mins => %s)))
+        ORDER BY tipo_veiculo, referencia_id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING j.id, j.referencia_id, r.mes_ano, j.tipo_veiculo
+""")
+
+CONCLUIR_JOBS = conexoes.preparar('concluir_jobs', """
+    UPDATE scrape_jobs
+    SET status = %s, ultimo_erro = NULL, concluido_em = now(),
+        duracao_segundos = EXTRACT(EPOCH FROM now() - iniciado_em)
+    WHERE id = ANY(%s::integer[])
+""")
+
+FALHAR_JOB = conexoes.preparar('falhar_job', """
+    UPDATE scrape_jobs
+    SET status = %s, ultimo_erro = %s, concluido_em = now(),
+        duracao_segundos = EXTRACT(EPOCH FROM now() - iniciado_em)
+    WHERE id = %s
+""")
+
+def reivindicar_job(cur, etapa, worker, status=(PENDENTE,), finalizados_antes_de=None,
+                    referencia_ids=None, tipos_veiculos=None):
+    """Reserva o próximo job da etapa com um dos status informados.
+
+    Usa FOR UPDATE SKIP LOCKED, então vários workers podem reivindicar ao mesmo
+    tempo sem pegar o mesmo job. Jobs em andamento há mais de
+    JOBS_CONFIG['expiracao_minutos'] (ex: processo interrompido) são retomados.
+    Com finalizados_antes_de, ignora jobs que falharam depois desse instante
+    (evita repetir na mesma execução um job que acabou de falhar).
+    referencia_ids e tipos_veiculos restringem os jobs reivindicados.
+    Retorna (job_id, referencia_id, mes_ano, tipo_veiculo) ou None. O chamador deve fazer commit.
+    """
+    conexoes.executar_preparada(cur, REIVINDICAR_JOB, (
+        EM_ANDAMENTO, worker, etapa, config.JOBS_CONFIG['max_tentativas'],
+        finalizados_antes_de, finalizados_antes_de,
+        referencia_ids, referencia_ids, tipos_veiculos, tipos_veiculos, list(status),
+        EM_ANDAMENTO, config.JOBS_CONFIG['expiracao_minutos']
+    ))
+    return cur.fetchone()
+
+def concluir_jobs(cur, job_ids):
+    """Marca os jobs como concluídos e registra a duração"""
+    if not job_ids:
+        return
+    conexoes.executar_preparada(cur, CONCLUIR_JOBS, (CONCLUIDO, list(job_ids)))
+
+def falhar_job(cur, job_id, erro):
+    """Marca o job como falho com a mensagem de erro"""
+    conexoes.executar_preparada(cur, FALHAR_JOB, (FALHOU, str(erro)[:1000], job_id))
+
+def liberar_jobs(cur, job_ids):
+    """Devolve os jobs para pendente sem contar a tentativa (ex: lote descartado por erro de outro job)"""
+    if not job_ids:
+        return
+    cur.execute("""
+        UPDATE scrape_jobs
+        SET status = %s, tentativas = GREATEST(tentativas - 1, 0), worker = NULL, iniciado_em = NULL
+        WHERE id = ANY(%s)
+    """, (PENDENTE, list(job_ids)))
+
+def marcar_para_reprocessar(cur, etapa, itens):
+    """Registra os jobs (referencia_id, tipo_veiculo) informados como falhos, com as tentativas zeradas"""
+    registrar_jobs(cur, etapa, itens)
+    cur.execute("""
+        UPDATE scrape_jobs
+        SET status = %s, tentativas = 0
+        WHERE chave = ANY(%s) AND status <> %s
+    """, (FALHOU, [chave_job(etapa, tipo_veiculo, referencia_id) for referencia_id, tipo_veiculo in itens], EM_ANDAMENTO))
+    return cur.rowcount
+
+def contar_jobs(cur, etapa, status):
+    """Quantidade de jobs da etapa com o status informado"""
+    cur.execute("SELECT COUNT(*) FROM scrape_jobs WHERE etapa = %s AND status = %s", (etapa, status))
+    return cur.fetchone()[0]
+
+def reiniciar_jobs(cur, etapa):
+    """Volta todos os jobs da etapa para pendente, para uma nova execução completa"""
+    cur.execute("""
+        UPDATE scrape_jobs
+        SET status = %s, tentativas = 0, ultimo_erro = NULL, worker = NULL,
+            iniciado_em = NULL, concluido_em = NULL, duracao_segundos = NULL
+        WHERE etapa = %s
+    """, (PENDENTE, etapa))
+    return cur.rowcount
+
+def resumo_jobs(cur, etapa):
+    """Registra no log a quantidade de jobs da etapa por status"""
+    cur.execute("SELECT status, COUNT(*) FROM scrape_jobs WHERE etapa = %s GROUP BY status ORDER BY status", (etapa,))
+    contagem = ', '.join(f"{status}: {total}" for status, total in cur.fetchall())
+    logging.info(f"Jobs da etapa {etapa} - {contagem or 'nenhum'}")
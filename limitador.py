@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import threading
+import time
+import config
+import metricas
+
+FECHADO = 'fechado'
+ABERTO = 'aberto'
+MEIO_ABERTO = 'meio-aberto'
+
+class LimitadorTaxa:
+    """Limitador de taxa (token bucket) com ajuste AIMD e disjuntor, compartilhado por todos os workers.
+
+    Cada chamada bem-sucedida aumenta a taxa em LIMITADOR_INCREMENTO req/s
+    (até LIMITADOR_TAXA_MAXIMA); cada erro ou resultado vazio a multiplica por
+    LIMITADOR_FATOR_REDUCAO (até LIMITADOR_TAXA_MINIMA). Após
+    LIMITADOR_LIMITE_FALHAS falhas consecutivas o disjuntor abre e todas as
+    chamadas ficam paradas por LIMITADOR_PAUSA_SEGUNDOS; depois disso uma
+    chamada de teste fecha o disjuntor se der certo ou o reabre se falhar.
+    Pode ser usado por threads e por corrotinas ao mesmo tempo.
+    """
+
+    def __init__(self, taxa_inicial=None, taxa_minima=None, taxa_maxima=None, incremento=None,
+                 fator_reducao=None, rajada=None, limite_falhas=None, pausa_segundos=None, intervalo_log=None):
+        cfg = config.LIMITADOR_CONFIG
+        self.taxa_minima = taxa_minima or cfg['taxa_minima']
+        self.taxa_maxima = taxa_maxima or cfg['taxa_maxima']
+        self.taxa = min(max(taxa_inicial or cfg['taxa_inicial'], self.taxa_minima), self.taxa_maxima)
+        self.incremento = incremento or cfg['incremento']
+        self.fator_reducao = fator_reducao or cfg['fator_reducao']
+        self.rajada = rajada or cfg['rajada']
+        self.limite_falhas = limite_falhas or cfg['limite_falhas']
+        self.pausa_segundos = pausa_segundos or cfg['pausa_segundos']
+        self.intervalo_log = intervalo_log or cfg['intervalo_log']
+
+        self.lock = threading.Lock()
+        self.tokens = 1.0
+        self.ultima_reposicao = time.monotonic()
+        self.estado = FECHADO
+        self.aberto_ate = 0.0
+        self.teste_ate = 0.0
+        self.falhas_consecutivas = 0
+        self.sucessos = 0
+        self.falhas = 0
+        self.aberturas = 0
+        self.ultimo_log = time.monotonic()
+
+    def _reservar(self):
+        """Consome um token se possível; retorna quantos segundos esperar antes de tentar de novo"""
+        with self.lock:
+            agora = time.monotonic()
+            if self.estado == ABERTO:
+                if agora < self.aberto_ate:
+                    return self.aberto_ate - agora
+                # Só a chamada de teste passa; as demais aguardam o resultado dela
+                self.estado = MEIO_ABERTO
+                self.teste_ate = agora + self.pausa_segundos
+                logging.info("Disjuntor meio-aberto: testando o site novamente")
+            elif self.estado == MEIO_ABERTO and agora < self.teste_ate:
+                return min(0.1, self.teste_ate - agora)
+
+            self.tokens = min(self.rajada, self.tokens + (agora - self.ultima_reposicao) * self.taxa)
+            self.ultima_reposicao = agora
+            if self.tokens >= 1:
+                self.tokens -= 1
+                espera = 0.0
+            else:
+                espera = (1 - self.tokens) / self.taxa
+
+            registrar = agora - self.ultimo_log >= self.intervalo_log
+            if registrar:
+                self.ultimo_log = agora
+        if registrar:
+            self.registrar_estado()
+        return espera
+
+    def aguardar(self):
+        """Bloqueia a thread até haver token disponível e o disjuntor não estar aberto"""
+        while True:
+            espera = self._reservar()
+            if not espera:
+                return
+            time.sleep(espera)
+
+    async def aguardar_async(self):
+        """Versão assíncrona de aguardar"""
+        while True:
+            espera = self._reservar()
+            if not espera:
+                return
+            await asyncio.sleep(espera)
+
+    def registrar_sucesso(self):
+        """Aumento aditivo da taxa; fecha o disjuntor se estava em teste"""
+        with self.lock:
+            self.sucessos += 1
+            self.falhas_consecutivas = 0
+            self.taxa = min(self.taxa_maxima, self.taxa + self.incremento)
+            if self.estado != FECHADO:
+                self.estado = FECHADO
+                logging.info(f"Disjuntor fechado, taxa {self.taxa:.2f} req/s")
+
+    def registrar_falha(self):
+        """Redução multiplicativa da taxa; abre o disjuntor após falhas consecutivas demais"""
+        with self.lock:
+            self.falhas += 1
+            self.falhas_consecutivas += 1
+            self.taxa = max(self.taxa_minima, self.taxa * self.fator_reducao)
+            self.tokens = min(self.tokens, 0.0)
+            if self.estado == MEIO_ABERTO or (self.estado == FECHADO and self.falhas_consecutivas >= self.limite_falhas):
+                self.estado = ABERTO
+                self.aberto_ate = time.monotonic() + self.pausa_segundos
+                self.aberturas += 1
+                self.falhas_consecutivas = 0
+                logging.warning(
+                    f"Disjuntor aberto: chamadas ao site pausadas por {self.pausa_segundos:.0f}s, "
+                    f"taxa reduzida para {self.taxa:.2f} req/s"
+                )
+
+    def registrar_estado(self):
+        """Registra no log a taxa atual e o estado do disjuntor"""
+        logging.info(
+            f"Limitador: taxa {self.taxa:.2f} req/s, disjuntor {self.estado}, "
+            f"{self.sucessos} sucessos, {self.falhas} falhas, {self.aberturas} aberturas"
+        )
+
+# Limitador compartilhado por todas as chamadas ao site da FIPE do processo
+LIMITADOR = LimitadorTaxa()
+
+def aguardar():
+    with metricas.medir('fipe_espera_segundos', espera='limitador'):
+        LIMITADOR.aguardar()
+
+async def aguardar_async():
+    with metricas.medir('fipe_espera_segundos', espera='limitador'):
+        await LIMITADOR.aguardar_async()
+
+def registrar_sucesso():
+    LIMITADOR.registrar_sucesso()
+
+def registrar_falha():
+    LIMITADOR.registrar_falha()
+
+def registrar_estado():
+    LIMITADOR.registrar_estado()
@@ -1,6 +1,5 @@
-import psycopg2
 import logging
-import config
+import conexoes
 
 # Configuração do logging
 logging.basicConfig(
@@ -16,11 +15,23 @@ def limpar_tabelas(cur):
     """Remove todas as tabelas do banco de dados"""
     try:
         # Lista de tabelas na ordem correta para remoção (respeitando as dependências)
+        # A view materializada depende das tabelas e é removida primeiro
+        cur.execute("DROP MATERIALIZED VIEW IF EXISTS mv_precos")
+        
         tabelas = [
+            'schema_migracoes',
+            'atualizacoes_views',
+            'analise_variacoes',
+            'analise_depreciacao',
+            'analise_veiculos',
+            'scrape_jobs',
+            'impressoes_marcas',
             'valores',
             'anos',
             'modelos',
             'marcas',
+            'dim_modelos',
+            'dim_marcas',
             'referencias'
         ]
         
@@ -36,7 +47,7 @@ def main():
     try:
         # Conecta ao banco de dados
         logging.info("Conectando ao banco de dados...")
-        conn = psycopg2.connect(**config.DB_CONFIG)
+        conn = conexoes.obter()
         cur = conn.cursor()
         
         # Remove as tabelas
@@ -53,7 +64,8 @@ def main():
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
+            conexoes.devolver(conn)
+        conexoes.encerrar()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
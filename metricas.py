@@ -0,0 +1,276 @@
+import bisect
+import contextvars
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+
+# Limites (em segundos) dos buckets dos histogramas de latência
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Unidade (tipo de veículo, referência) em andamento na thread ou tarefa atual
+UNIDADE_ATUAL = contextvars.ContextVar('unidade_atual', default=None)
+
+class Histograma:
+    def __init__(self, limites=LIMITES_HISTOGRAMA):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+        self.maximo = 0.0
+
+    def observar(self, valor):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+        self.maximo = max(self.maximo, valor)
+
+    def percentil(self, p):
+        """Estimativa do percentil p (0-100) por interpolação linear dentro do bucket em que ele cai"""
+        alvo = p / 100 * self.total
+        acumulado = 0
+        inferior = 0.0
+        for limite, contagem in zip(self.limites + (self.maximo,), self.contagens):
+            if contagem and acumulado + contagem >= alvo:
+                superior = min(limite, self.maximo)
+                return inferior + (superior - inferior) * (alvo - acumulado) / contagem
+            acumulado += contagem
+            inferior = limite
+        return self.maximo
+
+class Unidade:
+    """Span de uma unidade de trabalho (tipo de veículo, referência)"""
+
+    def __init__(self, tipo_veiculo, referencia):
+        self.tipo_veiculo = tipo_veiculo
+        self.referencia = referencia
+        self.inicio = time.perf_counter()
+        self.duracao = None
+        self.erro = None
+        self.itens = 0
+        # Tempo gasto em cada métrica/rótulo dentro da unidade
+        self.tempos = defaultdict(float)
+
+    def resumo(self):
+        return {
+            'tipo_veiculo': self.tipo_veiculo,
+            'referencia': self.referencia,
+            'duracao_segundos': round(self.duracao, 3),
+            'itens': self.itens,
+            'erro': self.erro,
+            'tempos': {nome: round(segundos, 3) for nome, segundos in sorted(self.tempos.items(), key=lambda t: -t[1])}
+        }
+
+def formatar_rotulos(rotulos):
+    if not rotulos:
+        return ''
+    pares = ','.join(f'{nome}="{str(valor).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for nome, valor in rotulos)
+    return '{' + pares + '}'
+
+class Metricas:
+    """Histogramas de latência, contadores e spans por (tipo de veículo, referência).
+
+    Exportados em formato texto do Prometheus (servidor HTTP opcional) e como
+    resumo JSON ao final da execução. Pode ser usado por várias threads e tarefas.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inicio = time.time()
+        self.histogramas = defaultdict(Histograma)
+        self.contadores = defaultdict(float)
+        self.unidades_abertas = {}
+        self.unidades = []
+        self.sequencia = itertools.count()
+
+    def observar(self, metrica, segundos, unidade=None, **rotulos):
+        """Registra uma duração no histograma metrica{rotulos} e na unidade em andamento"""
+        chave = (metrica, tuple(sorted(rotulos.items())))
+        with self.lock:
+            self.histogramas[chave].observar(segundos)
+            span = self.unidades_abertas.get(unidade) if unidade is not None else UNIDADE_ATUAL.get()
+            if span is not None:
+                span.tempos[':'.join([metrica] + [str(valor) for _, valor in chave[1]])] += segundos
+
+    @contextmanager
+    def medir(self, metrica, unidade=None, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(metrica, time.perf_counter() - inicio, unidade, **rotulos)
+
+    def contar(self, metrica, valor=1, unidade=None, **rotulos):
+        """Soma valor ao contador metrica{rotulos}; os itens também são somados à unidade"""
+        with self.lock:
+            self.contadores[(metrica, tuple(sorted(rotulos.items())))] += valor
+            if metrica == 'fipe_itens_total':
+                span = self.unidades_abertas.get(unidade) if unidade is not None else UNIDADE_ATUAL.get()
+                if span is not None:
+                    span.itens += valor
+
+    def abrir_unidade(self, chave, tipo_veiculo, referencia):
+        span = Unidade(tipo_veiculo, referencia)
+        with self.lock:
+            self.unidades_abertas[chave] = span
+        return span
+
+    def fechar_unidade(self, chave, erro=None):
+        with self.lock:
+            span = self.unidades_abertas.pop(chave, None)
+        if span is None:
+            return
+        span.duracao = time.perf_counter() - span.inicio
+        span.erro = erro
+        self.observar('fipe_unidade_segundos', span.duracao, tipo_veiculo=span.tipo_veiculo)
+        with self.lock:
+            self.unidades.append(span)
+
+    @contextmanager
+    def unidade(self, tipo_veiculo, referencia):
+        """Agrupa as métricas registradas no bloco em um span (tipo de veículo, referência)"""
+        chave = ('unidade', next(self.sequencia))
+        span = self.abrir_unidade(chave, tipo_veiculo, referencia)
+        token = UNIDADE_ATUAL.set(span)
+        erro = None
+        try:
+            yield span
+        except Exception as e:
+            erro = str(e)
+            raise
+        finally:
+            UNIDADE_ATUAL.reset(token)
+            self.fechar_unidade(chave, erro)
+
+    def texto_prometheus(self):
+        """Métricas no formato de exposição em texto do Prometheus"""
+        linhas = []
+        with self.lock:
+            tipos = set()
+            for (metrica, rotulos), valor in sorted(self.contadores.items()):
+                if metrica not in tipos:
+                    linhas.append(f"# TYPE {metrica} counter")
+                    tipos.add(metrica)
+                linhas.append(f"{metrica}{formatar_rotulos(rotulos)} {valor:g}")
+            for (metrica, rotulos), histograma in sorted(self.histogramas.items()):
+                if metrica not in tipos:
+                    linhas.append(f"# TYPE {metrica} histogram")
+                    tipos.add(metrica)
+                acumulado = 0
+                for limite, contagem in zip(histograma.limites + ('+Inf',), histograma.contagens):
+                    acumulado += contagem
+                    linhas.append(f"{metrica}_bucket{formatar_rotulos(rotulos + (('le', limite),))} {acumulado}")
+                linhas.append(f"{metrica}_sum{formatar_rotulos(rotulos)} {histograma.soma:.6f}")
+                linhas.append(f"{metrica}_count{formatar_rotulos(rotulos)} {histograma.total}")
+            # Duração de cada unidade concluída, para destacar os meses lentos
+            if self.unidades:
+                linhas.append("# TYPE fipe_unidade_duracao_segundos gauge")
+            for span in self.unidades:
+                rotulos = (('referencia', span.referencia), ('tipo_veiculo', span.tipo_veiculo))
+                linhas.append(f"fipe_unidade_duracao_segundos{formatar_rotulos(rotulos)} {span.duracao:.3f}")
+        return '\n'.join(linhas) + '\n'
+
+    def resumo(self, max_unidades=20):
+        """Resumo em dicionário: percentis de cada histograma, contadores, itens/s e unidades mais lentas"""
+        decorrido = time.time() - self.inicio
+        with self.lock:
+            histogramas = {
+                f"{metrica}{formatar_rotulos(rotulos)}": {
+                    'total': h.total, 'soma_segundos': round(h.soma, 3), 'p50': round(h.percentil(50), 4),
+                    'p90': round(h.percentil(90), 4), 'p99': round(h.percentil(99), 4), 'maximo': round(h.maximo, 3)
+                }
+                for (metrica, rotulos), h in sorted(self.histogramas.items())
+            }
+            contadores = {f"{metrica}{formatar_rotulos(rotulos)}": valor for (metrica, rotulos), valor in sorted(self.contadores.items())}
+            itens_por_segundo = {
+                dict(rotulos).get('etapa', ''): round(valor / decorrido, 2)
+                for (metrica, rotulos), valor in self.contadores.items() if metrica == 'fipe_itens_total'
+            }
+            unidades = sorted(self.unidades, key=lambda span: -span.duracao)
+            return {
+                'inicio': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.inicio)),
+                'duracao_segundos': round(decorrido, 1),
+                'histogramas': histogramas,
+                'contadores': contadores,
+                'itens_por_segundo': itens_por_segundo,
+                'unidades_concluidas': len(unidades),
+                'unidades_mais_lentas': [span.resumo() for span in unidades[:max_unidades]]
+            }
+
+class MetricasHandler(BaseHTTPRequestHandler):
+    metricas = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        conteudo = self.metricas.texto_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+METRICAS = Metricas()
+SERVIDOR = None
+ARQUIVO_JSON = None
+
+def observar(metrica, segundos, unidade=None, **rotulos):
+    METRICAS.observar(metrica, segundos, unidade, **rotulos)
+
+def medir(metrica, unidade=None, **rotulos):
+    return METRICAS.medir(metrica, unidade, **rotulos)
+
+def contar(metrica, valor=1, unidade=None, **rotulos):
+    METRICAS.contar(metrica, valor, unidade, **rotulos)
+
+def abrir_unidade(chave, tipo_veiculo, referencia):
+    return METRICAS.abrir_unidade(chave, tipo_veiculo, referencia)
+
+def fechar_unidade(chave, erro=None):
+    METRICAS.fechar_unidade(chave, erro)
+
+def unidade(tipo_veiculo, referencia):
+    return METRICAS.unidade(tipo_veiculo, referencia)
+
+def adicionar_argumentos(parser):
+    """Adiciona aos scripts as opções de exportação das métricas"""
+    parser.add_argument('--metricas-porta', type=int, metavar='PORTA',
+                        help="Porta local que expõe as métricas no formato do Prometheus em /metrics (padrão: METRICAS_PORTA)")
+    parser.add_argument('--metricas-json', metavar='ARQUIVO',
+                        help="Arquivo em que o resumo das métricas é gravado ao final (padrão: METRICAS_JSON)")
+
+def configurar(porta=None, arquivo_json=None):
+    """Inicia o servidor de métricas (se houver porta) e define o arquivo do resumo JSON"""
+    global SERVIDOR, ARQUIVO_JSON
+    porta = porta if porta is not None else config.METRICAS_CONFIG['porta']
+    ARQUIVO_JSON = arquivo_json or config.METRICAS_CONFIG['arquivo_json']
+    if porta and SERVIDOR is None:
+        MetricasHandler.metricas = METRICAS
+        SERVIDOR = ThreadingHTTPServer(('127.0.0.1', porta), MetricasHandler)
+        SERVIDOR.daemon_threads = True
+        threading.Thread(target=SERVIDOR.serve_forever, name='metricas', daemon=True).start()
+        logging.info(f"Métricas em http://127.0.0.1:{porta}/metrics")
+
+def encerrar():
+    """Grava o resumo JSON (se configurado) e para o servidor de métricas"""
+    global SERVIDOR
+    if ARQUIVO_JSON:
+        try:
+            with open(ARQUIVO_JSON, 'w', encoding='utf-8') as arquivo:
+                json.dump(METRICAS.resumo(), arquivo, ensure_ascii=False, indent=2)
+            logging.info(f"Resumo das métricas gravado em {ARQUIVO_JSON}")
+        except Exception as e:
+            logging.error(f"Erro ao gravar o resumo das métricas: {e}")
+    if SERVIDOR is not None:
+        SERVIDOR.shutdown()
+        SERVIDOR.server_close()
+        SERVIDOR = None
@@ -0,0 +1,399 @@
+import logging
+import time
+from psycopg2 import sql
+from conversoes import MESES
+import particoes
+
+# Identificador do advisory lock que impede duas execuções simultâneas das migrações
+LOCK_MIGRACOES = 7261001
+
+# Linhas atualizadas por transação nos preenchimentos, para não segurar locks por muito tempo
+TAMANHO_LOTE_PREENCHIMENTO = 10000
+
+def criar_tabela_migracoes(cur):
+    """Cria a tabela que registra as migrações já aplicadas"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migracoes (
+            versao INTEGER PRIMARY KEY,
+            descricao VARCHAR(200) NOT NULL,
+            aplicada_em TIMESTAMP NOT NULL DEFAULT now(),
+            duracao_segundos DOUBLE PRECISION
+        )
+    """)
+
+def versoes_aplicadas(cur):
+    cur.execute("SELECT versao FROM schema_migracoes")
+    return {row[0] for row in cur.fetchall()}
+
+def preencher_em_lotes(conn, tabela, atribuicoes, condicao, tamanho_lote=None):
+    """Executa UPDATE tabela SET atribuicoes WHERE condicao em faixas de id, com commit a cada faixa.
+
+    Cada transação trava no máximo tamanho_lote linhas, então a tabela continua
+    disponível para leitura e escrita durante o preenchimento.
+    """
+    tamanho_lote = tamanho_lote or TAMANHO_LOTE_PREENCHIMENTO
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT MIN(id), MAX(id) FROM {}").format(sql.Identifier(tabela)))
+        menor, maior = cur.fetchone()
+        if menor is None:
+            return 0
+
+        total = 0
+        for inicio in range(menor, maior + 1, tamanho_lote):
+            cur.execute(
+                sql.SQL("UPDATE {tabela} SET {atribuicoes} WHERE id >= %s AND id < %s AND ({condicao})").format(
+                    tabela=sql.Identifier(tabela),
+                    atribuicoes=sql.SQL(atribuicoes),
+                    condicao=sql.SQL(condicao)
+                ),
+                (inicio, inicio + tamanho_lote)
+            )
+            total += cur.rowcount
+            conn.commit()
+        logging.info(f"{total} linhas preenchidas em {tabela}")
+        return total
+
+def criar_indice_concorrente(cur, nome, tabela, definicao):
+    """CREATE INDEX CONCURRENTLY; um índice inválido de uma tentativa interrompida é recriado"""
+    cur.execute("""
+        SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s
+    """, (nome,))
+    linha = cur.fetchone()
+    if linha and linha[0]:
+        cur.execute(sql.SQL("DROP INDEX CONCURRENTLY {}").format(sql.Identifier(nome)))
+    cur.execute(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} {definicao}").format(
+        nome=sql.Identifier(nome), tabela=sql.Identifier(tabela), definicao=sql.SQL(definicao)
+    ))
+
+def criar_indice(conn, nome, tabela, definicao):
+    """Cria um índice sem bloquear as escritas na tabela.
+
+    Tabelas particionadas não aceitam CONCURRENTLY: o índice é criado só na
+    tabela principal (ON ONLY) e depois em cada partição, que é anexada a ele.
+    As partições criadas depois herdam o índice automaticamente.
+    """
+    autocommit = conn.autocommit
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            if not particoes.tabela_particionada(cur, tabela):
+                criar_indice_concorrente(cur, nome, tabela, definicao)
+            else:
+                cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {nome} ON ONLY {tabela} {definicao}").format(
+                    nome=sql.Identifier(nome), tabela=sql.Identifier(tabela), definicao=sql.SQL(definicao)
+                ))
+                cur.execute("""
+                    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = %s::regclass
+                """, (tabela,))
+                for (particao,) in cur.fetchall():
+                    indice_particao = f"{particao}_{nome[len('idx_'):] if nome.startswith('idx_') else nome}"[:63]
+                    criar_indice_concorrente(cur, indice_particao, particao, definicao)
+                    cur.execute("""
+                        SELECT 1 FROM pg_inherits
+                        WHERE inhparent = %s::regclass AND inhrelid = %s::regclass
+                    """, (nome, indice_particao))
+                    if cur.fetchone() is None:
+                        cur.execute(sql.SQL("ALTER INDEX {} ATTACH PARTITION {}").format(
+                            sql.Identifier(nome), sql.Identifier(indice_particao)
+                        ))
+        logging.info(f"Índice {nome} criado")
+    finally:
+        conn.autocommit = autocommit
+
+# Migrações. Cada uma recebe a conexão e pode fazer commits intermediários;
+# o registro da versão só é gravado depois que ela termina.
+
+def migracao_001_data_referencia(conn):
+    """referencias.data (primeiro dia do mês) para ordenar e filtrar por data"""
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE referencias ADD COLUMN IF NOT EXISTS data DATE")
+        meses = sql.SQL(', ').join(sql.SQL("({}, {})").format(sql.Literal(nome), sql.Literal(numero)) for nome, numero in MESES.items())
+        cur.execute(sql.SQL("""
+            UPDATE referencias r SET data = make_date(r.ano, m.numero, 1)
+            FROM (VALUES {meses}) AS m (nome, numero)
+            WHERE lower(trim(r.mes)) = m.nome AND r.data IS NULL
+        """).format(meses=meses))
+        cur.execute("SELECT mes_ano FROM referencias WHERE data IS NULL")
+        invalidas = [row[0] for row in cur.fetchall()]
+        if invalidas:
+            raise ValueError(f"Referências com mês inválido: {', '.join(invalidas)}")
+        cur.execute("ALTER TABLE referencias ALTER COLUMN data SET NOT NULL")
+    conn.commit()
+    criar_indice(conn, 'idx_referencias_data', 'referencias', '(data DESC)')
+
+def migracao_002_valor_numerico(conn):
+    """valores.valor_numerico com o preço em NUMERIC"""
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE valores ADD COLUMN IF NOT EXISTS valor_numerico NUMERIC(14, 2)")
+    conn.commit()
+    preencher_em_lotes(
+        conn, 'valores',
+        "valor_numerico = replace(replace(trim(replace(valor, 'R$', '')), '.', ''), ',', '.')::numeric",
+        "valor_numerico IS NULL AND valor ~ '^\\s*R\\$\\s*[0-9.]+,[0-9]{2}\\s*$'"
+    )
+
+def migracao_003_ano_combustivel(conn):
+    """anos.ano_modelo e anos.combustivel separados do texto "2024 Gasolina\""""
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE anos ADD COLUMN IF NOT EXISTS ano_modelo INTEGER")
+        cur.execute("ALTER TABLE anos ADD COLUMN IF NOT EXISTS combustivel VARCHAR(20)")
+    conn.commit()
+    preencher_em_lotes(
+        conn, 'anos',
+        "ano_modelo = substring(ano from '^\\s*([0-9]{4,5})\\s')::integer, "
+        "combustivel = substring(ano from '^\\s*[0-9]{4,5}\\s+(.+?)\\s*$')",
+        "ano_modelo IS NULL AND ano ~ '^\\s*[0-9]{4,5}\\s+\\S'"
+    )
+
+def migracao_004_indices(conn):
+    """Índices das chaves estrangeiras e de (referencia_id, tipo_veiculo)"""
+    criar_indice(conn, 'idx_marcas_referencia_tipo', 'marcas', '(referencia_id, tipo_veiculo) INCLUDE (nome)')
+    criar_indice(conn, 'idx_modelos_marca', 'modelos', '(marca_id)')
+    criar_indice(conn, 'idx_modelos_referencia', 'modelos', '(referencia_id)')
+    criar_indice(conn, 'idx_anos_modelo', 'anos', '(modelo_id)')
+    criar_indice(conn, 'idx_anos_referencia', 'anos', '(referencia_id)')
+    criar_indice(conn, 'idx_valores_referencia', 'valores', '(referencia_id) INCLUDE (ano_id, valor_numerico)')
+    criar_indice(conn, 'idx_scrape_jobs_referencia', 'scrape_jobs', '(referencia_id)')
+
+def migracao_005_dimensoes(conn):
+    """Dimensões de marcas e modelos (um registro por marca/modelo, independente da referência)"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS dim_marcas (
+                id SERIAL PRIMARY KEY,
+                tipo_veiculo VARCHAR(20) NOT NULL,
+                nome VARCHAR(100) NOT NULL,
+                codigo_fipe VARCHAR(20),
+                UNIQUE(tipo_veiculo, nome)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS dim_modelos (
+                id SERIAL PRIMARY KEY,
+                dim_marca_id INTEGER NOT NULL REFERENCES dim_marcas(id),
+                nome VARCHAR(100) NOT NULL,
+                codigo_fipe VARCHAR(20),
+                UNIQUE(dim_marca_id, nome)
+            )
+        """)
+        cur.execute("ALTER TABLE marcas ADD COLUMN IF NOT EXISTS dim_marca_id INTEGER REFERENCES dim_marcas(id)")
+        cur.execute("ALTER TABLE modelos ADD COLUMN IF NOT EXISTS dim_modelo_id INTEGER REFERENCES dim_modelos(id)")
+        cur.execute("""
+            INSERT INTO dim_marcas (tipo_veiculo, nome)
+            SELECT DISTINCT tipo_veiculo, nome FROM marcas
+            ON CONFLICT DO NOTHING
+        """)
+    conn.commit()
+    preencher_em_lotes(
+        conn, 'marcas',
+        "dim_marca_id = (SELECT d.id FROM dim_marcas d WHERE d.tipo_veiculo = marcas.tipo_veiculo AND d.nome = marcas.nome)",
+        "dim_marca_id IS NULL"
+    )
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO dim_modelos (dim_marca_id, nome)
+            SELECT DISTINCT ma.dim_marca_id, mo.nome
+            FROM modelos mo JOIN marcas ma ON ma.id = mo.marca_id
+            ON CONFLICT DO NOTHING
+        """)
+    conn.commit()
+    preencher_em_lotes(
+        conn, 'modelos',
+        "dim_modelo_id = (SELECT d.id FROM dim_modelos d JOIN marcas ma ON ma.dim_marca_id = d.dim_marca_id "
+        "WHERE ma.id = modelos.marca_id AND d.nome = modelos.nome)",
+        "dim_modelo_id IS NULL"
+    )
+    criar_indice(conn, 'idx_marcas_dim', 'marcas', '(dim_marca_id, referencia_id)')
+    criar_indice(conn, 'idx_modelos_dim', 'modelos', '(dim_modelo_id, referencia_id)')
+
+def migracao_006_views_precos(conn):
+    """View materializada mv_precos (preço por veículo e referência) usada pelas consultas"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS mv_precos AS
+            SELECT
+                dma.tipo_veiculo, dma.nome AS marca, dmo.nome AS modelo, a.ano,
+                dma.id AS dim_marca_id, dmo.id AS dim_modelo_id, a.ano_modelo, a.combustivel,
+                r.id AS referencia_id, r.mes_ano, r.data,
+                v.valor, v.valor_numerico
+            FROM valores v
+            JOIN anos a ON a.id = v.ano_id AND a.referencia_id = v.referencia_id
+            JOIN modelos m ON m.id = a.modelo_id
+            JOIN dim_modelos dmo ON dmo.id = m.dim_modelo_id
+            JOIN dim_marcas dma ON dma.id = dmo.dim_marca_id
+            JOIN referencias r ON r.id = v.referencia_id
+        """)
+        # Índice único exigido pelo REFRESH MATERIALIZED VIEW CONCURRENTLY
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_precos_chave ON mv_precos (dim_modelo_id, ano, referencia_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_mv_precos_veiculo ON mv_precos (tipo_veiculo, marca, modelo, ano, data)")
+        # Última atualização de cada view, usada para invalidar os caches das consultas
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS atualizacoes_views (
+                nome VARCHAR(100) PRIMARY KEY,
+                atualizada_em TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """)
+        cur.execute("""
+            INSERT INTO atualizacoes_views (nome) VALUES ('mv_precos')
+            ON CONFLICT (nome) DO UPDATE SET atualizada_em = now()
+        """)
+    conn.commit()
+
+def migracao_007_codigo_referencia(conn):
+    """referencias.codigo_fipe com o código da referência na tabela da FIPE"""
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE referencias ADD COLUMN IF NOT EXISTS codigo_fipe VARCHAR(20)")
+    conn.commit()
+
+def migracao_008_codigo_ano(conn):
+    """anos.codigo_fipe com o código do ano na FIPE (ex: "2024-1"), para o crawl reaproveitar os anos"""
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE anos ADD COLUMN IF NOT EXISTS codigo_fipe VARCHAR(20)")
+    conn.commit()
+
+def migracao_009_analise_precos(conn):
+    """Tabelas preenchidas pelo analise_precos.py (recalculadas por inteiro a cada execução)"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS analise_veiculos (
+                id INTEGER PRIMARY KEY,
+                dim_modelo_id INTEGER NOT NULL REFERENCES dim_modelos(id),
+                ano VARCHAR(20) NOT NULL,
+                ano_modelo INTEGER
+            )
+        """)
+        # Sem chaves estrangeiras, para não verificar cada uma das linhas gravadas pelo COPY
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS analise_variacoes (
+                veiculo_id INTEGER NOT NULL,
+                referencia_id INTEGER NOT NULL,
+                idade SMALLINT NOT NULL,
+                variacao_mensal DOUBLE PRECISION,
+                variacao_anual DOUBLE PRECISION,
+                media_movel DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY(veiculo_id, referencia_id)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS analise_depreciacao (
+                tipo_veiculo VARCHAR(20) NOT NULL,
+                idade SMALLINT NOT NULL,
+                variacao_anual_mediana DOUBLE PRECISION NOT NULL,
+                variacao_anual_media DOUBLE PRECISION NOT NULL,
+                valor_residual DOUBLE PRECISION NOT NULL,
+                quantidade INTEGER NOT NULL,
+                PRIMARY KEY(tipo_veiculo, idade)
+            )
+        """)
+    conn.commit()
+
+def unificar_por_codigo(cur, tabela, coluna_pai, coluna_fato, fato, referencias_extras=()):
+    """Junta os registros de uma dimensão com o mesmo código da FIPE (ex: marca renomeada no site).
+
+    Fica o de menor id, com o nome da referência mais recente; as linhas de `fato`
+    (e das tabelas em referencias_extras, pares (tabela, coluna)) passam a apontar
+    para ele. Retorna quantos registros foram removidos.
+    """
+    cur.execute(sql.SQL("""
+        CREATE TEMP TABLE mapa_unificacao ON COMMIT DROP AS
+        SELECT id, destino FROM (
+            SELECT id, MIN(id) OVER (PARTITION BY {pai}, codigo_fipe) AS destino
+            FROM {tabela} WHERE codigo_fipe IS NOT NULL
+        ) d WHERE id <> destino
+    """).format(pai=sql.Identifier(coluna_pai), tabela=sql.Identifier(tabela)))
+    cur.execute("SELECT COUNT(*) FROM mapa_unificacao")
+    removidos = cur.fetchone()[0]
+    if removidos:
+        for tabela_ref, coluna in ((fato, coluna_fato),) + tuple(referencias_extras):
+            cur.execute(sql.SQL("""
+                UPDATE {tabela} t SET {coluna} = m.destino FROM mapa_unificacao m WHERE t.{coluna} = m.id
+            """).format(tabela=sql.Identifier(tabela_ref), coluna=sql.Identifier(coluna)))
+        cur.execute(sql.SQL("DELETE FROM {} WHERE id IN (SELECT id FROM mapa_unificacao)").format(sql.Identifier(tabela)))
+        cur.execute(sql.SQL("""
+            UPDATE {tabela} d SET nome = (
+                SELECT f.nome FROM {fato} f JOIN referencias r ON r.id = f.referencia_id
+                WHERE f.{coluna} = d.id ORDER BY r.data DESC NULLS LAST LIMIT 1
+            )
+            WHERE d.id IN (SELECT destino FROM mapa_unificacao)
+              AND EXISTS (SELECT 1 FROM {fato} f WHERE f.{coluna} = d.id)
+        """).format(tabela=sql.Identifier(tabela), fato=sql.Identifier(fato), coluna=sql.Identifier(coluna_fato)))
+    cur.execute("DROP TABLE mapa_unificacao")
+    logging.info(f"{removidos} registros de {tabela} unificados pelo código da FIPE")
+    return removidos
+
+def migracao_010_dimensoes_codigo(conn):
+    """Dimensões identificadas pelo código da FIPE; o nome passa a ser um atributo (atualizado se mudar)"""
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE dim_marcas DROP CONSTRAINT IF EXISTS dim_marcas_tipo_veiculo_nome_key")
+        cur.execute("ALTER TABLE dim_modelos DROP CONSTRAINT IF EXISTS dim_modelos_dim_marca_id_nome_key")
+        # As marcas primeiro: os modelos delas passam a ser irmãos e podem ter o mesmo código
+        removidos = unificar_por_codigo(cur, 'dim_marcas', 'tipo_veiculo', 'dim_marca_id', 'marcas',
+                                        [('dim_modelos', 'dim_marca_id')])
+        removidos += unificar_por_codigo(cur, 'dim_modelos', 'dim_marca_id', 'dim_modelo_id', 'modelos',
+                                         [('analise_veiculos', 'dim_modelo_id')])
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_marcas_codigo ON dim_marcas (tipo_veiculo, codigo_fipe)
+            WHERE codigo_fipe IS NOT NULL
+        """)
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_modelos_codigo ON dim_modelos (dim_marca_id, codigo_fipe)
+            WHERE codigo_fipe IS NOT NULL
+        """)
+        # Registros antigos, gravados sem o código, continuam identificados pelo nome
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_marcas_nome ON dim_marcas (tipo_veiculo, nome)
+            WHERE codigo_fipe IS NULL
+        """)
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_modelos_nome ON dim_modelos (dim_marca_id, nome)
+            WHERE codigo_fipe IS NULL
+        """)
+        if removidos:
+            cur.execute("REFRESH MATERIALIZED VIEW mv_precos")
+    conn.commit()
+
+MIGRACOES = [
+    (1, "Data das referências", migracao_001_data_referencia),
+    (2, "Valores numéricos", migracao_002_valor_numerico),
+    (3, "Ano do modelo e combustível", migracao_003_ano_combustivel),
+    (4, "Índices das chaves estrangeiras", migracao_004_indices),
+    (5, "Dimensões de marcas e modelos", migracao_005_dimensoes),
+    (6, "View materializada de preços", migracao_006_views_precos),
+    (7, "Código da FIPE das referências", migracao_007_codigo_referencia),
+    (8, "Código da FIPE dos anos", migracao_008_codigo_ano),
+    (9, "Tabelas da análise de preços", migracao_009_analise_precos),
+    (10, "Dimensões pelo código da FIPE", migracao_010_dimensoes_codigo),
+]
+
+def aplicar_migracoes(conn):
+    """Aplica em ordem as migrações ainda não registradas em schema_migracoes"""
+    with conn.cursor() as cur:
+        criar_tabela_migracoes(cur)
+        conn.commit()
+        # Advisory lock de sessão: vale também entre as transações das migrações
+        cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_MIGRACOES,))
+        try:
+            aplicadas = versoes_aplicadas(cur)
+            conn.commit()
+            pendentes = [m for m in MIGRACOES if m[0] not in aplicadas]
+            if not pendentes:
+                logging.info("Banco de dados já está na versão mais recente")
+            for versao, descricao, funcao in pendentes:
+                logging.info(f"Aplicando migração {versao}: {descricao}")
+                inicio = time.perf_counter()
+                funcao(conn)
+                cur.execute(
+                    "INSERT INTO schema_migracoes (versao, descricao, duracao_segundos) VALUES (%s, %s, %s)",
+                    (versao, descricao, time.perf_counter() - inicio)
+                )
+                conn.commit()
+                logging.info(f"Migração {versao} aplicada em {time.perf_counter() - inicio:.1f}s")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_MIGRACOES,))
+            conn.commit()
@@ -0,0 +1,312 @@
+import argparse
+import logging
+import os
+import queue
+import statistics
+import threading
+import time
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+import config
+import prontidao
+import rede
+
+# Uso de memória (heap JavaScript) da página, em bytes
+SCRIPT_MEMORIA = "return (window.performance && performance.memory) ? performance.memory.usedJSHeapSize : 0;"
+
+# Tempo de carga da página (ms), recursos carregados e bytes transferidos
+SCRIPT_CARGA = """
+var t = performance.timing;
+var recursos = performance.getEntriesByType('resource');
+var bytes = 0;
+for (var i = 0; i < recursos.length; i++) { bytes += recursos[i].transferSize || 0; }
+return [Math.max(t.loadEventEnd - t.navigationStart, 0), recursos.length, bytes];
+"""
+
+# Padrões de URL (com * como curinga) bloqueados em cada perfil. Os scripts só usam
+# os selects de referência e de marca e as requisições XHR que os preenchem
+MIDIA = (
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.mp4', '*.webm', '*.mp3'
+)
+RASTREADORES = (
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*googlesyndication.com*',
+    '*googleadservices.com*', '*adservice.google.*', '*facebook.net*', '*facebook.com/tr*',
+    '*hotjar.com*', '*clarity.ms*'
+)
+PERFIS_BLOQUEIO = {
+    'nenhum': (),
+    'midia': MIDIA,
+    'completo': MIDIA + ('*.css',) + RASTREADORES
+}
+
+def padroes_bloqueio(perfil=None):
+    """Padrões de URL bloqueados no perfil (padrão: SELENIUM_BLOQUEIO), mais os de SELENIUM_BLOQUEAR_URLS"""
+    perfil = perfil or config.SELENIUM_CONFIG['bloqueio']
+    if perfil not in PERFIS_BLOQUEIO:
+        raise ValueError(f"Perfil de bloqueio inválido: {perfil} (opções: {', '.join(PERFIS_BLOQUEIO)})")
+    if perfil == 'nenhum':
+        return []
+    return list(PERFIS_BLOQUEIO[perfil]) + config.SELENIUM_CONFIG['bloquear_urls']
+
+def aplicar_bloqueio(driver, padroes):
+    """Bloqueia na aba atual as requisições cujas URLs casam com os padrões (Chrome DevTools Protocol)"""
+    if not padroes:
+        return
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': padroes})
+    except Exception as e:
+        logging.warning(f"Não foi possível bloquear recursos no navegador: {e}")
+
+def memoria_processos_mb(pid):
+    """Soma do RSS de um processo e de todos os seus descendentes, em MB (None fora do Linux)"""
+    if not os.path.exists(f'/proc/{pid}'):
+        return None
+    total_kb = 0
+    pendentes = [pid]
+    while pendentes:
+        atual = pendentes.pop()
+        try:
+            with open(f'/proc/{atual}/status') as arquivo:
+                for linha in arquivo:
+                    if linha.startswith('VmRSS:'):
+                        total_kb += int(linha.split()[1])
+            for tarefa in os.listdir(f'/proc/{atual}/task'):
+                with open(f'/proc/{atual}/task/{tarefa}/children') as arquivo:
+                    pendentes.extend(int(filho) for filho in arquivo.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            # O processo terminou durante a leitura
+            continue
+    return total_kb / 1024
+
+def opcoes_chrome(bloqueio=None):
+    """Opções do Chrome usadas por todos os scripts"""
+    chrome_options = Options()
+    if config.SELENIUM_CONFIG['captura_rede']:
+        # Log de rede usado para ler as respostas da API da página (rede.py)
+        chrome_options.set_capability('goog:loggingPrefs', rede.PREFERENCIAS_LOG)
+        chrome_options.add_experimental_option('perfLoggingPrefs', rede.PREFERENCIAS_DESEMPENHO)
+    depurador = config.SELENIUM_CONFIG['depurador']
+    if depurador:
+        # Anexa a um Chrome já aberto com --remote-debugging-port; as demais opções não se aplicam
+        chrome_options.debugger_address = depurador
+        return chrome_options
+
+    if config.SELENIUM_CONFIG['headless']:
+        chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument('--window-size=1920,1080')
+    chrome_options.add_argument('--disable-gpu')
+    chrome_options.add_argument('--disable-extensions')
+    chrome_options.add_argument('--disable-infobars')
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    if padroes_bloqueio(bloqueio):
+        # Também não carrega imagens em iframes, que não passam pelo bloqueio da aba
+        chrome_options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    return chrome_options
+
+class Navegador:
+    """Driver do Chrome já na página da FIPE, com contagem de operações para reciclagem.
+
+    Imagens, fontes, folhas de estilo e scripts de anúncios e analytics são
+    bloqueados conforme o perfil `bloqueio` (padrão: SELENIUM_BLOQUEIO).
+    """
+
+    def __init__(self, bloqueio=None):
+        inicio = time.perf_counter()
+        self.anexado = bool(config.SELENIUM_CONFIG['depurador'])
+        self.driver = webdriver.Chrome(options=opcoes_chrome(bloqueio))
+        self.operacoes = 0
+        try:
+            if self.anexado:
+                # Aba própria no Chrome compartilhado, fechada ao reciclar
+                self.driver.switch_to.new_window('tab')
+            aplicar_bloqueio(self.driver, padroes_bloqueio(bloqueio))
+
+            url = config.SELENIUM_CONFIG['url']
+            inicio_carga = time.perf_counter()
+            self.driver.get(url)
+            logging.info(f"Acessando a página: {url}")
+
+            # Aguarda o carregamento da página
+            self.wait = WebDriverWait(self.driver, 20)
+            self.wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+            prontidao.instalar_monitor_xhr(self.driver)
+            prontidao.aguardar_xhr_ociosas(self.driver, nome='carga_inicial')
+            self.tempo_carga = time.perf_counter() - inicio_carga
+        except Exception:
+            self.quit()
+            raise
+        self.tempo_inicio = time.perf_counter() - inicio
+        prontidao.registrar_espera('inicio_navegador', self.tempo_inicio)
+
+    def registrar_operacao(self):
+        self.operacoes += 1
+
+    def memoria_mb(self):
+        """Heap JavaScript usado pela página, em MB (0 se não disponível)"""
+        try:
+            return (self.driver.execute_script(SCRIPT_MEMORIA) or 0) / 1024 / 1024
+        except Exception:
+            return 0
+
+    def memoria_processos_mb(self):
+        """RSS do Chrome (chromedriver e todos os processos do navegador), em MB; None no Chrome anexado"""
+        if self.anexado:
+            return None
+        return memoria_processos_mb(self.driver.service.process.pid)
+
+    def precisa_reciclar(self):
+        """Indica se o driver atingiu o limite de operações ou de memória"""
+        if self.operacoes >= config.SELENIUM_CONFIG['max_operacoes']:
+            return True
+        return self.memoria_mb() >= config.SELENIUM_CONFIG['max_memoria_mb']
+
+    def quit(self):
+        try:
+            if self.anexado:
+                # Fecha só a aba; o Chrome anexado continua aberto para as próximas execuções
+                self.driver.close()
+        except Exception:
+            pass
+        self.driver.quit()
+
+class PoolNavegadores:
+    """Mantém navegadores já abertos na página da FIPE prontos para uso.
+
+    Sempre que um navegador é retirado, outro é preparado em segundo plano até
+    haver SELENIUM_POOL_RESERVA de reserva, então a troca de um navegador
+    reciclado não espera a inicialização do Chrome.
+    """
+
+    def __init__(self, reserva=None):
+        self.reserva = reserva if reserva is not None else config.SELENIUM_CONFIG['pool_reserva']
+        self.prontos = queue.Queue()
+        self.lock = threading.Lock()
+        self.preparando = 0
+        self.encerrado = False
+
+    def _preparar(self):
+        try:
+            navegador = Navegador()
+        except Exception as e:
+            # A exceção é entregue a quem estiver aguardando em obter()
+            logging.error(f"Erro ao preparar navegador: {e}")
+            navegador = e
+        if self.encerrado and isinstance(navegador, Navegador):
+            navegador.quit()
+        with self.lock:
+            self.preparando -= 1
+            self.prontos.put(navegador)
+
+    def aquecer(self, quantidade=None):
+        """Prepara navegadores em paralelo até haver `quantidade` (padrão: a reserva) prontos ou em preparo"""
+        quantidade = self.reserva if quantidade is None else quantidade
+        with self.lock:
+            faltam = quantidade - self.prontos.qsize() - self.preparando
+            self.preparando += max(faltam, 0)
+        for _ in range(faltam):
+            threading.Thread(target=self._preparar, daemon=True).start()
+
+    def obter(self):
+        """Retira um navegador pronto (aguardando o preparo se necessário) e repõe a reserva"""
+        with self.lock:
+            vazio = self.prontos.empty() and not self.preparando
+        if vazio:
+            self.aquecer(1)
+        navegador = self.prontos.get()
+        if isinstance(navegador, Exception):
+            raise navegador
+        self.aquecer()
+        return navegador
+
+    def reciclar(self, navegador):
+        """Fecha o navegador e retorna outro da reserva"""
+        logging.info(
+            f"Reciclando navegador após {navegador.operacoes} operações ({navegador.memoria_mb():.0f} MB de heap)"
+        )
+        navegador.quit()
+        return self.obter()
+
+    def encerrar(self):
+        """Fecha os navegadores de reserva"""
+        self.encerrado = True
+        while True:
+            try:
+                navegador = self.prontos.get_nowait()
+            except queue.Empty:
+                break
+            if not isinstance(navegador, Exception):
+                navegador.quit()
+
+def medir_bloqueio(perfis, repeticoes):
+    """Abre navegadores com cada perfil de bloqueio e retorna {perfil: mediana de cada medida}"""
+    resultados = {}
+    for perfil in perfis:
+        medidas = []
+        for _ in range(repeticoes):
+            navegador = Navegador(bloqueio=perfil)
+            try:
+                carga_ms, recursos, transferidos = navegador.driver.execute_script(SCRIPT_CARGA)
+                medidas.append({
+                    'inicio_segundos': navegador.tempo_inicio,
+                    'carga_segundos': navegador.tempo_carga,
+                    'load_ms': carga_ms,
+                    'recursos': recursos,
+                    'transferido_kb': transferidos / 1024,
+                    'rss_mb': navegador.memoria_processos_mb() or 0,
+                    'heap_mb': navegador.memoria_mb()
+                })
+            finally:
+                navegador.quit()
+        resultados[perfil] = {
+            chave: round(statistics.median(medida[chave] for medida in medidas), 3) for chave in medidas[0]
+        }
+    return resultados
+
+def imprimir_medidas(resultados):
+    """Tabela das medidas de cada perfil e a variação em relação ao primeiro"""
+    rotulos = (
+        ('carga_segundos', 'carga até a página ficar pronta (s)'), ('load_ms', 'evento load (ms)'),
+        ('recursos', 'recursos carregados'), ('transferido_kb', 'transferido (KB)'),
+        ('rss_mb', 'RSS do navegador (MB)'), ('heap_mb', 'heap da página (MB)'), ('inicio_segundos', 'início total (s)')
+    )
+    base = next(iter(resultados.values()))
+    for perfil, medidas in resultados.items():
+        print(f"\nPerfil {perfil}:")
+        for chave, rotulo in rotulos:
+            variacao = ''
+            if medidas is not base and base[chave]:
+                variacao = f" ({(medidas[chave] - base[chave]) / base[chave] * 100:+.1f}%)"
+            print(f"  {rotulo}: {medidas[chave]}{variacao}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mede a carga da página da FIPE e a memória do navegador com e sem bloqueio de recursos"
+    )
+    parser.add_argument('--perfis', nargs='+', choices=list(PERFIS_BLOQUEIO), default=['nenhum', 'completo'],
+                        help="Perfis de bloqueio comparados; o primeiro é a base da comparação")
+    parser.add_argument('--repeticoes', type=int, default=3, help="Navegadores abertos por perfil (usa a mediana)")
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('navegador.log'),
+            logging.StreamHandler()
+        ]
+    )
+    try:
+        imprimir_medidas(medir_bloqueio(args.perfis, args.repeticoes))
+    except Exception as e:
+        logging.error(f"Erro durante a medição: {e}")
+
+if __name__ == "__main__":
+    main()
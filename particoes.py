@@ -0,0 +1,61 @@
+import logging
+from psycopg2 import sql
+
+# Tabelas que podem ser particionadas por referência (setup_database.py --particionar)
+TABELAS_PARTICIONADAS = ['anos', 'valores']
+
+def tabela_particionada(cur, tabela):
+    """Indica se a tabela foi criada com particionamento declarativo"""
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+        )
+    """, (tabela,))
+    return cur.fetchone()[0]
+
+def nome_particao(tabela, referencia_id, data):
+    """Nome da partição de uma referência (ex: valores_2025_01)"""
+    if data is None:
+        return f"{tabela}_ref_{referencia_id}"
+    return f"{tabela}_{data:%Y_%m}"
+
+def criar_particoes(cur, referencia_ids=None):
+    """Cria, nas tabelas particionadas, a partição de cada referência que ainda não tiver uma.
+
+    Cada referência tem sua própria partição (faixa [id, id + 1) de referencia_id),
+    então inserções, vacuum e consultas de um mês tocam uma única partição.
+    Sem referencia_ids, considera todas as referências. Retorna o número de partições criadas.
+    """
+    tabelas = [tabela for tabela in TABELAS_PARTICIONADAS if tabela_particionada(cur, tabela)]
+    if not tabelas:
+        return 0
+
+    if referencia_ids is None:
+        cur.execute("SELECT id, data FROM referencias")
+    else:
+        cur.execute("SELECT id, data FROM referencias WHERE id = ANY(%s)", (list(referencia_ids),))
+    referencias = cur.fetchall()
+
+    criadas = 0
+    for tabela in tabelas:
+        # Referências que já têm partição nesta tabela
+        cur.execute("""
+            SELECT pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+        """, (tabela,))
+        limites = {row[0] for row in cur.fetchall()}
+
+        for referencia_id, data in referencias:
+            limite = f"FOR VALUES FROM ({referencia_id}) TO ({referencia_id + 1})"
+            if limite in limites:
+                continue
+            particao = nome_particao(tabela, referencia_id, data)
+            cur.execute(sql.SQL("CREATE TABLE {particao} PARTITION OF {tabela} FOR VALUES FROM (%s) TO (%s)").format(
+                particao=sql.Identifier(particao),
+                tabela=sql.Identifier(tabela)
+            ), (referencia_id, referencia_id + 1))
+            logging.info(f"Partição {particao} criada")
+            criadas += 1
+    return criadas
@@ -0,0 +1,176 @@
+import logging
+import math
+import time
+from collections import defaultdict
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+import config
+import metricas
+
+# Tempos de cada espera (em segundos), agrupados pelo nome da espera
+TEMPOS_ESPERA = defaultdict(list)
+
+# Conta as requisições XHR pendentes e concluídas da página. Também considera
+# o jQuery.active, usado pelo site da FIPE, caso o monitor tenha sido instalado
+# depois de alguma requisição já ter sido disparada.
+SCRIPT_MONITOR_XHR = """
+if (!window.__fipeMonitor) {
+    window.__fipeMonitor = true;
+    window.__fipePendentes = 0;
+    window.__fipeConcluidas = 0;
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function() {
+        window.__fipePendentes++;
+        this.addEventListener('loadend', function() {
+            window.__fipePendentes--;
+            window.__fipeConcluidas++;
+        });
+        return send.apply(this, arguments);
+    };
+}
+"""
+
+SCRIPT_ESTADO_XHR = """
+var jq = (window.jQuery && window.jQuery.active) || 0;
+return [Math.max(window.__fipePendentes || 0, jq), window.__fipeConcluidas || 0];
+"""
+
+# Lê todas as opções de um select de uma vez, como [código, texto]; ler cada
+# option pelo WebDriver custaria uma requisição ao navegador por opção
+SCRIPT_OPCOES = """
+var select = document.getElementById(arguments[0]);
+if (!select) { return null; }
+var opcoes = [];
+for (var i = 0; i < select.options.length; i++) {
+    var texto = select.options[i].text.trim();
+    if (texto) { opcoes.push([select.options[i].value, texto]); }
+}
+return opcoes;
+"""
+
+# Select já preenchido, mas só com opções sem texto (o placeholder): a lista veio vazia
+SCRIPT_SO_PLACEHOLDER = """
+var select = document.getElementById(arguments[0]);
+if (!select || !select.options.length) { return false; }
+for (var i = 0; i < select.options.length; i++) {
+    if (select.options[i].text.trim()) { return false; }
+}
+return true;
+"""
+
+SCRIPT_CODIGO_OPCAO = """
+var select = document.getElementById(arguments[0]);
+if (!select) { return null; }
+for (var i = 0; i < select.options.length; i++) {
+    if (select.options[i].text.trim() === arguments[1]) {
+        return [select.options[i].value, select.options[i].selected];
+    }
+}
+return null;
+"""
+
+def instalar_monitor_xhr(driver):
+    """Instala na página o contador de requisições XHR pendentes"""
+    try:
+        # Também registra o script para as próximas navegações
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': SCRIPT_MONITOR_XHR})
+    except Exception:
+        pass
+    driver.execute_script(SCRIPT_MONITOR_XHR)
+
+def estado_xhr(driver):
+    """Retorna (pendentes, concluídas) das requisições XHR da página"""
+    pendentes, concluidas = driver.execute_script(SCRIPT_ESTADO_XHR)
+    return pendentes, concluidas
+
+def opcoes_select(driver, select_id):
+    """Retorna as opções (código, texto) de um select em uma única chamada (None se não existir)"""
+    opcoes = driver.execute_script(SCRIPT_OPCOES, select_id)
+    return None if opcoes is None else [(codigo, texto) for codigo, texto in opcoes]
+
+def so_placeholder(driver, select_id):
+    """Indica se o select tem apenas o placeholder (nenhuma opção com texto)"""
+    return driver.execute_script(SCRIPT_SO_PLACEHOLDER, select_id)
+
+def codigo_opcao(driver, select_id, texto):
+    """Retorna (código, selecionada) da opção com o texto informado em uma única chamada (None se não existir)"""
+    opcao = driver.execute_script(SCRIPT_CODIGO_OPCAO, select_id, texto)
+    return None if opcao is None else tuple(opcao)
+
+def registrar_espera(nome, segundos):
+    """Registra a duração de uma espera"""
+    TEMPOS_ESPERA[nome].append(segundos)
+    metricas.observar('fipe_espera_segundos', segundos, espera=nome)
+
+def aguardar(driver, condicao, nome, timeout=None):
+    """Aguarda a condição ser verdadeira, com limite de SELENIUM_CONFIG['timeout'] segundos"""
+    timeout = timeout or config.SELENIUM_CONFIG['timeout']
+    inicio = time.perf_counter()
+    try:
+        resultado = WebDriverWait(driver, timeout, poll_frequency=0.05).until(condicao)
+    except TimeoutException:
+        registrar_espera(f"{nome} (timeout)", time.perf_counter() - inicio)
+        raise
+    registrar_espera(nome, time.perf_counter() - inicio)
+    return resultado
+
+def aguardar_xhr_ociosas(driver, nome='xhr_ociosas', timeout=None):
+    """Aguarda não haver nenhuma requisição XHR pendente na página"""
+    return aguardar(driver, lambda d: estado_xhr(d)[0] == 0, nome, timeout)
+
+def aguardar_opcoes(driver, select_id, nome='opcoes', timeout=None):
+    """Aguarda o select ter opções carregadas e não haver XHR pendente; retorna as opções.
+
+    Se alguma XHR já foi concluída e o select só tem o placeholder, a lista veio
+    vazia e [] é retornado sem esperar o timeout.
+    """
+    # O WebDriverWait só para em valores verdadeiros, então as opções vão em uma tupla
+    def carregado(d):
+        opcoes = opcoes_select(d, select_id)
+        if opcoes is None:
+            return False
+        pendentes, concluidas = estado_xhr(d)
+        if pendentes:
+            return False
+        if opcoes:
+            return (opcoes,)
+        return ([],) if concluidas and so_placeholder(d, select_id) else False
+    return aguardar(driver, carregado, nome, timeout)[0]
+
+def aguardar_atualizacao_select(driver, select_id, opcoes_anteriores, concluidas_antes, nome='atualizacao_select', timeout=None):
+    """Aguarda o select ser recarregado após uma ação na página.
+
+    Considera pronto quando as opções mudaram ou quando uma nova requisição XHR
+    foi concluída (a lista pode ser idêntica à anterior) e não há outra pendente.
+    Retorna as opções do select ([] se a nova requisição deixou só o placeholder).
+    """
+    def atualizado(d):
+        pendentes, concluidas = estado_xhr(d)
+        if pendentes:
+            return False
+        opcoes = opcoes_select(d, select_id)
+        if opcoes is None:
+            return False
+        if not opcoes:
+            return ([],) if concluidas > concluidas_antes and so_placeholder(d, select_id) else False
+        if opcoes != opcoes_anteriores or concluidas > concluidas_antes:
+            return (opcoes,)
+        return False
+    return aguardar(driver, atualizado, nome, timeout)[0]
+
+def percentil(valores, p):
+    """Percentil p (0-100) de uma lista de valores pelo método do vizinho mais próximo"""
+    ordenados = sorted(valores)
+    indice = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+    return ordenados[indice]
+
+def resumo_esperas():
+    """Registra no log a distribuição dos tempos de espera"""
+    for nome, tempos in sorted(TEMPOS_ESPERA.items()):
+        if not tempos:
+            continue
+        logging.info(
+            f"Espera '{nome}': {len(tempos)} ocorrências, "
+            f"p50={percentil(tempos, 50):.3f}s p90={percentil(tempos, 90):.3f}s "
+            f"p99={percentil(tempos, 99):.3f}s máx={max(tempos):.3f}s total={sum(tempos):.1f}s"
+        )
@@ -0,0 +1,68 @@
+import base64
+import json
+from urllib.parse import parse_qs
+import fipe_http
+import prontidao
+
+# Opções do Chrome que registram os eventos de rede no log de desempenho
+# (goog:loggingPrefs), sem os eventos de página, que não são usados
+PREFERENCIAS_LOG = {'performance': 'ALL'}
+PREFERENCIAS_DESEMPENHO = {'enableNetwork': True, 'enablePage': False}
+
+def eventos(driver):
+    """Eventos (método, parâmetros) registrados no log de desempenho desde a última leitura"""
+    for entrada in driver.get_log('performance'):
+        mensagem = json.loads(entrada['message'])['message']
+        yield mensagem['method'], mensagem.get('params', {})
+
+def descartar_eventos(driver):
+    """Descarta os eventos já registrados, para considerar só as requisições feitas daqui em diante"""
+    driver.get_log('performance')
+
+def confere_parametros(corpo, dados):
+    """Indica se o corpo (form-urlencoded) da requisição tem os parâmetros em dados"""
+    if not dados:
+        return True
+    parametros = {chave: valores[0] for chave, valores in parse_qs(corpo or '').items()}
+    return all(parametros.get(chave) == str(valor) for chave, valor in dados.items())
+
+def corpo_resposta(driver, endpoint, request_id):
+    """JSON da resposta já recebida pelo Chrome"""
+    resposta = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+    corpo = resposta['body']
+    if resposta.get('base64Encoded'):
+        corpo = base64.b64decode(corpo).decode('utf-8')
+    return fipe_http.verificar_erro(endpoint, json.loads(corpo))
+
+def aguardar_resposta(driver, endpoint, dados=None, nome=None, timeout=None):
+    """Aguarda a página receber a resposta de um endpoint da API (ex: ConsultarMarcas) e retorna o JSON.
+
+    Considera só as requisições registradas depois de descartar_eventos() cujo corpo
+    tem os parâmetros em dados (ex: o código da referência). Retorna assim que o
+    Chrome termina de receber a resposta, com os códigos e os nomes, sem ler o DOM.
+    """
+    caminho = f"/api/veiculos/{endpoint}"
+    # Status HTTP de cada requisição ao endpoint (None até a resposta chegar)
+    requisicoes = {}
+
+    def recebida(d):
+        for metodo, parametros in eventos(d):
+            request_id = parametros.get('requestId')
+            if metodo == 'Network.requestWillBeSent':
+                requisicao = parametros['request']
+                if caminho in requisicao['url'] and confere_parametros(requisicao.get('postData'), dados):
+                    requisicoes[request_id] = None
+            elif request_id not in requisicoes:
+                continue
+            elif metodo == 'Network.responseReceived':
+                requisicoes[request_id] = parametros['response']['status']
+            elif metodo == 'Network.loadingFailed':
+                raise fipe_http.ErroFipe(f"{endpoint}: {parametros.get('errorText')}")
+            elif metodo == 'Network.loadingFinished':
+                if requisicoes[request_id] != 200:
+                    raise fipe_http.ErroFipe(f"{endpoint}: HTTP {requisicoes[request_id]}")
+                # Em lista, pois uma resposta vazia encerraria a espera como falsa
+                return [corpo_resposta(d, endpoint, request_id)]
+        return False
+
+    return prontidao.aguardar(driver, recebida, nome or endpoint, timeout)[0]
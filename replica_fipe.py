@@ -0,0 +1,274 @@
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+from conversoes import MESES
+from fipe_http import CODIGOS_TIPO_VEICULO
+
+PREFIXO_API = '/api/veiculos/'
+
+NOMES_MESES = list(MESES)
+COMBUSTIVEIS = {1: 'Gasolina', 2: 'Álcool', 3: 'Diesel'}
+
+# Página com os mesmos elementos usados pelos scripts em Selenium: abas com data-slug,
+# selects selectTabelaReferencia{tipo} e selectMarca{tipo} preenchidos por XHR
+PAGINA = """<!DOCTYPE html>
+<html lang="pt-br">
+<head><meta charset="utf-8"><title>Réplica da Tabela FIPE</title></head>
+<body>
+<div class="tab-veiculos"><ul>
+{abas}
+</ul></div>
+{selects}
+<script>
+function consultar(endpoint, dados, retorno) {{
+    var xhr = new XMLHttpRequest();
+    xhr.open('POST', '{prefixo}' + endpoint);
+    xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+    xhr.onload = function() {{ if (xhr.status === 200) {{ retorno(JSON.parse(xhr.responseText)); }} }};
+    xhr.send(new URLSearchParams(dados).toString());
+}}
+function preencher(select, opcoes) {{
+    select.innerHTML = '<option value=""></option>';
+    opcoes.forEach(function(opcao) {{
+        var elemento = document.createElement('option');
+        elemento.value = opcao[0];
+        elemento.text = opcao[1];
+        select.appendChild(elemento);
+    }});
+}}
+var CODIGOS = {codigos};
+function carregarMarcas(tipo) {{
+    var referencia = document.getElementById('selectTabelaReferencia' + tipo);
+    consultar('ConsultarMarcas', {{codigoTabelaReferencia: referencia.value, codigoTipoVeiculo: CODIGOS[tipo]}}, function(marcas) {{
+        preencher(document.getElementById('selectMarca' + tipo), marcas.map(function(m) {{ return [m.Value, m.Label]; }}));
+    }});
+}}
+document.querySelectorAll('div.tab-veiculos a').forEach(function(aba) {{
+    aba.addEventListener('click', function(evento) {{
+        evento.preventDefault();
+        var tipo = aba.getAttribute('data-slug');
+        consultar('ConsultarTabelaDeReferencia', {{}}, function(tabela) {{
+            var select = document.getElementById('selectTabelaReferencia' + tipo);
+            select.innerHTML = '';
+            tabela.forEach(function(item) {{
+                var elemento = document.createElement('option');
+                elemento.value = item.Codigo;
+                elemento.text = item.Mes;
+                select.appendChild(elemento);
+            }});
+            carregarMarcas(tipo);
+        }});
+    }});
+}});
+document.querySelectorAll('select[id^="selectTabelaReferencia"]').forEach(function(select) {{
+    select.addEventListener('change', function() {{ carregarMarcas(select.id.replace('selectTabelaReferencia', '')); }});
+}});
+</script>
+</body>
+</html>
+"""
+
+class DadosReplica:
+    """Tabela FIPE sintética e determinística: mesma semente, mesmas referências, marcas e preços"""
+
+    def __init__(self, referencias=6, marcas=40, modelos=5, anos=3, semente=1, ultimo_mes=(2024, 12)):
+        self.semente = semente
+        self.quantidade_marcas = marcas
+        self.quantidade_modelos = modelos
+        self.quantidade_anos = anos
+
+        # Referências da mais recente para a mais antiga, como no site
+        self.referencias = []
+        ano, mes = ultimo_mes
+        for indice in range(referencias):
+            self.referencias.append({'Codigo': 400 - indice, 'Mes': f"{NOMES_MESES[mes - 1]}/{ano} "})
+            mes -= 1
+            if mes == 0:
+                ano, mes = ano - 1, 12
+
+    def marcas(self, tipo_veiculo):
+        return [{'Label': f"Marca {tipo_veiculo} {codigo:03d}", 'Value': str(codigo)}
+                for codigo in range(1, self.quantidade_marcas + 1)]
+
+    def modelos(self, codigo_marca):
+        inicio = int(codigo_marca) * 1000
+        return {
+            'Modelos': [{'Label': f"Modelo {codigo}", 'Value': codigo}
+                        for codigo in range(inicio, inicio + self.quantidade_modelos)],
+            # Como na FIPE, os anos de todos os modelos da marca
+            'Anos': sorted({ano['Value']: ano for codigo in range(inicio, inicio + self.quantidade_modelos)
+                            for ano in self.anos(codigo)}.values(), key=lambda ano: ano['Value'], reverse=True)
+        }
+
+    def anos(self, codigo_modelo):
+        anos = []
+        for indice in range(self.quantidade_anos):
+            ano = 2024 - indice
+            combustivel = 1 + (int(codigo_modelo) + indice) % len(COMBUSTIVEIS)
+            anos.append({'Label': f"{ano} {COMBUSTIVEIS[combustivel]}", 'Value': f"{ano}-{combustivel}"})
+        return anos
+
+    def valor(self, dados):
+        # O preço depende só da consulta, então é o mesmo em todas as execuções
+        gerador = random.Random(f"{self.semente}|{sorted(dados.items())}")
+        reais = gerador.randint(8000, 400000)
+        mes = next((r['Mes'].strip() for r in self.referencias if str(r['Codigo']) == dados.get('codigoTabelaReferencia')), '')
+        return {
+            'Valor': f"R$ {reais:,}".replace(',', '.') + ',00',
+            'Marca': f"Marca {dados.get('codigoMarca')}",
+            'Modelo': f"Modelo {dados.get('codigoModelo')}",
+            'AnoModelo': int(dados.get('anoModelo', 0)),
+            'Combustivel': COMBUSTIVEIS.get(int(dados.get('codigoTipoCombustivel', 1)), ''),
+            'CodigoFipe': f"{int(dados.get('codigoMarca', 0)):03d}{int(dados.get('codigoModelo', 0)) % 1000:03d}-1",
+            'MesReferencia': mes,
+            'TipoVeiculo': int(dados.get('codigoTipoVeiculo', 1)),
+            'SiglaCombustivel': COMBUSTIVEIS.get(int(dados.get('codigoTipoCombustivel', 1)), ' ')[0]
+        }
+
+    def responder(self, endpoint, dados):
+        """Resposta JSON de um endpoint (None se o endpoint não existir)"""
+        tipos = {str(codigo): tipo for tipo, codigo in CODIGOS_TIPO_VEICULO.items()}
+        if endpoint == 'ConsultarTabelaDeReferencia':
+            return self.referencias
+        if endpoint == 'ConsultarMarcas':
+            return self.marcas(tipos.get(dados.get('codigoTipoVeiculo'), 'carro'))
+        if endpoint == 'ConsultarModelos':
+            return self.modelos(dados.get('codigoMarca', 0))
+        if endpoint == 'ConsultarAnoModelo':
+            return self.anos(dados.get('codigoModelo', 0))
+        if endpoint == 'ConsultarValorComTodosParametros':
+            return self.valor(dados)
+        return None
+
+class ReplicaFipeHandler(BaseHTTPRequestHandler):
+    """Serve a página e os endpoints JSON da réplica com latência e erros configuráveis"""
+
+    dados = None
+    latencia = 0.0
+    variacao = 0.0
+    taxa_erros = 0.0
+    taxa_vazias = 0.0
+    aleatorio = random.Random(1)
+    lock = threading.Lock()
+    contadores = {'requisicoes': 0, 'erros': 0, 'vazias': 0}
+
+    def _sortear(self):
+        with self.lock:
+            self.contadores['requisicoes'] += 1
+            atraso = max(0.0, self.latencia + self.aleatorio.uniform(-self.variacao, self.variacao))
+            sorteio = self.aleatorio.random()
+        return atraso, sorteio
+
+    def _responder(self, status, conteudo, tipo):
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/index.html'):
+            self.send_error(404)
+            return
+        abas = '\n'.join(
+            f'<li class="ilustra"><a href="#" data-slug="{tipo}">{tipo}</a></li>' for tipo in CODIGOS_TIPO_VEICULO
+        )
+        selects = '\n'.join(
+            f'<select id="selectTabelaReferencia{tipo}" style="display: none"></select>'
+            f'<select id="selectMarca{tipo}"></select>' for tipo in CODIGOS_TIPO_VEICULO
+        )
+        pagina = PAGINA.format(abas=abas, selects=selects, prefixo=PREFIXO_API, codigos=json.dumps(CODIGOS_TIPO_VEICULO))
+        self._responder(200, pagina.encode('utf-8'), 'text/html; charset=utf-8')
+
+    def do_POST(self):
+        if not self.path.startswith(PREFIXO_API):
+            self.send_error(404)
+            return
+        endpoint = self.path[len(PREFIXO_API):]
+        tamanho = int(self.headers.get('Content-Length', 0))
+        dados = dict(parse_qsl(self.rfile.read(tamanho).decode('utf-8'), keep_blank_values=True))
+
+        atraso, sorteio = self._sortear()
+        time.sleep(atraso)
+        if sorteio < self.taxa_erros:
+            with self.lock:
+                self.contadores['erros'] += 1
+            self.send_error(500)
+            return
+
+        resposta = self.dados.responder(endpoint, dados)
+        if resposta is None:
+            self.send_error(404)
+            return
+        if endpoint == 'ConsultarMarcas' and sorteio < self.taxa_erros + self.taxa_vazias:
+            # Lista vazia: é o que o site devolve quando está bloqueando as consultas
+            with self.lock:
+                self.contadores['vazias'] += 1
+            resposta = []
+        self._responder(200, json.dumps(resposta, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def iniciar(dados, porta=0, latencia=0.0, variacao=0.0, taxa_erros=0.0, taxa_vazias=0.0, semente=1):
+    """Inicia a réplica em uma thread; retorna o servidor (a porta escolhida fica em server_address)"""
+    ReplicaFipeHandler.dados = dados
+    ReplicaFipeHandler.latencia = latencia
+    ReplicaFipeHandler.variacao = variacao
+    ReplicaFipeHandler.taxa_erros = taxa_erros
+    ReplicaFipeHandler.taxa_vazias = taxa_vazias
+    ReplicaFipeHandler.aleatorio = random.Random(semente)
+    ReplicaFipeHandler.contadores = {'requisicoes': 0, 'erros': 0, 'vazias': 0}
+    servidor = ThreadingHTTPServer(('127.0.0.1', porta), ReplicaFipeHandler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='replica_fipe', daemon=True).start()
+    return servidor
+
+def adicionar_argumentos(parser):
+    """Opções do tamanho da tabela sintética e do comportamento da réplica"""
+    parser.add_argument('--referencias', type=int, default=6, help="Número de referências (meses)")
+    parser.add_argument('--marcas', type=int, default=40, help="Marcas por tipo de veículo")
+    parser.add_argument('--modelos', type=int, default=5, help="Modelos por marca")
+    parser.add_argument('--anos', type=int, default=3, help="Anos por modelo")
+    parser.add_argument('--latencia', type=float, default=0.02, help="Latência de cada resposta da API, em segundos")
+    parser.add_argument('--variacao', type=float, default=0.01, help="Variação aleatória (±) da latência, em segundos")
+    parser.add_argument('--taxa-erros', type=float, default=0.0, help="Fração das requisições respondidas com erro 500")
+    parser.add_argument('--taxa-vazias', type=float, default=0.05,
+                        help="Fração das consultas de marcas respondidas com lista vazia (simula bloqueio)")
+    parser.add_argument('--semente', type=int, default=1, help="Semente dos dados, da latência e dos erros")
+
+def criar_dados(args):
+    return DadosReplica(args.referencias, args.marcas, args.modelos, args.anos, args.semente)
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    parser = argparse.ArgumentParser(description="Réplica local do site da FIPE com dados sintéticos")
+    parser.add_argument('--porta', type=int, default=8766, help="Porta do servidor")
+    adicionar_argumentos(parser)
+    args = parser.parse_args()
+
+    servidor = iniciar(criar_dados(args), args.porta, args.latencia, args.variacao,
+                       args.taxa_erros, args.taxa_vazias, args.semente)
+    logging.info(f"Réplica da FIPE em http://127.0.0.1:{args.porta}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()
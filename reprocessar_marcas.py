@@ -1,12 +1,24 @@
-import psycopg2
+import argparse
+import os
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+import socket
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait, Select
+from selenium.webdriver.support.ui import Select
 from selenium.webdriver.support import expected_conditions as EC
-import time
+import cache_fipe
 import config
+import conexoes
+import diferencas
+import dimensoes
+import fipe_http
+import impressoes
+import jobs
+import limitador
+import metricas
+import navegador
+from escritor_lote import EscritorLote
+import prontidao
+import rede
 
 # Configuração do logging
 logging.basicConfig(
@@ -18,11 +30,11 @@ logging.basicConfig(
     ]
 )
 
-def carregar_referencias_falhas():
-    """Carrega as referências com falhas do arquivo"""
+def carregar_referencias_falhas(caminho):
+    """Carrega as referências com falhas de um arquivo (ref_id,referencia,tipo_veiculo)"""
     referencias = []
     try:
-        with open('referencias_sem_marcas.txt', 'r') as arquivo:
+        with open(caminho, 'r') as arquivo:
             for linha in arquivo:
                 ref_id, referencia, tipo_veiculo = linha.strip().split(',')
                 referencias.append((int(ref_id), referencia, tipo_veiculo))
@@ -33,159 +45,242 @@ def carregar_referencias_falhas():
 
 def selecionar_tipo_veiculo(driver, tipo_veiculo):
     """Seleciona o tipo de veículo na página"""
+    if isinstance(driver, fipe_http.ClienteFipe):
+        return fipe_http.selecionar_tipo_veiculo(driver, tipo_veiculo)
+
+    limitador.aguardar()
     try:
         botao = driver.find_element(By.CSS_SELECTOR, f'div.tab-veiculos ul li.ilustra a[data-slug="{tipo_veiculo}"]')
         driver.execute_script("arguments[0].click();", botao)
+        # Aguarda as referências do tipo selecionado serem carregadas
+        prontidao.aguardar_opcoes(driver, f"selectTabelaReferencia{tipo_veiculo}", nome='tipo_veiculo')
+        limitador.registrar_sucesso()
         logging.info(f"Tipo de veículo '{tipo_veiculo}' selecionado com sucesso!")
-        time.sleep(2)
         return True
     except Exception as e:
+        limitador.registrar_falha()
         logging.error(f"Erro ao selecionar tipo de veículo '{tipo_veiculo}': {str(e)}")
         return False
 
 def get_marcas_site(driver, referencia, wait, tipo_veiculo):
-    """Obtém a lista de marcas do site para uma referência e tipo de veículo"""
+    """Obtém as marcas (código, nome) do site para uma referência e tipo de veículo"""
+    if isinstance(driver, fipe_http.ClienteFipe):
+        return fipe_http.get_marcas_site(driver, referencia, wait, tipo_veiculo)
+
+    # Lista já obtida em uma execução anterior
+    consulta_cache = {'referencia': referencia, 'tipoVeiculo': tipo_veiculo}
+    marcas = cache_fipe.obter('opcoes_marcas', consulta_cache)
+    if marcas is not None:
+        marcas = [(codigo, nome) for codigo, nome in marcas]
+        logging.info(f"Encontradas {len(marcas)} marcas em cache para a referência {referencia} do tipo {tipo_veiculo}")
+        return marcas
+
     max_retries = 5
     for attempt in range(max_retries):
+        # Respeita a taxa atual e o disjuntor, compartilhados com os outros workers
+        limitador.aguardar()
         try:
             # Encontra e seleciona a referência
-            select_ref = wait.until(
-                EC.presence_of_element_located((By.ID, f"selectTabelaReferencia{tipo_veiculo}"))
-            )
+            select_ref_id = f"selectTabelaReferencia{tipo_veiculo}"
+            select_ref = wait.until(EC.presence_of_element_located((By.ID, select_ref_id)))
             driver.execute_script("arguments[0].style.display = 'block';", select_ref)
-            select = Select(select_ref)
-            select.select_by_visible_text(referencia)
-            logging.info(f"Referência {referencia} selecionada para {tipo_veiculo}")
-            
-            # Aumentado tempo de espera para 5 segundos
-            time.sleep(5)
             
-            # Encontra e obtém a lista de marcas
-            select_marcas = wait.until(
-                EC.presence_of_element_located((By.ID, f"selectMarca{tipo_veiculo}"))
-            )
-            driver.execute_script("arguments[0].style.display = 'block';", select_marcas)
-            select = Select(select_marcas)
+            # Guarda o estado do select de marcas antes da seleção; na captura de rede
+            # basta descartar os eventos anteriores
+            select_marcas_id = f"selectMarca{tipo_veiculo}"
+            captura = config.SELENIUM_CONFIG['captura_rede']
+            if captura:
+                rede.descartar_eventos(driver)
+            else:
+                marcas_anteriores = prontidao.opcoes_select(driver, select_marcas_id)
+                _, concluidas_antes = prontidao.estado_xhr(driver)
             
-            # Obtém todas as opções do select
-            options = select.options
-            marcas = []
-            
-            # Itera sobre as opções para obter o texto
-            for option in options:
-                if option.text and option.text.strip():
-                    marcas.append(option.text.strip())
+            # Código da referência e se ela já está selecionada, em uma única chamada
+            opcao = prontidao.codigo_opcao(driver, select_ref_id, referencia)
+            if opcao is None:
+                raise ValueError(f"Referência {referencia} não encontrada no select")
+            codigo_referencia, selecionada = opcao
+            if selecionada:
+                # Já selecionada: a página não dispara nova requisição
+                marcas = prontidao.aguardar_opcoes(driver, select_marcas_id, nome='marcas')
+            else:
+                with metricas.medir('fipe_etapa_segundos', etapa='selecionar_referencia'):
+                    Select(select_ref).select_by_value(codigo_referencia)
+                logging.info(f"Referência {referencia} selecionada para {tipo_veiculo}")
+                
+                if captura:
+                    # Marcas (código, nome) da resposta JSON recebida pela página, sem ler o select
+                    resposta = rede.aguardar_resposta(
+                        driver, 'ConsultarMarcas', {'codigoTabelaReferencia': codigo_referencia}, nome='marcas'
+                    )
+                    marcas = [(codigo, nome) for codigo, nome in fipe_http.ler_opcoes(resposta) if nome]
+                else:
+                    # Aguarda o carregamento das marcas (nova resposta XHR ou lista alterada)
+                    marcas = prontidao.aguardar_atualizacao_select(
+                        driver, select_marcas_id, marcas_anteriores, concluidas_antes, nome='marcas'
+                    )
             
+            if not marcas:
+                raise ValueError("A página recebeu uma lista de marcas vazia")
+            limitador.registrar_sucesso()
             logging.info(f"Encontradas {len(marcas)} marcas para a referência {referencia} do tipo {tipo_veiculo}")
+            cache_fipe.gravar('opcoes_marcas', consulta_cache, marcas, referencia)
             return marcas
             
         except Exception as e:
+            # Erro ou lista vazia: reduz a taxa (o intervalo até a nova tentativa vem do limitador)
+            limitador.registrar_falha()
             if attempt == max_retries - 1:
+                metricas.contar('fipe_erros_total', etapa='marcas_site')
                 logging.error(f"Erro ao obter marcas do site para referência {referencia} e tipo {tipo_veiculo}: {e}")
                 return []
+            metricas.contar('fipe_tentativas_total', etapa='marcas_site')
             logging.warning(f"Tentativa {attempt + 1} falhou, tentando novamente...")
-            time.sleep(5)
 
-def processar_referencia(driver, wait, cur, conn, referencia_id, referencia, tipo_veiculo):
-    """Processa uma referência específica para um tipo de veículo"""
+def processar_referencia(driver, wait, cur, escritor, indice, referencia_id, referencia, tipo_veiculo):
+    """Processa uma referência específica para um tipo de veículo; retorna a impressão das marcas"""
     logging.info(f"Processando referência: {referencia} para {tipo_veiculo}")
     
-    try:
-        # Obtém marcas do site
-        marcas = get_marcas_site(driver, referencia, wait, tipo_veiculo)
-        
-        if not marcas:
-            logging.warning(f"Nenhuma marca encontrada para a referência {referencia} do tipo {tipo_veiculo}")
-            return
-        
-        # Verifica se já existem marcas para esta referência
-        cur.execute("""
-            SELECT COUNT(*) FROM marcas 
-            WHERE referencia_id = %s AND tipo_veiculo = %s
-        """, (referencia_id, tipo_veiculo))
-        
-        count = cur.fetchone()[0]
-        if count > 0:
-            logging.info(f"Já existem {count} marcas para a referência {referencia} do tipo {tipo_veiculo}")
-            return
-        
-        # Insere as marcas no banco
-        for marca in marcas:
-            try:
-                cur.execute(
-                    "INSERT INTO marcas (nome, tipo_veiculo, referencia_id) VALUES (%s, %s, %s)",
-                    (marca, tipo_veiculo, referencia_id)
-                )
-            except psycopg2.IntegrityError:
-                # Ignora erros de chave duplicada
-                continue
-        
-        conn.commit()
-        logging.info(f"Adicionadas {len(marcas)} marcas para a referência {referencia} do tipo {tipo_veiculo}")
-        
-    except Exception as e:
-        logging.error(f"Erro ao processar referência {referencia} do tipo {tipo_veiculo}: {str(e)}")
-        conn.rollback()
+    # Obtém marcas do site
+    marcas = get_marcas_site(driver, referencia, wait, tipo_veiculo)
+    
+    if not marcas:
+        logging.warning(f"Nenhuma marca encontrada para a referência {referencia} do tipo {tipo_veiculo}")
+        raise jobs.JobFalhou("Nenhuma marca encontrada")
+    
+    nomes = [nome for _, nome in marcas]
+    impressao = (referencia_id, tipo_veiculo, impressoes.calcular_impressao(nomes), len(marcas))
+    
+    # Compara com as marcas já gravadas (índice carregado uma vez por tipo de veículo)
+    novas_marcas, removidas = indice.diferenca(cur, tipo_veiculo, referencia_id, nomes)
+    diferencas.registrar_removidas('marcas', removidas, f"a referência {referencia} do tipo {tipo_veiculo}")
+    if not novas_marcas:
+        logging.info(f"Já existem todas as {len(marcas)} marcas para a referência {referencia} do tipo {tipo_veiculo}")
+        return impressao
+    
+    # Grava as marcas novas em um único lote; duplicadas são ignoradas pelo ON CONFLICT
+    codigos = {nome: codigo for codigo, nome in marcas}
+    dims = dimensoes.marcas(tipo_veiculo, [(codigos[marca], marca) for marca in novas_marcas])
+    escritor.gravar([(marca, tipo_veiculo, referencia_id, dims[marca]) for marca in novas_marcas])
+    indice.adicionar(tipo_veiculo, referencia_id, novas_marcas)
+    logging.info(f"Adicionadas {len(novas_marcas)} marcas para a referência {referencia} do tipo {tipo_veiculo}")
+    return impressao
+
+def reivindicar_job(conn, nome_worker, inicio_execucao):
+    """Reserva o próximo job falho em uma transação própria, fora do lote de commits"""
+    with conn.cursor() as cur:
+        job = jobs.reivindicar_job(cur, 'marcas', nome_worker, status=(jobs.FALHOU,),
+                                   finalizados_antes_de=inicio_execucao)
+    conn.commit()
+    return job
+
+def parse_argumentos():
+    parser = argparse.ArgumentParser(description="Reprocessa as referências que falharam ou não retornaram marcas")
+    fipe_http.adicionar_argumentos(parser)
+    cache_fipe.adicionar_argumentos(parser)
+    metricas.adicionar_argumentos(parser)
+    parser.add_argument('--arquivo',
+                        help="Marca para reprocessamento as referências de um arquivo (ex: referencias_sem_marcas.txt)")
+    return parser.parse_args()
 
 def main():
+    args = parse_argumentos()
     try:
-        # Carrega as referências com falhas
-        referencias = carregar_referencias_falhas()
-        logging.info(f"Encontradas {len(referencias)} referências para reprocessar")
+        cache_fipe.configurar(args.cache)
+        metricas.configurar(args.metricas_porta, args.metricas_json)
         
-        if not referencias:
-            logging.info("Não há referências para reprocessar")
-            return
+        if args.engine == 'selenium':
+            # Começa a abrir o navegador enquanto consulta o banco
+            pool = navegador.PoolNavegadores(reserva=0)
+            pool.aquecer(1)
         
         # Conecta ao banco de dados
         logging.info("Conectando ao banco de dados...")
-        conn = psycopg2.connect(**config.DB_CONFIG)
+        conn = conexoes.obter()
         cur = conn.cursor()
         
-        # Configuração do Chrome
-        chrome_options = Options()
-        if config.SELENIUM_CONFIG['headless']:
-            chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options.add_argument('--window-size=1920,1080')
-        chrome_options.add_argument('--disable-gpu')
-        chrome_options.add_argument('--disable-extensions')
-        chrome_options.add_argument('--disable-infobars')
-        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
+        if args.arquivo:
+            # Carrega as referências do arquivo e as marca como falhas no controle de jobs
+            referencias = carregar_referencias_falhas(args.arquivo)
+            jobs.marcar_para_reprocessar(cur, 'marcas', [(ref_id, tipo_veiculo) for ref_id, _, tipo_veiculo in referencias])
+            conn.commit()
+        
+        # As referências a reprocessar são os jobs que falharam
+        total = jobs.contar_jobs(cur, 'marcas', jobs.FALHOU)
+        logging.info(f"Encontradas {total} referências para reprocessar")
         
-        # Inicializa o driver
-        driver = webdriver.Chrome(options=chrome_options)
+        if not total:
+            logging.info("Não há referências para reprocessar")
+            return
         
-        # Acessa a página
-        url = "https://veiculos.fipe.org.br/"
-        driver.get(url)
-        logging.info(f"Acessando a página: {url}")
+        inicio_execucao = jobs.agora(cur)
+        nome_worker = f"{socket.gethostname()}-{os.getpid()}"
         
-        # Aguarda o carregamento da página
-        wait = WebDriverWait(driver, 20)
-        wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-        time.sleep(5)
+        if args.engine == 'http':
+            # Cliente HTTP com sessão persistente; não há página a aguardar
+            sessao = driver = fipe_http.ClienteFipe(gravar_em=args.gravar)
+            wait = None
+            logging.info(f"Usando a API da FIPE em {driver.url}")
+        else:
+            # Navegador aberto em paralelo com as consultas acima
+            sessao = pool.obter()
+            driver, wait = sessao.driver, sessao.wait
         
         # Processa cada referência
+        escritor = EscritorLote(conn, 'marcas', ['nome', 'tipo_veiculo', 'referencia_id', 'dim_marca_id'])
+        # Marcas já gravadas, carregadas uma vez por tipo de veículo
+        indice = diferencas.IndiceMarcas()
+        # Os jobs concluídos são confirmados em grupos de POOL_CONFIG['commit_unidades'] (ou a cada intervalo)
+        agrupador = conexoes.AgrupadorCommits(conn)
         tipo_veiculo_atual = None
-        for ref_id, referencia, tipo_veiculo in referencias:
+        while True:
+            job = conexoes.executar(reivindicar_job, nome_worker, inicio_execucao)
+            if job is None:
+                break
+            job_id, ref_id, referencia, tipo_veiculo = job
+            
             try:
-                # Se mudou o tipo de veículo, seleciona o novo tipo
-                if tipo_veiculo != tipo_veiculo_atual:
-                    if not selecionar_tipo_veiculo(driver, tipo_veiculo):
-                        continue
-                    tipo_veiculo_atual = tipo_veiculo
-                    time.sleep(5)
-                
-                processar_referencia(driver, wait, cur, conn, ref_id, referencia, tipo_veiculo)
-                time.sleep(3)
+                agrupador.iniciar()
+                # Span da unidade (tipo de veículo, referência): agrupa os tempos do job
+                with metricas.unidade(tipo_veiculo, referencia):
+                    # Se mudou o tipo de veículo, seleciona o novo tipo
+                    if tipo_veiculo != tipo_veiculo_atual:
+                        with metricas.medir('fipe_etapa_segundos', etapa='selecionar_tipo_veiculo'):
+                            selecionado = selecionar_tipo_veiculo(driver, tipo_veiculo)
+                        if not selecionado:
+                            tipo_veiculo_atual = None
+                            raise jobs.JobFalhou(f"Erro ao selecionar tipo de veículo '{tipo_veiculo}'")
+                        tipo_veiculo_atual = tipo_veiculo
+                    
+                    with metricas.medir('fipe_etapa_segundos', etapa='processar_referencia'):
+                        impressao = processar_referencia(driver, wait, cur, escritor, indice, ref_id, referencia, tipo_veiculo)
+                    metricas.contar('fipe_itens_total', etapa='marcas')
+                jobs.concluir_jobs(cur, [job_id])
+                impressoes.salvar_impressoes(cur, [impressao])
+                agrupador.concluir(job_id)
                 
             except Exception as e:
-                logging.error(f"Erro ao processar referência {referencia} do tipo {tipo_veiculo}: {str(e)}")
-                continue
+                if not isinstance(e, jobs.JobFalhou):
+                    logging.error(f"Erro ao processar referência {referencia} do tipo {tipo_veiculo}: {str(e)}")
+                # Desfaz só o job atual; se a transação inteira for perdida, os jobs concluídos nela voltam para pendente
+                perdidos = agrupador.desfazer_unidade()
+                indice.descartar()
+                metricas.contar('fipe_erros_total', etapa='marcas')
+                jobs.falhar_job(cur, job_id, e)
+                jobs.liberar_jobs(cur, perdidos)
+                agrupador.confirmar()
+            
+            # Troca o navegador após muitas operações ou uso excessivo de memória
+            if isinstance(sessao, navegador.Navegador):
+                sessao.registrar_operacao()
+                if sessao.precisa_reciclar():
+                    sessao = pool.reciclar(sessao)
+                    driver, wait = sessao.driver, sessao.wait
+                    tipo_veiculo_atual = None
+        
+        agrupador.confirmar()
+        logging.info(f"{escritor.total_inseridas} marcas gravadas no banco")
+        jobs.resumo_jobs(cur, 'marcas')
         
         logging.info("Processo de reprocessamento concluído com sucesso!")
         
@@ -194,12 +289,20 @@ def main():
         if 'conn' in locals():
             conn.rollback()
     finally:
+        prontidao.resumo_esperas()
+        limitador.registrar_estado()
+        cache_fipe.encerrar()
+        dimensoes.encerrar()
+        metricas.encerrar()
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
-        if 'driver' in locals():
-            driver.quit()
+            conexoes.devolver(conn)
+        conexoes.encerrar()
+        if 'sessao' in locals():
+            sessao.quit()
+        if 'pool' in locals():
+            pool.encerrar()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,6 +1,8 @@
-import psycopg2
+import argparse
 import logging
-import config
+import conexoes
+import particoes
+from migracoes import aplicar_migracoes
 
 # Configuração do logging
 logging.basicConfig(
@@ -12,8 +14,11 @@ logging.basicConfig(
     ]
 )
 
-def criar_tabelas(cur):
-    """Cria as tabelas necessárias se elas não existirem"""
+def criar_tabelas(cur, particionar=False):
+    """Cria as tabelas necessárias se elas não existirem.
+
+    Com particionar=True, anos e valores são criadas particionadas por referência.
+    """
     try:
         # Tabela de referências
         cur.execute("""
@@ -48,25 +53,93 @@ def criar_tabelas(cur):
             )
         """)
         
-        # Tabela de anos
+        if particionar:
+            for tabela in particoes.TABELAS_PARTICIONADAS:
+                cur.execute("SELECT to_regclass(%s) IS NOT NULL", (tabela,))
+                if cur.fetchone()[0] and not particoes.tabela_particionada(cur, tabela):
+                    logging.warning(f"A tabela {tabela} já existe sem particionamento e será mantida assim")
+            
+            # Tabela de anos, particionada por referência (as chaves incluem referencia_id)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS anos (
+                    id SERIAL,
+                    ano VARCHAR(20) NOT NULL,
+                    modelo_id INTEGER REFERENCES modelos(id),
+                    referencia_id INTEGER NOT NULL REFERENCES referencias(id),
+                    PRIMARY KEY(id, referencia_id),
+                    UNIQUE(ano, modelo_id, referencia_id)
+                ) PARTITION BY RANGE (referencia_id)
+            """)
+            
+            # Tabela de valores, particionada por referência
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS valores (
+                    id SERIAL,
+                    valor VARCHAR(100) NOT NULL,
+                    ano_id INTEGER,
+                    referencia_id INTEGER NOT NULL REFERENCES referencias(id),
+                    PRIMARY KEY(id, referencia_id),
+                    UNIQUE(ano_id, referencia_id),
+                    FOREIGN KEY (ano_id, referencia_id) REFERENCES anos(id, referencia_id)
+                ) PARTITION BY RANGE (referencia_id)
+            """)
+        else:
+            # Tabela de anos
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS anos (
+                    id SERIAL PRIMARY KEY,
+                    ano VARCHAR(20) NOT NULL,
+                    modelo_id INTEGER REFERENCES modelos(id),
+                    referencia_id INTEGER REFERENCES referencias(id),
+                    UNIQUE(ano, modelo_id, referencia_id)
+                )
+            """)
+            
+            # Tabela de valores
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS valores (
+                    id SERIAL PRIMARY KEY,
+                    valor VARCHAR(100) NOT NULL,
+                    ano_id INTEGER REFERENCES anos(id),
+                    referencia_id INTEGER REFERENCES referencias(id),
+                    UNIQUE(ano_id, referencia_id)
+                )
+            """)
+        
+        # Controle dos jobs de extração (uma linha por unidade de trabalho)
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS anos (
+            CREATE TABLE IF NOT EXISTS scrape_jobs (
                 id SERIAL PRIMARY KEY,
-                ano VARCHAR(20) NOT NULL,
-                modelo_id INTEGER REFERENCES modelos(id),
+                chave VARCHAR(200) NOT NULL,
+                etapa VARCHAR(20) NOT NULL,
                 referencia_id INTEGER REFERENCES referencias(id),
-                UNIQUE(ano, modelo_id, referencia_id)
+                tipo_veiculo VARCHAR(20),
+                status VARCHAR(20) NOT NULL DEFAULT 'pendente',
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                ultimo_erro TEXT,
+                worker VARCHAR(100),
+                criado_em TIMESTAMP NOT NULL DEFAULT now(),
+                iniciado_em TIMESTAMP,
+                concluido_em TIMESTAMP,
+                duracao_segundos DOUBLE PRECISION,
+                UNIQUE(chave)
             )
         """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_scrape_jobs_fila
+            ON scrape_jobs (etapa, status, tipo_veiculo, referencia_id)
+        """)
         
-        # Tabela de valores
+        # Impressão digital das marcas de cada (referência, tipo de veículo), para detectar alterações
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS valores (
-                id SERIAL PRIMARY KEY,
-                valor VARCHAR(100) NOT NULL,
-                ano_id INTEGER REFERENCES anos(id),
+            CREATE TABLE IF NOT EXISTS impressoes_marcas (
                 referencia_id INTEGER REFERENCES referencias(id),
-                UNIQUE(ano_id, referencia_id)
+                tipo_veiculo VARCHAR(20) NOT NULL,
+                impressao CHAR(40) NOT NULL,
+                total_marcas INTEGER NOT NULL,
+                verificado_em TIMESTAMP NOT NULL DEFAULT now(),
+                alterado_em TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY(referencia_id, tipo_veiculo)
             )
         """)
         
@@ -76,17 +149,33 @@ def criar_tabelas(cur):
         logging.error(f"Erro ao criar tabelas: {e}")
         raise
 
+def parse_argumentos():
+    parser = argparse.ArgumentParser(description="Cria a estrutura do banco de dados e aplica as migrações")
+    parser.add_argument('--particionar', action='store_true',
+                        help="Cria as tabelas anos e valores particionadas por referência (apenas se ainda não existirem)")
+    return parser.parse_args()
+
 def main():
+    args = parse_argumentos()
     try:
         # Conecta ao banco de dados
         logging.info("Conectando ao banco de dados...")
-        conn = psycopg2.connect(**config.DB_CONFIG)
+        conn = conexoes.obter()
         cur = conn.cursor()
         
         # Cria as tabelas
-        criar_tabelas(cur)
+        criar_tabelas(cur, args.particionar)
+        conn.commit()
         
+        # Aplica as migrações pendentes (colunas tipadas, índices...)
+        aplicar_migracoes(conn)
+        
+        # Partições das referências já cadastradas (se anos e valores forem particionadas)
+        criadas = particoes.criar_particoes(cur)
         conn.commit()
+        if criadas:
+            logging.info(f"{criadas} partições criadas")
+        
         logging.info("Setup do banco de dados concluído com sucesso!")
         
     except Exception as e:
@@ -97,7 +186,8 @@ def main():
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
+            conexoes.devolver(conn)
+        conexoes.encerrar()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
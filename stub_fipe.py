@@ -0,0 +1,69 @@
+import argparse
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+from fipe_http import chave_gravacao
+
+# Configuração do logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+
+PREFIXO_API = '/api/veiculos/'
+
+class StubFipeHandler(BaseHTTPRequestHandler):
+    """Responde aos POSTs da API da FIPE com as respostas gravadas pelo ClienteFipe"""
+
+    diretorio = 'gravacoes'
+
+    def do_POST(self):
+        if not self.path.startswith(PREFIXO_API):
+            self.send_error(404)
+            return
+
+        endpoint = self.path[len(PREFIXO_API):]
+        tamanho = int(self.headers.get('Content-Length', 0))
+        corpo = self.rfile.read(tamanho).decode('utf-8')
+        dados = dict(parse_qsl(corpo, keep_blank_values=True))
+
+        caminho = os.path.join(self.diretorio, chave_gravacao(endpoint, dados))
+        if not os.path.exists(caminho):
+            logging.warning(f"Sem gravação para {endpoint} {dados}")
+            self.send_error(404)
+            return
+
+        with open(caminho, 'rb') as arquivo:
+            conteudo = arquivo.read()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que reproduz respostas gravadas da API da FIPE")
+    parser.add_argument('--diretorio', default='gravacoes', help="Diretório com as respostas gravadas")
+    parser.add_argument('--porta', type=int, default=8765, help="Porta do servidor")
+    args = parser.parse_args()
+
+    StubFipeHandler.diretorio = args.diretorio
+    servidor = ThreadingHTTPServer(('127.0.0.1', args.porta), StubFipeHandler)
+    logging.info(f"Stub da FIPE em http://127.0.0.1:{args.porta} usando {args.diretorio}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()
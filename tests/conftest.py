@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+import pytest
+
+# Os módulos do projeto ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache_fipe
+import limitador
+import replica_fipe
+import stub_fipe
+
+@pytest.fixture(autouse=True)
+def limitador_rapido(monkeypatch):
+    """Limitador novo em cada teste, sem esperas relevantes nem disjuntor, e sem cache de respostas"""
+    novo = limitador.LimitadorTaxa(taxa_inicial=1000, taxa_maxima=1000, rajada=1000, limite_falhas=1000)
+    monkeypatch.setattr(limitador, 'LIMITADOR', novo)
+    monkeypatch.setattr(cache_fipe, 'CACHE', None)
+    return novo
+
+@pytest.fixture
+def replica():
+    """Réplica da FIPE em uma porta livre; retorna (url, dados)"""
+    dados = replica_fipe.DadosReplica(referencias=2, marcas=3, modelos=2, anos=2)
+    servidor = replica_fipe.iniciar(dados, porta=0)
+    yield f"http://127.0.0.1:{servidor.server_address[1]}", dados
+    servidor.shutdown()
+    servidor.server_close()
+
+class StubComFalhas(stub_fipe.StubFipeHandler):
+    """Stub que responde 500 às primeiras `falhas` requisições e conta as recebidas"""
+
+    falhas = 0
+    requisicoes = 0
+
+    def do_POST(self):
+        StubComFalhas.requisicoes += 1
+        if StubComFalhas.requisicoes <= self.falhas:
+            self.send_error(500)
+            return
+        super().do_POST()
+
+@pytest.fixture
+def stub(tmp_path):
+    """Stub da FIPE em uma porta livre servindo as gravações de tmp_path; retorna (url, diretório, handler)"""
+    StubComFalhas.diretorio = str(tmp_path)
+    StubComFalhas.falhas = 0
+    StubComFalhas.requisicoes = 0
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), StubComFalhas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{servidor.server_address[1]}", str(tmp_path), StubComFalhas
+    servidor.shutdown()
+    servidor.server_close()
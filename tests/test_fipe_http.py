@@ -0,0 +1,145 @@
+import asyncio
+import aiohttp
+import pytest
+import cache_fipe
+import fipe_http
+
+MARCAS = [{'Label': 'Acura ', 'Value': 1}, {'Label': 'Agrale', 'Value': 2}]
+
+def gravar_marcas(diretorio, conteudo=MARCAS):
+    fipe_http.gravar_resposta(diretorio, *fipe_http.requisicao_marcas(400, 'carro'), conteudo)
+
+def test_cliente_le_respostas(replica):
+    url, dados = replica
+    cliente = fipe_http.ClienteFipe(url=url)
+    try:
+        assert cliente.consultar_tabela_referencia() == [(400, 'dezembro/2024'), (399, 'novembro/2024')]
+        assert cliente.codigo_referencia('novembro/2024') == 399
+        assert cliente.consultar_marcas(400, 'moto') == [
+            ('1', 'Marca moto 001'), ('2', 'Marca moto 002'), ('3', 'Marca moto 003')
+        ]
+        assert cliente.consultar_modelos(400, 'carro', '2') == [('2000', 'Modelo 2000'), ('2001', 'Modelo 2001')]
+        anos = cliente.consultar_ano_modelo(400, 'carro', '2', '2000')
+        assert [codigo for codigo, _ in anos] == ['2024-3', '2023-1']
+        assert anos[0][1] == '2024 Diesel'
+        valor = cliente.consultar_valor(400, 'carro', '2', '2000', '2024-3')
+        # A réplica recebe os campos do formulário como texto
+        _, formulario = fipe_http.requisicao_valor(400, 'carro', '2', '2000', '2024-3')
+        assert valor == dados.valor({campo: str(conteudo) for campo, conteudo in formulario.items()})
+        assert valor['MesReferencia'] == 'dezembro/2024'
+    finally:
+        cliente.quit()
+
+def test_cliente_async_le_respostas(replica):
+    url, _ = replica
+
+    async def consultar():
+        async with fipe_http.ClienteFipeAsync(url=url) as cliente:
+            tabela = await cliente.consultar_tabela_referencia()
+            marcas = await cliente.consultar_marcas(400, 'carro')
+            modelos, anos_marca = await cliente.consultar_modelos_anos(400, 'carro', '1')
+            anos = await cliente.consultar_ano_modelo(400, 'carro', '1', '1001')
+            valor = await cliente.consultar_valor(400, 'carro', '1', '1001', anos[0][0])
+            return tabela, marcas, modelos, anos_marca, anos, valor
+
+    tabela, marcas, modelos, anos_marca, anos, valor = asyncio.run(consultar())
+    assert tabela == [(400, 'dezembro/2024'), (399, 'novembro/2024')]
+    assert marcas[0] == ('1', 'Marca carro 001') and len(marcas) == 3
+    assert modelos == [('1000', 'Modelo 1000'), ('1001', 'Modelo 1001')]
+    # Os anos da marca são a união dos anos dos modelos dela
+    assert set(anos) <= set(anos_marca)
+    assert [codigo for codigo, _ in anos_marca] == ['2024-3', '2024-2', '2023-3', '2023-1']
+    assert valor['Valor'].startswith('R$ ') and valor['Modelo'] == 'Modelo 1001'
+
+def test_cliente_repete_apos_erro_500(stub):
+    url, diretorio, handler = stub
+    gravar_marcas(diretorio)
+    handler.falhas = 1
+    cliente = fipe_http.ClienteFipe(url=url)
+    try:
+        assert cliente.consultar_marcas(400, 'carro') == [('1', 'Acura'), ('2', 'Agrale')]
+    finally:
+        cliente.quit()
+    assert handler.requisicoes == 2
+
+def test_cliente_async_repete_apos_erro_500(stub, limitador_rapido):
+    url, diretorio, handler = stub
+    gravar_marcas(diretorio)
+    handler.falhas = 2
+
+    async def consultar():
+        async with fipe_http.ClienteFipeAsync(url=url, tentativas=3) as cliente:
+            return await cliente.consultar_marcas(400, 'carro')
+
+    assert asyncio.run(consultar()) == [('1', 'Acura'), ('2', 'Agrale')]
+    assert handler.requisicoes == 3
+    assert (limitador_rapido.falhas, limitador_rapido.sucessos) == (2, 1)
+
+def test_cliente_async_desiste_apos_as_tentativas(stub):
+    url, diretorio, handler = stub
+    gravar_marcas(diretorio)
+    handler.falhas = 10
+
+    async def consultar():
+        async with fipe_http.ClienteFipeAsync(url=url, tentativas=3) as cliente:
+            return await cliente.consultar_marcas(400, 'carro')
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(consultar())
+    assert handler.requisicoes == 3
+
+def test_resposta_com_erro_gera_erro_fipe(stub, limitador_rapido):
+    url, diretorio, _ = stub
+    requisicao = fipe_http.requisicao_valor(400, 'carro', '1', '1000', '2024-1')
+    fipe_http.gravar_resposta(diretorio, *requisicao, {'codigo': '0', 'erro': 'nadaencontrado'})
+
+    cliente = fipe_http.ClienteFipe(url=url)
+    try:
+        with pytest.raises(fipe_http.ErroFipe, match='nadaencontrado'):
+            cliente.consultar_valor(400, 'carro', '1', '1000', '2024-1')
+    finally:
+        cliente.quit()
+
+    async def consultar():
+        async with fipe_http.ClienteFipeAsync(url=url) as cliente:
+            return await cliente.consultar_valor(400, 'carro', '1', '1000', '2024-1')
+
+    with pytest.raises(fipe_http.ErroFipe, match='nadaencontrado'):
+        asyncio.run(consultar())
+    # O site respondeu normalmente: o erro da API não reduz a taxa
+    assert (limitador_rapido.falhas, limitador_rapido.sucessos) == (0, 2)
+
+def test_lista_vazia_nao_vai_para_o_cache(stub, tmp_path, monkeypatch):
+    url, diretorio, handler = stub
+    monkeypatch.setattr(cache_fipe, 'CACHE', cache_fipe.CacheRespostas(str(tmp_path / 'cache.sqlite'), ttl_historico_horas=0))
+    try:
+        # Lista vazia transitória (ex: bloqueio): o próximo cliente precisa consultar o site de novo
+        for conteudo, esperado, requisicoes in (([], [], 1), (MARCAS, [('1', 'Acura'), ('2', 'Agrale')], 2),
+                                                  (MARCAS, [('1', 'Acura'), ('2', 'Agrale')], 2)):
+            gravar_marcas(diretorio, conteudo)
+            cliente = fipe_http.ClienteFipe(url=url)
+            try:
+                assert cliente.consultar_marcas(400, 'carro') == esperado
+            finally:
+                cliente.quit()
+            # A terceira consulta já vem do cache
+            assert handler.requisicoes == requisicoes
+    finally:
+        cache_fipe.CACHE.fechar()
+
+def test_cliente_async_nao_guarda_lista_vazia(stub, tmp_path, monkeypatch):
+    url, diretorio, handler = stub
+    monkeypatch.setattr(cache_fipe, 'CACHE', cache_fipe.CacheRespostas(str(tmp_path / 'cache.sqlite'), ttl_historico_horas=0))
+    gravar_marcas(diretorio, [])
+
+    async def consultar():
+        async with fipe_http.ClienteFipeAsync(url=url) as cliente:
+            return await cliente.consultar_marcas(400, 'carro')
+
+    try:
+        assert asyncio.run(consultar()) == []
+        gravar_marcas(diretorio)
+        assert asyncio.run(consultar()) == [('1', 'Acura'), ('2', 'Agrale')]
+        assert handler.requisicoes == 2
+    finally:
+        cache_fipe.CACHE.fechar()